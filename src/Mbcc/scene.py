@@ -0,0 +1,14 @@
+"""
+Mbcc 场景图
+
+场景 (探测点 / 识别器) 与转移随识别资源一起在此注册, 坐标以 native_resolution 为准.
+"""
+from src.admin.adbHandler import BaseAutoHandler
+from src.admin.common.config_enum import ConfigApp
+from src.admin.scene.graph import SceneGraph
+
+graph = SceneGraph(ConfigApp.MBCC.name)
+
+
+class MbccAutoHandler(BaseAutoHandler):
+    scene_graph = graph
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Optional, Protocol, cast
+from typing import Optional, Protocol, cast, TYPE_CHECKING
 
 import io
 import logging
@@ -17,17 +17,26 @@ import numpy as np
 
 # import app
 
-from src.admin.utils import cvimage
+from src.admin.utils import metrics
+from src.admin.utils import tracing
 from src.admin.utils.socketutil import recvall
-from revconn import ReverseConnectionHost
-from adb_service import ADBServer, ADBDevice
-from info import ADBDeviceInfo
-from agent import ControlAgentClient
-from ..config.setting import baseSetting
+from .revconn import ReverseConnectionHost
+from .adb_service import ADBServer, ADBDevice
+from .info import ADBDeviceInfo
+from ..config.device_setting import get_device_store
+from .screenshot_cache import AdaptiveScreenshotCache
+from .input_queue import InputQueue
+from .gesture import Gesture, perform_gesture
+from .screencap_channel import PersistentScreencapChannel
 
 from ..common.config_enum import ConfigApp, EventAction, EventFlag, GroupName, KeyName, \
     ControllerCapabilities, InputMethod, ScreenshotMethod, ScreenshotTransport, AospScreencapEncoding
 
+if TYPE_CHECKING:
+    # cvimage 会导入 cv2, 仅在解码截图时才导入
+    from src.admin.utils import cvimage
+    from src.admin.utils.framebus import FrameBus
+
 logger = logging.getLogger(__name__)
 
 class AdbOperate():
@@ -45,11 +54,15 @@ class AdbOperate():
         raise NotImplementedError
     def send_text(self, text: str) -> None:
         raise NotImplementedError
+    def perform_gesture(self, gesture: Gesture) -> None:
+        """多指手势, 不支持多点触控时逐个指针依次执行"""
+        perform_gesture(self, gesture)
     def close(self) -> None:
         pass
 
 
 class _TouchEventsInputImpl(AdbOperate):
+    @tracing.traced('input.tap')
     def touch_tap(self, x: int, y: int, hold_time: float = 0) -> None:
         """
         鼠标点击操作
@@ -62,7 +75,7 @@ class _TouchEventsInputImpl(AdbOperate):
         time.sleep(hold_time)
         self.touch_event(EventAction.UP, x, y)
 
-
+    @tracing.traced('input.swipe')
     def touch_swipe(self, x0, y0, x1, y1, move_duration=1, hold_before_release=0, interpolation='linear'):
         """
         鼠标拖动操作
@@ -128,6 +141,7 @@ class _TouchEventsInputImpl(AdbOperate):
 class ShellInputAdapter(AdbOperate):
     def __init__(self, controller: ADBController, displayid):
         self.controller = controller
+        self.metrics_key = controller.metrics_key
 
         if displayid is not None and displayid != 0:
             if controller.sdk_version >= 29:
@@ -145,12 +159,15 @@ class ShellInputAdapter(AdbOperate):
         else:
             self.caps = ControllerCapabilities(0)
 
+    @tracing.traced('input.tap')
     def touch_tap(self, x, y, hold_time=0):
-        if hold_time > 0:
-            self.controller.adb.exec(f'{self.input_command} swipe {x} {y} {x} {y} {hold_time * 1000:.0f}')
-        else:
-            self.controller.adb.exec(f'{self.input_command} tap {x} {y}')
+        with metrics.timer(self.metrics_key, 'input.tap'):
+            if hold_time > 0:
+                self.controller.adb.exec(f'{self.input_command} swipe {x} {y} {x} {y} {hold_time * 1000:.0f}')
+            else:
+                self.controller.adb.exec(f'{self.input_command} tap {x} {y}')
 
+    @tracing.traced('input.swipe')
     def touch_swipe(self, x0, y0, x1, y1, move_duration=1, hold_before_release=0, interpolation='linear'):
         if self.support_motion_events:
             # use default implementation if `input motionevent` is supported
@@ -161,26 +178,32 @@ class ShellInputAdapter(AdbOperate):
                 'hold_before_release is not supported in shell mode, you may experience unexpected inertia scrolling')
         if interpolation != 'linear':
             warnings.warn('interpolation mode other than linear is not supported in shell mode')
-        self.controller.adb.exec(f'{self.input_command} swipe {x0} {y0} {x1} {y1} {move_duration * 1000:.0f}')
+        with metrics.timer(self.metrics_key, 'input.swipe'):
+            self.controller.adb.exec(f'{self.input_command} swipe {x0} {y0} {x1} {y1} {move_duration * 1000:.0f}')
 
+    @tracing.traced('input.text')
     def send_text(self, text):
         escaped_text = shlex.quote(text)
-        self.controller.adb.exec(f'{self.input_command} text {escaped_text}')
+        with metrics.timer(self.metrics_key, 'input.text'):
+            self.controller.adb.exec(f'{self.input_command} text {escaped_text}')
 
+    @tracing.traced('input.key')
     def send_key(self, keycode: int, hold_time=0.07):
-        self.controller.adb.exec(f'{self.input_command} keyevent {keycode}')
+        with metrics.timer(self.metrics_key, 'input.key'):
+            self.controller.adb.exec(f'{self.input_command} keyevent {keycode}')
 
     def touch_event(self, action: EventAction, x: int, y: int, pointer_id=0) -> None:
         if not self.support_motion_events:
             raise io.UnsupportedOperation('touch events is not available')
         if pointer_id != 0:
             raise NotImplementedError("multitouch is not supported")
-        if action == EventAction.DOWN:
-            self.controller.adb.exec(f'{self.input_command} motionevent DOWN {x} {y}')
-        elif action == EventAction.UP:
-            self.controller.adb.exec(f'{self.input_command} motionevent UP {x} {y}')
-        elif action == EventAction.MOVE:
-            self.controller.adb.exec(f'{self.input_command} motionevent MOVE {x} {y}')
+        with metrics.timer(self.metrics_key, 'input.touch'):
+            if action == EventAction.DOWN:
+                self.controller.adb.exec(f'{self.input_command} motionevent DOWN {x} {y}')
+            elif action == EventAction.UP:
+                self.controller.adb.exec(f'{self.input_command} motionevent UP {x} {y}')
+            elif action == EventAction.MOVE:
+                self.controller.adb.exec(f'{self.input_command} motionevent MOVE {x} {y}')
 
     def key_event(self, action: EventAction, keycode: int, metastate: int = 0) -> None:
         raise NotImplementedError
@@ -199,28 +222,36 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
             if displayid is not None and displayid != 0:
                 raise NotImplementedError('shell screenshot on this device does not support multi display')
         self.controller = controller
+        self.metrics_key = controller.metrics_key
+        self._nc_channel: Optional[PersistentScreencapChannel] = None
         use_encoding, use_transport = self._select_simulator_image_setting()
-        pending_impl = None
+        pending_impls = []
         if use_transport == 'adb' and use_encoding == 'raw':
-            pending_impl = self._screenshot_adb_raw
+            pending_impls.append(self._screenshot_adb_raw)
         elif use_transport == 'adb' and use_encoding == 'gzip':
-            pending_impl = self._screenshot_adb_compressed
+            pending_impls.append(self._screenshot_adb_compressed)
         elif use_transport == 'adb' and use_encoding == 'png':
-            pending_impl = self._screenshot_adb_png
+            pending_impls.append(self._screenshot_adb_png)
         elif use_transport == 'vm_network':
             if controller.device_info.nat_to_host_loopback:
-                pending_impl = self._screenshot_nc_connect
+                # 优先使用常驻连接, 不可用时每帧建立一次连接
+                pending_impls.append(self._screenshot_nc_persistent)
+                pending_impls.append(self._screenshot_nc_connect)
 
         self._impl = self._screenshot_adb_raw
         screenshot = None
-        if pending_impl is not None:
+        for pending_impl in pending_impls:
             try:
                 logger.debug('testing quirk implementation %s ', pending_impl.__name__)
                 screenshot = pending_impl()
                 self._impl = pending_impl
                 logger.debug('quirk implementation %s test passed', pending_impl.__name__)
+                break
             except:
-                logger.debug('quirk implementation failed, falling back to adb raw', exc_info=True)
+                logger.debug('quirk implementation %s failed', pending_impl.__name__, exc_info=True)
+        if self._impl != self._screenshot_nc_persistent and self._nc_channel is not None:
+            self._nc_channel.close()
+            self._nc_channel = None
 
         if screenshot is None:
             screenshot = self._impl()
@@ -234,9 +265,9 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
         """
         device_info = self.controller.device_info
         # 配置文件中读取[模拟器截图图片压缩格式]和[模拟器截图图片传输方式]
-        baseSetting.select_app(ConfigApp.BASE).select_group(GroupName.Simulator)
-        use_encoding_name = baseSetting.get(KeyName.AospScreenshotEncoding)
-        use_transport_name = baseSetting.get(KeyName.ScreenshotTransport)
+        device_config = self.controller.device_config
+        use_encoding_name = device_config.aosp_screenshot_encoding
+        use_transport_name = device_config.screenshot_transport
 
         if use_transport_name == ScreenshotTransport.auto.name \
                 and device_info.slow_adb_connection() and device_info.emulator_hypervisor:
@@ -276,10 +307,12 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
         pixels = data[hdrlen:]
         arr: np.ndarray = np.frombuffer(pixels, dtype=np.uint8)
         arr = arr.reshape((h, w, 4))
+        from src.admin.utils import cvimage
         im = cvimage.fromarray(arr, 'RGBA')
         if colorspace == 2:
             from ..imgreco.cms import p3_to_srgb_inplace
-            im = p3_to_srgb_inplace(im)
+            with metrics.timer(self.metrics_key, 'screenshot.p3'):
+                im = p3_to_srgb_inplace(im)
         return im
 
     def _decode_screencap_png(self, pngdata):
@@ -292,38 +325,50 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
             from ..imgreco.cms import srgb_profile
             ImageCms.profileToProfile(img, src_profile, srgb_profile, ImageCms.INTENT_RELATIVE_COLORIMETRIC,
                                       inPlace=True)
+        from src.admin.utils import cvimage
         return cvimage.from_pil(img)
 
     def _screenshot_adb_raw(self):
-        sock = self.controller.adb.exec_stream('screencap')
-        data = recvall(sock, 8388608, True)
-        sock.close()
+        with metrics.timer(self.metrics_key, 'screenshot.transfer'):
+            sock = self.controller.adb.exec_stream('screencap')
+            data = recvall(sock, 8388608, True)
+            sock.close()
         return self._decode_screencap(data)
 
     def _screenshot_adb_png(self):
-        sock = self.controller.adb.exec_stream('screencap -p')
-        data = recvall(sock, 8388608, True)
-        sock.close()
-        return self._decode_screencap_png(data)
+        with metrics.timer(self.metrics_key, 'screenshot.transfer'):
+            sock = self.controller.adb.exec_stream('screencap -p')
+            data = recvall(sock, 8388608, True)
+            sock.close()
+        with metrics.timer(self.metrics_key, 'screenshot.decode'):
+            return self._decode_screencap_png(data)
 
     def _screenshot_adb_compressed(self):
-        sock = self.controller.adb.exec_stream('screencap | gzip -1')
-        data = recvall(sock, 8388608, True)
-        sock.close()
-        data = zlib.decompress(data, zlib.MAX_WBITS | 16, 8388608)
+        with metrics.timer(self.metrics_key, 'screenshot.transfer'):
+            sock = self.controller.adb.exec_stream('screencap | gzip -1')
+            data = recvall(sock, 8388608, True)
+            sock.close()
+        with metrics.timer(self.metrics_key, 'screenshot.decode'):
+            data = zlib.decompress(data, zlib.MAX_WBITS | 16, 8388608)
         return self._decode_screencap(data)
 
     def _screenshot_nc_connect(self):
         nc_command = self.controller.device_info.nc_command
         nat_address = self.controller.device_info.nat_to_host_loopback
         rch = ReverseConnectionHost.get_instance()
-        future = rch.register_cookie()
-        with self.controller.adb.exec_stream(
-                f'(echo {future.cookie.decode()}; screencap) | {nc_command} {nat_address} {rch.port}'):
-            with future.result(10) as sock:
-                data = recvall(sock, 8388608, True)
+        future = rch.register_cookie(newline=True)
+        with metrics.timer(self.metrics_key, 'screenshot.transfer'):
+            with self.controller.adb.exec_stream(
+                    f'(echo {future.cookie.decode()}; screencap) | {nc_command} {nat_address} {rch.port}'):
+                with future.result(10) as sock:
+                    data = recvall(sock, 8388608, True)
         return self._decode_screencap(data)
 
+    def _screenshot_nc_persistent(self):
+        if self._nc_channel is None:
+            self._nc_channel = PersistentScreencapChannel(self.controller)
+        return self._decode_screencap(self._nc_channel.capture())
+
     def _screenshot_nc_listen(self):
         address = self.controller.device_info.host_l2_reachable
         with self.controller.adb.exec_stream(f'screencap | nc -l -p {self._listen_port}'):
@@ -334,15 +379,26 @@ class ShellScreenshotAdapter(ScreenshotProtocol):
         return self._decode_screencap(data)
 
     def screenshot(self):
-        return self._impl()
+        with metrics.timer(self.metrics_key, 'screenshot'):
+            return self._impl()
+
+    def close(self) -> None:
+        if self._nc_channel is not None:
+            self._nc_channel.close()
+            self._nc_channel = None
 
 
 class AahAgentClientAdapter(_TouchEventsInputImpl, ScreenshotProtocol):
     def __init__(self, controller: ADBController, displayid):
         self.controller = controller
+        self.metrics_key = controller.metrics_key
         self.displayid = displayid
         self.display_connected = False
-        self.client = ControlAgentClient(controller.adb, displayid)
+        # aah-agent 依赖 lz4, 仅在启用时导入
+        from .agent import acquire_shared_client
+        # 同一设备的多个显示器共用一个 aah-agent 进程
+        self._shared_client = acquire_shared_client(controller.adb)
+        self.client = self._shared_client.display(displayid or 0)
         self.compress = controller.device_config.aah_agent_compress
         self.connection_types = {'input': 'adb'}
 
@@ -358,7 +414,7 @@ class AahAgentClientAdapter(_TouchEventsInputImpl, ScreenshotProtocol):
     def open_screenshot_connection(self):
         logger.debug('opening aah-agent screenshot connection')
         try:
-            if self.controller.device_config.screenshot_transport != 'adb':
+            if self.controller.device_config.screenshot_transport != ScreenshotTransport.adb.name:
                 if loopback := self.controller.device_info.nat_to_host_loopback:
                     logger.debug('applying nat_to_host_loopback quirk')
                     rch = ReverseConnectionHost.get_instance()
@@ -386,26 +442,38 @@ class AahAgentClientAdapter(_TouchEventsInputImpl, ScreenshotProtocol):
     def get_screenshot_capabilities(self) -> ControllerCapabilities:
         return ControllerCapabilities.SCREENSHOT_TIMESTAMP
 
-    def touch_event(self, action: EventAction, x: int, y: int, pointer_id=0) -> None:
-        return self.client.touch_event(action, x, y, pointer_id)
+    def touch_event(self, action: EventAction, x: int, y: int, pointer_id=0, flags: EventFlag = 0) -> None:
+        with metrics.timer(self.metrics_key, 'input.touch'):
+            return self.client.touch_event(action, x, y, pointer_id, flags=flags)
+
+    def batch_event(self):
+        return self.client.batch_event()
 
     def key_event(self, action: EventAction, keycode: int, metastate: int = 0) -> None:
-        return self.client.key_event(action, keycode, metastate)
+        with metrics.timer(self.metrics_key, 'input.key_event'):
+            return self.client.key_event(action, keycode, metastate)
 
+    @tracing.traced('input.key')
     def send_key(self, keycode: int, metastate: int = 0) -> None:
-        return self.client.send_key(keycode, metastate)
+        with metrics.timer(self.metrics_key, 'input.key'):
+            return self.client.send_key(keycode, metastate)
 
+    @tracing.traced('input.text')
     def send_text(self, text: str) -> None:
-        return self.client.send_text(text)
+        with metrics.timer(self.metrics_key, 'input.text'):
+            return self.client.send_text(text)
 
     def screenshot(self) -> cvimage.Image:
-        wrapped_img = self.client.screenshot(compress=self.compress, srgb=True)
+        with metrics.timer(self.metrics_key, 'screenshot'):
+            wrapped_img = self.client.screenshot(compress=self.compress, srgb=True)
         return wrapped_img.image
 
     def close(self) -> None:
         if self.client is not None:
+            from .agent import release_shared_client
             self.client.close()
             self.client = None
+            release_shared_client(self._shared_client)
 
 
 def _check_invalid_screenshot(image: cvimage.Image):
@@ -416,7 +484,7 @@ def _check_invalid_screenshot(image: cvimage.Image):
 
 class ADBController:
     def __init__(self, device: ADBDevice, display_id: Optional[int] = None, preload_device_info: dict = {},
-                 override_identifier: Optional[str] = None):
+                 override_identifier: Optional[str] = None, config_app: ConfigApp = ConfigApp.BASE):
         """
         Creates a new ADBController instance.
 
@@ -424,8 +492,11 @@ class ADBController:
         :param display_id: the display id to use for the device, if not specified, the default display id is used
         :param preload_quirks: quirks to preload, preloaded quirks won't be cheked again
         :param override_identifier: overrides the device identifier for quirks store, useful for custom enumerators
+        :param config_app: application whose settings are layered between the base and the per-device settings
         """
         self.adb = device
+        # 同一设备的 adb / aah-agent / 截图 / 输入指标统一以 adb 序列号为键
+        self.metrics_key = device.serial
         self.display_id = display_id
         sdk_version_str = self.adb.exec('getprop ro.build.version.sdk').strip()
         try:
@@ -433,23 +504,27 @@ class ADBController:
         except ValueError:
             self.sdk_version = 19
         self.device_identifier = override_identifier or self._get_device_identifier()
+        # 基础配置 -> 应用配置 -> 设备配置
+        self.device_config = get_device_store().device_config(self.device_identifier, config_app)
         # 更新驱动信息
         self._probe_quirks(preload_device_info)
 
         self.input = None
         self._screenshot_adapter = None
 
-        self._last_screenshot = None
-        self._last_screenshot_expire = 0
-        baseSetting.select_app(ConfigApp.BASE).select_group(GroupName.Simulator)
+        self._input_queue: Optional[InputQueue] = None
+        self._screenshot_cache = AdaptiveScreenshotCache(self._capture, lambda: self.device_config.screenshot_rate_limit)
+        # 截图发布到共享内存，供其他进程读取
+        self.frame_bus: Optional[FrameBus] = None
 
-        if baseSetting.get(KeyName.InputMethod) == InputMethod.aah_agent.name \
-                or baseSetting.get(KeyName.ScreenshotMethod) == ScreenshotMethod.aah_agent.name:
+        use_agent_input = self.device_config.input_method == InputMethod.aah_agent.name
+        use_agent_screenshot = self.device_config.screenshot_method == ScreenshotMethod.aah_agent.name
+        if use_agent_input or use_agent_screenshot:
             try:
                 agent_client = AahAgentClientAdapter(self, self.display_id)
-                if self.device_config.input_method == 'aah-agent':
+                if use_agent_input:
                     self.input = agent_client
-                if self.device_config.screenshot_method == 'aah-agent':
+                if use_agent_screenshot:
                     try:
                         # raise RuntimeError
                         agent_client.open_screenshot_connection()
@@ -461,6 +536,8 @@ class ADBController:
                                            exc_info=True)
                         else:
                             logger.warning('当前设备不支持 aah-agent 截图。如果设备显示卡死，请重启设备并在设置中关闭 aah-agent 截图。', exc_info=True)
+                        # 只对当前设备关闭 aah-agent 截图
+                        self.device_config.set(KeyName.ScreenshotMethod, ScreenshotMethod.aosp_screencap.name)
                         self.device_config.save()
                     except:
                         logger.debug('failed to open aah-agent screenshot connection', exc_info=True)
@@ -503,21 +580,33 @@ class ADBController:
     def capabilities(self) -> ControllerCapabilities:
         return self.input.get_input_capabilities() | self._screenshot_adapter.get_screenshot_capabilities()
 
-    def screenshot(self, cached: bool = True) -> cvimage.Image:
-        rate_limit = app.config.device.screenshot_rate_limit
-        if rate_limit == 0:
-            return self._screenshot_adapter.screenshot()
-        t0 = time.perf_counter()
-        if not cached or self._last_screenshot is None or t0 > self._last_screenshot_expire:
-            self._last_screenshot = self._screenshot_adapter.screenshot()
-            t1 = time.perf_counter()
-            if rate_limit == -1:
-                self._last_screenshot_expire = t1 + (t1 - t0)
-            else:
-                self._last_screenshot_expire = t0 + (1 / rate_limit)
-        return self._last_screenshot
+    @tracing.traced('screenshot')
+    def screenshot(self, cached: bool = True, max_age: Optional[float] = None) -> cvimage.Image:
+        """
+        Take a screenshot, or reuse a recent one.
+
+        :param cached:  allow returning a cached screenshot, see :class:`AdaptiveScreenshotCache`
+        :param max_age: accept a cached screenshot no older than this many seconds
+        """
+        return self._screenshot_cache.get(cached, max_age)
+
+    def _capture(self) -> cvimage.Image:
+        with tracing.span('screenshot.capture', adapter=self._screenshot_adapter.__class__.__name__):
+            image = self._screenshot_adapter.screenshot()
+        if self.frame_bus is not None:
+            self.frame_bus.publish(image)
+        return image
+
+    @property
+    def input_queue(self) -> InputQueue:
+        """asynchronous input, every call returns a future completed after the event is delivered"""
+        if self._input_queue is None:
+            self._input_queue = InputQueue(self.input, self.metrics_key, f'input-queue-{self.device_identifier}')
+        return self._input_queue
 
     def close(self):
+        if self._input_queue is not None:
+            self._input_queue.close()
         self.input.close()
         self._screenshot_adapter.close()
 
@@ -8,6 +8,7 @@ import socket
 import os
 import numpy as np
 import contextlib
+from src.admin.utils import metrics
 from src.admin.utils.sys_utils import find_adb_from_android_sdk
 from src.admin.utils.socket_util import recvexactly, recvall
 
@@ -118,12 +119,12 @@ class ADBServer:
         address = f'{self.address[0]}:{self.address[1]}'
         return f'{self.__class__.__name__}({address!r})'
 
-    def create_session(self):
+    def create_session(self, metrics_key=None):
         ensure_adb_alive(self)
-        return self._create_session_nocheck()
+        return self._create_session_nocheck(metrics_key)
 
-    def _create_session_nocheck(self):
-        return ADBClientSession(server=self.address)
+    def _create_session_nocheck(self, metrics_key=None):
+        return ADBClientSession(server=self.address, metrics_key=metrics_key)
 
     def service(self, cmd: str, timeout: Optional[float] = None):
         """make a service request to ADB server, consult ADB sources for available services"""
@@ -193,12 +194,12 @@ class ADBDevice:
         if self.serial is not None:
             session = self._create_session_retry()
         else:
-            session = self.server.create_session()
+            session = self.server.create_session(self.serial)
             session.service('host:transport-any')
         return session
 
     def _create_session_retry(self, retry_count=0):
-        session = self.server.create_session()
+        session = self.server.create_session(self.serial)
         try:
             session.service('host:transport:' + self.serial)
             return session
@@ -225,9 +226,11 @@ class ADBDevice:
         """run command in device, returns stdout content after the command exits"""
         if len(cmd) == 0:
             raise ValueError('no command specified for blocking exec')
-        sock = self.exec_stream(cmd)
-        data = recvall(sock)
-        sock.close()
+        with metrics.timer(self.serial, 'adb.exec'):
+            sock = self.exec_stream(cmd)
+            data = recvall(sock)
+            sock.close()
+        metrics.count(self.serial, 'adb.exec.bytes', len(data))
         return data
 
     def shell_stream(self, cmd=''):
@@ -305,12 +308,17 @@ class ADBControllerTarget:
 
 
 class ADBClientSession:
-    def __init__(self, server=None, timeout=None):
+    def __init__(self, server=None, timeout=None, metrics_key=None):
+        """
+        :param metrics_key: device serial the session is for, sessions to the server itself are keyed by its address
+        """
         if server is None:
             server = ('127.0.0.1', 5037)
         if server[0] == '127.0.0.1' or server[0] == '::1':
             timeout = 0.5
-        sock = socket.create_connection(server, timeout=timeout)
+        self.metrics_key = metrics_key or f'{server[0]}:{server[1]}'
+        with metrics.timer(self.metrics_key, 'adb.connect'):
+            sock = socket.create_connection(server, timeout=timeout)
         sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         sock.settimeout(None)
         self.sock: socket.socket = sock
@@ -324,8 +332,9 @@ class ADBClientSession:
         """make a service request to ADB server, consult ADB sources for available services"""
         cmdbytes = cmd.encode()
         data = b'%04X%b' % (len(cmdbytes), cmdbytes)
-        self.sock.send(data)
-        _check_okay(self.sock)
+        with metrics.timer(self.metrics_key, 'adb.service'):
+            self.sock.send(data)
+            _check_okay(self.sock)
         return self
 
     def read_response(self):
@@ -348,7 +357,7 @@ class ADBAnyUSBDevice(ADBDevice):
         super().__init__('<any usb>', server)
 
     def create_session(self):
-        return self.server.create_session().service('host:transport-usb')
+        return self.server.create_session(self.serial).service('host:transport-usb')
 
 
 class ADBAnyEmulatorDevice(ADBDevice):
@@ -356,4 +365,4 @@ class ADBAnyEmulatorDevice(ADBDevice):
         super().__init__('<any emulator>', server)
 
     def create_session(self):
-        return self.server.create_session().service('host:transport-local')
+        return self.server.create_session(self.serial).service('host:transport-local')
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Literal, Optional, Union, TYPE_CHECKING
+from typing import Callable, Literal, Optional, Union, TYPE_CHECKING
 
 from concurrent import futures
 from dataclasses import dataclass
@@ -8,6 +8,7 @@ import io
 import ipaddress
 import logging
 import random
+import re
 import socket
 import struct
 import threading
@@ -15,13 +16,13 @@ import time
 from contextlib import contextmanager
 
 import numpy as np
-import lz4.block
 
-from adb_service import ADBDevice
+from .adb_service import ADBDevice
 from ..common.config_enum import EventAction, EventFlag
 
 from ..utils.socketutil import recvexactly
 from ..utils import cvimage
+from ..utils import metrics
 
 
 class DisplayFlag(IntFlag):
@@ -33,9 +34,11 @@ class DisplayFlag(IntFlag):
 _logger = logging.getLogger(__name__)
 
 class SocketWithLock:
-    def __init__(self, sock: socket.socket):
+    def __init__(self, sock: socket.socket, metrics_key: Optional[str] = None):
         self.socket = sock
         self.lock = threading.Lock()
+        # 指标按流归属的显示器区分, 为空时使用设备序列号
+        self.metrics_key = metrics_key
     def close(self):
         self.socket.close()
 
@@ -51,27 +54,89 @@ class ScreenshotImage:
     capture_latency: float
 
 
-def _socket_iter_lines(sock: socket.socket):
-    linebuf = io.BytesIO()
-    buf = bytearray(4096)
+_metric_names: dict[bytes, tuple[str, str, str]] = {}
+
+
+def _command_metric_names(cmd: bytes):
+    names = _metric_names.get(cmd)
+    if names is None:
+        base = 'agent.' + cmd.decode('ascii', 'replace').strip().lower()
+        names = _metric_names[cmd] = (base + '.rtt', base + '.transfer', base + '.errors')
+    return names
+
+
+def _socket_iter_lines(sock: socket.socket, bufsize: int = 65536):
+    """
+    Yield lines (without the trailing newline) received from `sock` until EOF.
+
+    Each chunk is split in one pass; only the unterminated tail is carried over to the next chunk.
+    """
+    pending = []
     while True:
-        chunklen = sock.recv_into(buf, 4096)
-        if chunklen == 0:
+        chunk = sock.recv(bufsize)
+        if not chunk:
             break
-        chunk = buf[:chunklen]
-        while (index := chunk.find(b'\n')) != -1:
-            linebuf.write(chunk[:index+1])
-            line = linebuf.getvalue()
-            linebuf.truncate(0)
-            linebuf.seek(0)
-            yield line
-            chunk = chunk[index + 1:]
-        linebuf.write(chunk)
+        if b'\n' not in chunk:
+            pending.append(chunk)
+            continue
+        if pending:
+            pending.append(chunk)
+            chunk = b''.join(pending)
+            pending.clear()
+        *lines, tail = chunk.split(b'\n')
+        yield from lines
+        if tail:
+            pending.append(tail)
+    if pending:
+        yield b''.join(pending)
+
+
+@dataclass
+class AgentLogEvent:
+    READY = 'ready'
+    FPS = 'fps'
+    ERROR = 'error'
+    LOG = 'log'
+
+    kind: str
+    message: str
+    value: Optional[float] = None
+
+
+_FPS_PATTERN = re.compile(r'\bfps\s*[=:]\s*([0-9]+(?:\.[0-9]+)?)', re.IGNORECASE)
+# 只匹配异常的首行, 堆栈中的 "at ..." 和 "Caused by: ..." 不单独计数
+_ERROR_PATTERN = re.compile(r'^(?:E/|FATAL\b|Error\b|Exception in thread\b|[\w$.]+(?:Exception|Error)(?::|$))',
+                            re.IGNORECASE)
+
+
+def parse_agent_log(line: str) -> AgentLogEvent:
+    """classify a line printed by aah-agent"""
+    if 'bootstrap connection: listening' in line:
+        return AgentLogEvent(AgentLogEvent.READY, line)
+    if (match := _FPS_PATTERN.search(line)) is not None:
+        return AgentLogEvent(AgentLogEvent.FPS, line, float(match.group(1)))
+    if _ERROR_PATTERN.search(line) is not None:
+        return AgentLogEvent(AgentLogEvent.ERROR, line)
+    return AgentLogEvent(AgentLogEvent.LOG, line)
+
+
+class AgentDisconnectedError(ConnectionError):
+    """connection to aah-agent was lost while a command was in flight"""
+
 
 class ControlAgentClient:
-    def __init__(self, device: ADBDevice, display_id: Optional[int] = None):
+    # 连接断开后重启 agent 的等待间隔 (秒), 依次尝试
+    RECONNECT_BACKOFF = (0, 0.05, 0.1, 0.2, 0.4)
+
+    def __init__(self, device: ADBDevice, display_id: Optional[int] = None, auto_reconnect: bool = True):
+        """
+        :param device:         device to run the agent on
+        :param display_id:     display bound to the control stream
+        :param auto_reconnect: restart the agent and restore all streams when a connection drops
+        """
         self.device = device
         self.display_id = display_id or 0
+        self.auto_reconnect = auto_reconnect
 
         self.ready_future = futures.Future()
         self.stdio_closed_future = futures.Future()
@@ -79,48 +144,83 @@ class ControlAgentClient:
         self.closed = False
         self.stdio_stream = None
         self.control_stream = None
-        self.data_stream = None
+        # display_id -> 截图流, 每个显示器一条
+        self.data_streams: dict[int, SocketWithLock] = {}
+        # display_id -> 输入流, 控制流所绑定的显示器不在其中
+        self.input_streams: dict[int, SocketWithLock] = {}
+        self._streams_lock = threading.Lock()
+        # display_id -> open_screenshot 参数, 重连后据此恢复截图流
+        self._screenshot_specs: dict[int, tuple] = {}
+
+        # 每次重连成功后递增, 用于合并同一次断开引起的多个重连请求
+        self.generation = 0
+        self.reconnect_count = 0
+        # 每次关闭会话时递增, 用于区分主动关闭和 agent 意外退出
+        self._session = 0
+        self._healthy = threading.Event()
+        self._reconnect_lock = threading.Lock()
 
         self.log_tag = f'aah-agent on {device}'
+        # 最近一次 agent 报告的帧率
+        self.fps: Optional[float] = None
+        self._log_listeners: list[Callable[[AgentLogEvent], None]] = []
 
         try:
-            control_socket_name = 'aah-agent-' + random.randbytes(4).hex()
-
-            _logger.debug(f'{self.log_tag} deploying')
-            import app
-            agent_path = app.get_vendor_path('aah-agent') / 'app-release-unsigned.apk'
-            server_buf = np.fromfile(agent_path, dtype=np.uint8)
-            self.device.push("/data/local/tmp/app-release-unsigned.apk", server_buf)
-
-            _logger.debug(f'{self.log_tag} starting')
-            cmdline = 'CLASSPATH=/data/local/tmp/app-release-unsigned.apk app_process /data/local/tmp --nice-name=aah-agent xyz.cirno.aah.agent.Main ' + control_socket_name
-            self.stdio_stream: socket.socket = self.device.shell_stream(cmdline)
-
-            stdio_thread = threading.Thread(target=self._stdio_worker)
-            stdio_thread.daemon = True
-            stdio_thread.start()
-            
-            futures.wait([self.ready_future, self.stdio_closed_future], timeout=10, return_when=futures.FIRST_COMPLETED)
-            if not self.ready_future.done():
-                self.stdio_stream.close()
-                raise ConnectionError("Failed to start scrsrv" )
-
-            self.control_stream = SocketWithLock(self.device.service(f'localabstract:{control_socket_name}').detach())
-            self._send_command(self.control_stream, b'OPEN', struct.pack('>ii', 0, 0))
-            self._send_command(self.control_stream, b'DISP', struct.pack('>ii', self.display_id, DisplayFlag.INPUT))
+            self._deploy()
+            self._start()
         except Exception as e:
             self.close()
             raise
 
+    def _deploy(self):
+        _logger.debug(f'{self.log_tag} deploying')
+        import app
+        agent_path = app.get_vendor_path('aah-agent') / 'app-release-unsigned.apk'
+        server_buf = np.fromfile(agent_path, dtype=np.uint8)
+        self.device.push("/data/local/tmp/app-release-unsigned.apk", server_buf)
+
+    def _start(self):
+        control_socket_name = 'aah-agent-' + random.randbytes(4).hex()
+
+        _logger.debug(f'{self.log_tag} starting')
+        cmdline = 'CLASSPATH=/data/local/tmp/app-release-unsigned.apk app_process /data/local/tmp --nice-name=aah-agent xyz.cirno.aah.agent.Main ' + control_socket_name
+        ready_future = self.ready_future = futures.Future()
+        stdio_closed_future = self.stdio_closed_future = futures.Future()
+        self.stdio_stream: socket.socket = self.device.shell_stream(cmdline)
+
+        stdio_thread = threading.Thread(target=self._stdio_worker, args=(self.stdio_stream, ready_future, stdio_closed_future, self._session))
+        stdio_thread.daemon = True
+        stdio_thread.start()
+
+        futures.wait([ready_future, stdio_closed_future], timeout=10, return_when=futures.FIRST_COMPLETED)
+        if not ready_future.done():
+            self.stdio_stream.close()
+            raise ConnectionError("Failed to start scrsrv" )
+
+        self.control_stream = SocketWithLock(self.device.service(f'localabstract:{control_socket_name}').detach())
+        self._send_command(self.control_stream, b'OPEN', struct.pack('>ii', 0, 0))
+        self._send_command(self.control_stream, b'DISP', struct.pack('>ii', self.display_id, DisplayFlag.INPUT))
+        self._healthy.set()
+
     def __del__(self):
         self.close()
 
-    def open_screenshot(self, mode: Literal['adb', 'listen', 'connect'] = 'adb', address: Optional[tuple[str, int]] = None, connect_payload: Optional[bytes] = None, connection_future: Optional[futures.Future[socket.socket]] = None):
+    @property
+    def data_stream(self) -> Optional[SocketWithLock]:
+        """screenshot stream of the default display"""
+        return self.data_streams.get(self.display_id)
+
+    def metrics_key(self, display_id: Optional[int] = None) -> str:
+        if display_id is None or display_id == self.display_id:
+            return self.device.serial
+        return f'{self.device.serial}:display={display_id}'
+
+    def _open_stream(self, mode: Literal['adb', 'listen', 'connect'] = 'adb', address: Optional[tuple[str, int]] = None, connect_payload: Optional[bytes] = None, connection_future: Optional[futures.Future[socket.socket]] = None):
         if mode == 'adb':
             data_socket_name = 'aah-agent-' + random.randbytes(4).hex()
             data_socket_name_bytes = data_socket_name.encode('utf-8')
             self._send_command(self.control_stream, b'OPEN', struct.pack('>iih', 2, 2, len(data_socket_name_bytes)) + data_socket_name_bytes)
-            self.data_stream = SocketWithLock(self.device.service(f'localabstract:{data_socket_name}').detach())
+            return SocketWithLock(self.device.service(f'localabstract:{data_socket_name}').detach())
         elif mode == 'connect':
             addr = ipaddress.ip_address(address[0])
             port = address[1]
@@ -134,33 +234,245 @@ class ControlAgentClient:
                 connect_payload = b''
             self._send_command(self.control_stream, b'OPEN', struct.pack('>ii', 1, family) + addr.packed + struct.pack('>H', port) + connect_payload)
             sock = connection_future.result()
-            self.data_stream = SocketWithLock(sock)
+            return SocketWithLock(sock)
         elif mode == 'listen':
             resp = self._send_command(self.control_stream, b'OPEN', struct.pack('>ii', 2, 0) + b'\x00\x00\x00\x00\x00\x00')  # bind 0.0.0.0:0
             ip = address[0]
             port = struct.unpack('>iH', resp)[1]
             sock = socket.create_connection((ip, port), timeout=10)
             sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            self.data_stream = SocketWithLock(sock)
+            return SocketWithLock(sock)
         else:
             raise NotImplementedError
 
-        self._send_command(self.data_stream, b'DISP', struct.pack('>ii', self.display_id, DisplayFlag.SCREEN_CAPTURE))
+    def open_screenshot(self, mode: Literal['adb', 'listen', 'connect'] = 'adb', address: Optional[tuple[str, int]] = None, connect_payload: Optional[bytes] = None, connection_future: Optional[futures.Future[socket.socket]] = None, display_id: Optional[int] = None):
+        """
+        Open a screenshot stream for a display.
+
+        Every display gets its own stream, so frames of different displays can be fetched concurrently
+        from the same agent process. Opening a display again replaces its previous stream.
+
+        :param display_id: display to capture, defaults to the display of this client
+        """
+        if display_id is None:
+            display_id = self.display_id
+        self._call(lambda: self._open_screenshot(mode, address, connect_payload, connection_future, display_id), retry=False)
+        self._screenshot_specs[display_id] = (mode, address, connect_payload)
+
+    def _open_screenshot(self, mode, address, connect_payload, connection_future, display_id: int):
+        stream = self._open_stream(mode, address, connect_payload, connection_future)
+        stream.metrics_key = self.metrics_key(display_id)
+        try:
+            self._send_command(stream, b'DISP', struct.pack('>ii', display_id, DisplayFlag.SCREEN_CAPTURE))
+        except:
+            stream.close()
+            raise
+        with self._streams_lock:
+            old = self.data_streams.get(display_id)
+            self.data_streams[display_id] = stream
+        if old is not None:
+            old.close()
+
+    def open_input(self, display_id: int, mode: Literal['adb', 'listen', 'connect'] = 'adb', **kwargs) -> SocketWithLock:
+        """
+        Open an input stream targeting another display.
 
-    def _stdio_worker(self):
+        Input for the display of this client goes through the control stream and needs no extra stream.
+        """
+        if display_id == self.display_id:
+            return self.control_stream
+        with self._streams_lock:
+            stream = self.input_streams.get(display_id)
+        if stream is not None:
+            return stream
+        # 建立连接较慢, 不持有锁, 以免阻塞其他显示的流
+        stream = self._open_stream(mode, **kwargs)
+        stream.metrics_key = self.metrics_key(display_id)
+        try:
+            self._send_command(stream, b'DISP', struct.pack('>ii', display_id, DisplayFlag.INPUT))
+        except:
+            stream.close()
+            raise
+        with self._streams_lock:
+            existing = self.input_streams.setdefault(display_id, stream)
+        if existing is not stream:
+            # 其他线程已先打开了同一显示的输入流
+            stream.close()
+        return existing
+
+    def _input_stream(self, display_id: Optional[int]) -> SocketWithLock:
+        if display_id is None or display_id == self.display_id:
+            return self.control_stream
+        stream = self.input_streams.get(display_id)
+        if stream is None:
+            stream = self.open_input(display_id)
+        return stream
+
+    def _data_stream(self, display_id: Optional[int]) -> SocketWithLock:
+        if display_id is None:
+            display_id = self.display_id
+        stream = self.data_streams.get(display_id)
+        if stream is None:
+            raise RuntimeError(f'screenshot stream for display {display_id} is not opened')
+        return stream
+
+    def display(self, display_id: int) -> AgentDisplay:
+        """input and screenshot of one display, sharing this agent process"""
+        return AgentDisplay(self, display_id)
+
+    def close_display(self, display_id: int):
+        """close the screenshot and input streams of a display"""
+        self._screenshot_specs.pop(display_id, None)
+        with self._streams_lock:
+            streams = [self.data_streams.pop(display_id, None), self.input_streams.pop(display_id, None)]
+        for stream in streams:
+            if stream is not None:
+                stream.close()
+
+    def _stdio_worker(self, stdio_stream: socket.socket, ready_future: futures.Future, stdio_closed_future: futures.Future, session: int):
+        debug = _logger.isEnabledFor(logging.DEBUG)
         try:
-            for line in _socket_iter_lines(self.stdio_stream):
-                strline = line.rstrip(b'\r\n').decode('utf-8', errors='replace')
-                _logger.debug(f'{self.log_tag} stdio: {strline}')
-                if 'bootstrap connection: listening' in strline:
-                    self.ready_future.set_result(True)
+            for line in _socket_iter_lines(stdio_stream):
+                strline = line.rstrip(b'\r').decode('utf-8', errors='replace')
+                if debug:
+                    _logger.debug('%s stdio: %s', self.log_tag, strline)
+                event = parse_agent_log(strline)
+                if event.kind == AgentLogEvent.READY:
+                    if not ready_future.done():
+                        ready_future.set_result(True)
+                elif event.kind == AgentLogEvent.FPS:
+                    self.fps = event.value
+                elif event.kind == AgentLogEvent.ERROR:
+                    metrics.count(self.device.serial, 'agent.log.errors')
+                    if not debug:
+                        _logger.warning('%s: %s', self.log_tag, strline)
+                for listener in list(self._log_listeners):
+                    try:
+                        listener(event)
+                    except Exception:
+                        # 监听器的异常不能中断读取, 否则会被当作 agent 退出而重连
+                        _logger.exception('%s: agent log listener %r failed', self.log_tag, listener)
         except OSError:
             _logger.debug(f'{self.log_tag} stdio closed')
         except:
             _logger.debug(f'{self.log_tag} error:', exc_info=True)
-        self.stdio_closed_future.set_result(None)
+        stdio_closed_future.set_result(None)
+        if ready_future.done() and not self.closed and session == self._session:
+            # agent 进程意外退出, 在后台提前重启, 下一次调用无需等待
+            self._healthy.clear()
+            if self.auto_reconnect:
+                threading.Thread(target=self._background_reconnect, args=(self.generation,), daemon=True).start()
+
+    def add_log_listener(self, listener: Callable[[AgentLogEvent], None]):
+        """call `listener` with every parsed line printed by the agent"""
+        self._log_listeners.append(listener)
+        return listener
+
+    def remove_log_listener(self, listener):
+        self._log_listeners.remove(listener)
+
+    def _background_reconnect(self, generation: int):
+        try:
+            self._reconnect(generation)
+        except Exception:
+            _logger.debug(f'{self.log_tag} background reconnect failed', exc_info=True)
+
+    def _close_session(self):
+        self._session += 1
+        if self.stdio_stream:
+            self.stdio_stream.close()
+        if self.control_stream:
+            self.control_stream.close()
+        with self._streams_lock:
+            streams = list(self.data_streams.values()) + list(self.input_streams.values())
+            self.data_streams.clear()
+            self.input_streams.clear()
+        for stream in streams:
+            stream.close()
+
+    def _reconnect(self, generation: int):
+        """
+        Restart the agent and restore the control stream and all screenshot streams.
+
+        Input streams of other displays are reopened on next use.
+        Does nothing if another thread has already reconnected since `generation`.
+        """
+        with self._reconnect_lock:
+            if self.closed:
+                raise AgentDisconnectedError(f'{self.log_tag} is closed')
+            if generation != self.generation:
+                return
+            _logger.info(f'{self.log_tag} connection lost, restarting')
+            self._healthy.clear()
+            t0 = time.perf_counter()
+            last_error = None
+            for attempt, delay in enumerate(self.RECONNECT_BACKOFF):
+                if delay:
+                    time.sleep(delay)
+                self._close_session()
+                # close() 不等待重连, 每一步之后都要检查, 否则会在关闭后重新启动 agent
+                if self.closed:
+                    raise AgentDisconnectedError(f'{self.log_tag} is closed')
+                try:
+                    if attempt == len(self.RECONNECT_BACKOFF) - 1:
+                        # 多次失败时可能是 apk 被清理, 最后一次重新部署
+                        self._deploy()
+                    self._start()
+                    for display_id, spec in list(self._screenshot_specs.items()):
+                        self._restore_screenshot(display_id, *spec)
+                except Exception as e:
+                    _logger.debug(f'{self.log_tag} restart attempt {attempt} failed', exc_info=True)
+                    last_error = e
+                    continue
+                if self.closed:
+                    self._close_session()
+                    raise AgentDisconnectedError(f'{self.log_tag} is closed')
+                break
+            else:
+                self._close_session()
+                raise AgentDisconnectedError(f'{self.log_tag} failed to restart') from last_error
+            self.generation += 1
+            self.reconnect_count += 1
+            elapsed = time.perf_counter() - t0
+            metrics.record(self.device.serial, 'agent.reconnect', elapsed)
+            _logger.info(f'{self.log_tag} restarted in {elapsed * 1000:.0f}ms')
+
+    def _restore_screenshot(self, display_id: int, mode, address, connect_payload):
+        if mode == 'connect':
+            # 反向连接的 cookie 只能使用一次, 恢复时改用 adb 转发
+            _logger.debug(f'{self.log_tag} restoring screenshot stream of display {display_id} over adb')
+            mode, address, connect_payload = 'adb', None, None
+        self._open_screenshot(mode, address, connect_payload, None, display_id)
+
+    def _call(self, func, retry: bool):
+        """
+        Run `func` against the current session, restarting the agent if the connection is lost.
+
+        Commands issued while the agent is restarting wait for the restart to complete.
+        A command lost in flight is retried only if `retry` (i.e. it is idempotent); input events
+        are not retried as they may have been injected already, and raise :class:`AgentDisconnectedError`.
+        """
+        if not self._healthy.is_set() and self.auto_reconnect and not self.closed:
+            self._reconnect(self.generation)
+        generation = self.generation
+        try:
+            return func()
+        except AgentDisconnectedError:
+            if self.closed or not self.auto_reconnect:
+                raise
+            self._reconnect(generation)
+            if not retry:
+                raise
+        return func()
 
     def _send_command_with_metrics(self, conn: SocketWithLock, cmd, payload=b''):
+        try:
+            return self._send_command_with_metrics_unchecked(conn, cmd, payload)
+        except (OSError, EOFError) as e:
+            metrics.count(conn.metrics_key or self.device.serial, 'agent.disconnects')
+            raise AgentDisconnectedError(f'{self.log_tag}: connection lost during {cmd.decode("ascii", "replace").strip()}') from e
+
+    def _send_command_with_metrics_unchecked(self, conn: SocketWithLock, cmd, payload=b''):
         tinit = time.perf_counter()
         sock = conn.socket
         with conn.lock:
@@ -173,8 +485,13 @@ class ControlAgentClient:
             if token == b'OKAY':
                 payload = recvexactly(sock, payload_len)
                 tfullresp = time.perf_counter()
+                rtt_name, transfer_name, _ = _command_metric_names(cmd)
+                metrics_key = conn.metrics_key or self.device.serial
+                metrics.record(metrics_key, rtt_name, tresp - tinit)
+                metrics.record(metrics_key, transfer_name, tfullresp - tresp)
                 return payload, tinit, tsend, tresp, tfullresp
             elif token == b'FAIL':
+                metrics.count(conn.metrics_key or self.device.serial, _command_metric_names(cmd)[2])
                 raise RuntimeError(recvexactly(sock, payload_len).decode('utf-8', 'ignore'))
             else:
                 raise RuntimeError(f'Unknown response: {token}')
@@ -183,28 +500,34 @@ class ControlAgentClient:
         payload, tinit, tsend, tresp, tfullresp = self._send_command_with_metrics(conn, cmd, payload)
         return payload
 
-    def _set_display_id(self, display_id: int):
-        self._send_command(self.data_stream, b'DISP', struct.pack('>ii', display_id, DisplayFlag.SCREEN_CAPTURE))
+    def _set_display_id(self, display_id: int, stream_display_id: Optional[int] = None):
+        """switch the display captured by an existing screenshot stream"""
+        if stream_display_id is None:
+            stream_display_id = self.display_id
+        stream = self._data_stream(stream_display_id)
+        self._send_command(stream, b'DISP', struct.pack('>ii', display_id, DisplayFlag.SCREEN_CAPTURE))
 
     def _sync(self):
-        resp = self._send_command(self.control_stream, b'SYNC')
+        resp = self._call(lambda: self._send_command(self.control_stream, b'SYNC'), retry=True)
         assert len(resp) == 8
         nanosecs = struct.unpack('>q', resp)[0]
         return nanosecs
 
-    def screenshot(self, compress: bool = False, srgb: bool = False):
+    def screenshot(self, compress: bool = False, srgb: bool = False, display_id: Optional[int] = None):
         """
         Fetch last rendered frame from device.
 
-        :param compress: whether to compress the image, may speed up transfer
-        :param srgb:     whether to convert the image to sRGB
+        :param compress:   whether to compress the image, may speed up transfer
+        :param srgb:       whether to convert the image to sRGB
+        :param display_id: display to fetch from, its screenshot stream must be opened with :meth:`open_screenshot`
 
         :return: screenshot image, or `None` if no frame is available
         """
-        if compress:
-            resp, tinit, tsend, tresp, tfullresp = self._send_command_with_metrics(self.data_stream, b'SCAP', b'\x01\x00\x00\x00')
-        else:
-            resp, tinit, tsend, tresp, tfullresp = self._send_command_with_metrics(self.data_stream, b'SCAP', b'\x00\x00\x00\x00')
+        metrics_key = self.metrics_key(display_id)
+        scap_payload = b'\x01\x00\x00\x00' if compress else b'\x00\x00\x00\x00'
+        # 截图可以安全重试
+        resp, tinit, tsend, tresp, tfullresp = self._call(
+            lambda: self._send_command_with_metrics(self._data_stream(display_id), b'SCAP', scap_payload), retry=True)
         resplen = len(resp)
         assert resplen >= 40
         width, height, px, row, color, ts, java_capture_latency, decompress_len = struct.unpack_from('>iiiiiqqi', resp, 0)
@@ -214,7 +537,9 @@ class ControlAgentClient:
             return None
         buf = np.frombuffer(resp[40:], dtype=np.uint8)
         if decompress_len != 0:
-            decompressed = lz4.block.decompress(buf, uncompressed_size=decompress_len, return_bytearray=True)
+            import lz4.block
+            with metrics.timer(metrics_key, 'agent.decompress'):
+                decompressed = lz4.block.decompress(buf, uncompressed_size=decompress_len, return_bytearray=True)
             buf = np.frombuffer(decompressed, dtype=np.uint8)
         arr = np.lib.stride_tricks.as_strided(buf, (height, width, 4), (row, px, 1))
         arr = np.ascontiguousarray(arr)
@@ -223,13 +548,14 @@ class ControlAgentClient:
         img = cvimage.fromarray(arr, 'RGBA')
         if srgb and color == ScreenshotImage.COLORSPACE_DISPLAY_P3:
             from imgreco.cms import p3_to_srgb_inplace
-            img = p3_to_srgb_inplace(img)
+            with metrics.timer(metrics_key, 'agent.p3'):
+                img = p3_to_srgb_inplace(img)
             color = ScreenshotImage.COLORSPACE_SRGB
         xfer_time = time.perf_counter() - tresp
         img.timestamp = ts / 1e9
         return ScreenshotImage(img, color, java_capture_latency / 1e9 + xfer_time)
 
-    def touch_event(self, action: EventAction, x: Union[int, float], y: Union[int, float], pointer_id: int = 0, pressure: float = 1.0, flags: EventFlag = 0):
+    def touch_event(self, action: EventAction, x: Union[int, float], y: Union[int, float], pointer_id: int = 0, pressure: float = 1.0, flags: EventFlag = 0, display_id: Optional[int] = None):
         """
         Send a touch event to device
 
@@ -239,10 +565,11 @@ class ControlAgentClient:
         :param pointer_id: pointer id of touch event, use different pointer id for multitouch
         :param pressure:   pressure of touch event
         :param flags:      flags of touch event, see :class:`EventFlag`
+        :param display_id: display to inject to, defaults to the display of this client
         """
-        self._send_command(self.control_stream, b'TOUC', struct.pack('>iifffi', action, pointer_id, x, y, pressure, flags))
+        self._call(lambda: self._send_command(self._input_stream(display_id), b'TOUC', struct.pack('>iifffi', action, pointer_id, x, y, pressure, flags)), retry=False)
 
-    def key_event(self, action: EventAction, keycode: int, metastate: int = 0, flags: EventFlag = 0):
+    def key_event(self, action: EventAction, keycode: int, metastate: int = 0, flags: EventFlag = 0, display_id: Optional[int] = None):
         """
         Send a key event (UP or DOWN) to device.
 
@@ -250,55 +577,56 @@ class ControlAgentClient:
         :param keycode:   see :mod:`keycode`
         :param metastate: state of meta keys
         :param flags:     use EventFlag.ASYNC for asynchronous injected event
+        :param display_id: display to inject to, defaults to the display of this client
         """
-        self._send_command(self.control_stream, b'KEY ', struct.pack('>iiii', action, keycode, metastate, flags))
+        self._call(lambda: self._send_command(self._input_stream(display_id), b'KEY ', struct.pack('>iiii', action, keycode, metastate, flags)), retry=False)
 
-    def send_key(self, keycode: int, metastate: int = 0):
+    def send_key(self, keycode: int, metastate: int = 0, display_id: Optional[int] = None):
         """
         Send a key press (DOWN then UP) to device.
 
         :param keycode:   see :mod:`keycode`
         :param metastate: state of meta keys
         """
-        self._send_command(self.control_stream, b'KPRS', struct.pack('>ii', keycode, metastate))
+        self._call(lambda: self._send_command(self._input_stream(display_id), b'KPRS', struct.pack('>ii', keycode, metastate)), retry=False)
 
-    def send_text(self, text: str):
+    def send_text(self, text: str, display_id: Optional[int] = None):
         """
         Send text to device.
 
         :param text: text to send
         """
-        self._send_command(self.control_stream, b'TEXT', text.encode('utf-8'))
+        self._call(lambda: self._send_command(self._input_stream(display_id), b'TEXT', text.encode('utf-8')), retry=False)
 
-    def begin_batch_event(self):
+    def begin_batch_event(self, display_id: Optional[int] = None):
         """
         Begin a batch of event.
 
         All events in the batch will use the timestamp of begin request
         and not being injected until end_batch_event is called.
         """
-        self._send_command(self.control_stream, b'BEGB')
+        self._call(lambda: self._send_command(self._input_stream(display_id), b'BEGB'), retry=False)
     
-    def end_batch_event(self):
+    def end_batch_event(self, display_id: Optional[int] = None):
         """
         End a batch of event.
 
         All events sent after begin_batch_event call will be dispatched sequentially with their original mode (async or not)
         """
-        self._send_command(self.control_stream, b'ENDB')
+        self._call(lambda: self._send_command(self._input_stream(display_id), b'ENDB'), retry=False)
 
     @contextmanager
-    def batch_event(self):
+    def batch_event(self, display_id: Optional[int] = None):
         """
         Run a batch of event from a context manager.
 
         All events in the batch will use the timestamp of begin (__enter__) request.
         """
         try:
-            self.begin_batch_event()
+            self.begin_batch_event(display_id)
             yield
         finally:
-            self.end_batch_event()
+            self.end_batch_event(display_id)
 
     def close(self):
         """
@@ -308,13 +636,94 @@ class ControlAgentClient:
         """
         if not self.closed:
             _logger.debug(f'closing {self.log_tag}')
-            if self.stdio_stream:
-                self.stdio_stream.close()
-            if self.control_stream:
-                self.control_stream.close()
-            if self.data_stream:
-                self.data_stream.close()
             self.closed = True
+            self._close_session()
+
+
+class AgentDisplay:
+    """
+    Input and screenshot of one display, multiplexed over a shared :class:`ControlAgentClient`.
+
+    Used for dual-instance setups (e.g. virtual displays) so that all displays of a device are served
+    by one agent process.
+    """
+
+    def __init__(self, client: ControlAgentClient, display_id: int):
+        self.client = client
+        self.display_id = display_id
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.client.log_tag} display={self.display_id}>'
+
+    @property
+    def metrics_key(self):
+        return self.client.metrics_key(self.display_id)
+
+    def open_screenshot(self, mode: Literal['adb', 'listen', 'connect'] = 'adb', address: Optional[tuple[str, int]] = None, connect_payload: Optional[bytes] = None, connection_future: Optional[futures.Future[socket.socket]] = None):
+        self.client.open_screenshot(mode, address, connect_payload, connection_future, display_id=self.display_id)
+
+    def screenshot(self, compress: bool = False, srgb: bool = False):
+        return self.client.screenshot(compress, srgb, display_id=self.display_id)
+
+    def touch_event(self, action: EventAction, x: Union[int, float], y: Union[int, float], pointer_id: int = 0, pressure: float = 1.0, flags: EventFlag = 0):
+        self.client.touch_event(action, x, y, pointer_id, pressure, flags, display_id=self.display_id)
+
+    def key_event(self, action: EventAction, keycode: int, metastate: int = 0, flags: EventFlag = 0):
+        self.client.key_event(action, keycode, metastate, flags, display_id=self.display_id)
+
+    def send_key(self, keycode: int, metastate: int = 0):
+        self.client.send_key(keycode, metastate, display_id=self.display_id)
+
+    def send_text(self, text: str):
+        self.client.send_text(text, display_id=self.display_id)
+
+    def batch_event(self):
+        return self.client.batch_event(display_id=self.display_id)
+
+    def close(self):
+        self.client.close_display(self.display_id)
+
+
+_shared_clients: dict[str, tuple[ControlAgentClient, int]] = {}
+_shared_clients_lock = threading.Lock()
+# 每个设备一把锁, 启动 agent 时只阻塞同一设备的调用方
+_device_locks: dict[str, threading.Lock] = {}
+
+
+def acquire_shared_client(device: ADBDevice) -> ControlAgentClient:
+    """
+    Get the agent client of a device, starting the agent on first use.
+
+    Every call must be paired with :func:`release_shared_client`.
+    """
+    with _shared_clients_lock:
+        device_lock = _device_locks.setdefault(device.serial, threading.Lock())
+    with device_lock:
+        with _shared_clients_lock:
+            entry = _shared_clients.get(device.serial)
+            if entry is not None and not entry[0].closed:
+                client, users = entry
+                _shared_clients[device.serial] = (client, users + 1)
+                return client
+        client = ControlAgentClient(device)
+        with _shared_clients_lock:
+            _shared_clients[device.serial] = (client, 1)
+        return client
+
+
+def release_shared_client(client: ControlAgentClient):
+    """close the agent client once the last user has released it"""
+    with _shared_clients_lock:
+        entry = _shared_clients.get(client.device.serial)
+        if entry is None or entry[0] is not client:
+            client.close()
+            return
+        users = entry[1] - 1
+        if users > 0:
+            _shared_clients[client.device.serial] = (client, users)
+            return
+        del _shared_clients[client.device.serial]
+    client.close()
 
 # def _demo():
 #     import sys
@@ -1,9 +1,9 @@
-from adb_service import ADBServer
+from .adb_service import ADBServer
 from typing import Optional
 from functools import lru_cache
 import logging
 from typing import Protocol
-from adb_service import ADBControllerTarget
+from .adb_service import ADBControllerTarget
 
 logger = logging.getLogger(__name__)
 
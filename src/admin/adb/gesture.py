@@ -0,0 +1,184 @@
+from __future__ import annotations
+from typing import Iterator, Sequence, TYPE_CHECKING
+
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..common.config_enum import ControllerCapabilities, EventAction, EventFlag
+from ..utils import tracing
+
+if TYPE_CHECKING:
+    from .adb_controller import AdbOperate
+
+
+@dataclass
+class PointerStroke:
+    """
+    一个指针的轨迹
+
+    :param path:     经过的点, 按移动距离匀速经过
+    :param start:    按下的时间 (秒, 相对手势开始)
+    :param duration: 从第一个点移动到最后一个点的时间
+    :param hold:     到达最后一个点后松开前的等待时间
+    """
+    path: Sequence[tuple[float, float]]
+    start: float = 0
+    duration: float = 0.3
+    hold: float = 0
+
+    def __post_init__(self):
+        points = np.asarray(self.path, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            raise ValueError('stroke needs at least one point')
+        self._points = points
+        seglen = np.hypot(*np.diff(points, axis=0).T) if len(points) > 1 else np.zeros(0)
+        self._cumlen = np.concatenate(([0.0], np.cumsum(seglen)))
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration + self.hold
+
+    def position(self, t: float) -> tuple[int, int]:
+        """position at time `t` (relative to the gesture start)"""
+        total = self._cumlen[-1]
+        if self.duration <= 0 or total == 0:
+            progress = 1.0 if t >= self.start else 0.0
+        else:
+            progress = min(max((t - self.start) / self.duration, 0.0), 1.0)
+        distance = progress * total
+        x = np.interp(distance, self._cumlen, self._points[:, 0])
+        y = np.interp(distance, self._cumlen, self._points[:, 1])
+        return int(round(x)), int(round(y))
+
+
+class Gesture:
+    """
+    多指手势, 多个指针的 DOWN/MOVE/UP 排在同一条时间线上
+
+    每一帧内的事件应同时发送, 支持批量事件的实现 (aah-agent) 一帧发送一批.
+    """
+
+    def __init__(self, strokes: Sequence[PointerStroke], frame_time: float = 1 / 100):
+        if not strokes:
+            raise ValueError('gesture needs at least one stroke')
+        self.strokes = list(strokes)
+        self.frame_time = frame_time
+
+    @property
+    def duration(self) -> float:
+        return max(stroke.end for stroke in self.strokes)
+
+    def frames(self) -> Iterator[tuple[float, list[tuple[EventAction, int, int, int]]]]:
+        """
+        Yield `(time, events)` per frame, each event being `(action, pointer_id, x, y)`.
+
+        A pointer moves only in frames where its position changed, and is released after its last MOVE.
+        """
+        down = [False] * len(self.strokes)
+        released = [False] * len(self.strokes)
+        last = [None] * len(self.strokes)
+        end = self.duration
+        frame = 0
+        while True:
+            t = min(frame * self.frame_time, end)
+            downs, moves, ups = [], [], []
+            for pointer_id, stroke in enumerate(self.strokes):
+                if released[pointer_id] or t < stroke.start:
+                    continue
+                pos = stroke.position(t)
+                if not down[pointer_id]:
+                    downs.append((EventAction.DOWN, pointer_id, *pos))
+                    down[pointer_id] = True
+                elif pos != last[pointer_id]:
+                    moves.append((EventAction.MOVE, pointer_id, *pos))
+                if t >= stroke.end:
+                    ups.append((EventAction.UP, pointer_id, *pos))
+                    released[pointer_id] = True
+                last[pointer_id] = pos
+            # 同一帧内先移动所有指针再松开, 合并的 MOVE 不会被 UP 打断
+            events = downs + moves + ups
+            if events:
+                yield t, events
+            if all(released):
+                return
+            frame += 1
+
+
+def pinch(center: tuple[float, float], start_distance: float, end_distance: float, angle: float = 0,
+          duration: float = 0.5, hold: float = 0.1) -> Gesture:
+    """
+    Two-finger pinch around `center`, zooming out when `end_distance < start_distance`.
+
+    :param angle: direction of the line between the fingers, in degrees
+    """
+    dx, dy = math.cos(math.radians(angle)) / 2, math.sin(math.radians(angle)) / 2
+    cx, cy = center
+    strokes = []
+    for sign in (-1, 1):
+        p0 = (cx + sign * dx * start_distance, cy + sign * dy * start_distance)
+        p1 = (cx + sign * dx * end_distance, cy + sign * dy * end_distance)
+        strokes.append(PointerStroke([p0, p1], duration=duration, hold=hold))
+    return Gesture(strokes)
+
+
+def two_finger_drag(x0, y0, x1, y1, spacing: float = 100, duration: float = 0.5, hold: float = 0.1) -> Gesture:
+    """two fingers `spacing` apart moving together from (x0, y0) to (x1, y1)"""
+    angle = math.atan2(y1 - y0, x1 - x0) + math.pi / 2
+    ox, oy = math.cos(angle) * spacing / 2, math.sin(angle) * spacing / 2
+    return Gesture([
+        PointerStroke([(x0 - ox, y0 - oy), (x1 - ox, y1 - oy)], duration=duration, hold=hold),
+        PointerStroke([(x0 + ox, y0 + oy), (x1 + ox, y1 + oy)], duration=duration, hold=hold),
+    ])
+
+
+def _sleep_until(deadline: float):
+    delay = deadline - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+@tracing.traced('input.gesture')
+def perform_multitouch(target: AdbOperate, gesture: Gesture):
+    """send every frame of `gesture` as one batch, so the device sees the pointers move simultaneously"""
+    start_time = time.perf_counter()
+    for t, events in gesture.frames():
+        _sleep_until(start_time + t)
+        with target.batch_event():
+            for action, pointer_id, x, y in events:
+                flags = EventFlag.MERGE_MULTITOUCH_MOVE if action == EventAction.MOVE else 0
+                target.touch_event(action, x, y, pointer_id, flags=flags)
+
+
+@tracing.traced('input.gesture')
+def perform_sequential(target: AdbOperate, gesture: Gesture):
+    """
+    Emulate `gesture` one stroke after another with a single pointer.
+
+    Used by backends without multitouch (e.g. shell input); strokes are not simultaneous.
+    """
+    touch_events = ControllerCapabilities.TOUCH_EVENTS in target.get_input_capabilities()
+    for stroke in sorted(gesture.strokes, key=lambda s: s.start):
+        x0, y0 = stroke.position(stroke.start)
+        x1, y1 = stroke.position(stroke.start + stroke.duration)
+        single = Gesture([PointerStroke(stroke.path, 0, stroke.duration, stroke.hold)], gesture.frame_time)
+        if touch_events:
+            start_time = time.perf_counter()
+            for t, events in single.frames():
+                _sleep_until(start_time + t)
+                for action, _, x, y in events:
+                    target.touch_event(action, x, y)
+        elif (x0, y0) == (x1, y1):
+            target.touch_tap(x0, y0, stroke.duration + stroke.hold)
+        else:
+            target.touch_swipe(x0, y0, x1, y1, stroke.duration, stroke.hold)
+
+
+def perform_gesture(target: AdbOperate, gesture: Gesture):
+    caps = target.get_input_capabilities()
+    if ControllerCapabilities.MULTITOUCH_EVENTS in caps and hasattr(target, 'batch_event'):
+        perform_multitouch(target, gesture)
+    else:
+        perform_sequential(target, gesture)
@@ -5,11 +5,11 @@ import time
 from typing import TYPE_CHECKING, Optional
 from ..config.setting import baseSetting
 from ..common.config_enum import Hypervisor
-from .adb_controller import ADBController
 from .adb_service import ADBDevice
 from ..utils.socketutil import recvall
 
 if TYPE_CHECKING:
+    from .adb_controller import ADBController
     from .client import ADBDevice
 
 import logging
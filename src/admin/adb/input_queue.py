@@ -0,0 +1,220 @@
+from __future__ import annotations
+from typing import Callable, Optional, TYPE_CHECKING
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent import futures
+
+from ..common.config_enum import EventAction, EventFlag
+from ..utils import metrics
+
+if TYPE_CHECKING:
+    from .adb_controller import AdbOperate
+
+logger = logging.getLogger(__name__)
+
+
+class _InputItem:
+    __slots__ = ('kind', 'args', 'submitted', 'future', 'merged')
+
+    def __init__(self, kind: str, args: tuple):
+        self.kind = kind
+        self.args = args
+        self.submitted = time.perf_counter()
+        self.future = futures.Future()
+        # 被合并掉的事件, 随本事件一起完成
+        self.merged: list[futures.Future] = []
+
+    @property
+    def is_move(self):
+        return self.kind == 'touch' and self.args[0] == EventAction.MOVE
+
+    def _pending(self):
+        # 已完成的 Future 再次设置结果会抛出 InvalidStateError, 导致队列线程退出
+        return [future for future in (*self.merged, self.future) if not future.done()]
+
+    def set_result(self, result):
+        for future in self._pending():
+            future.set_result(result)
+
+    def set_exception(self, e):
+        for future in self._pending():
+            future.set_exception(e)
+
+
+def coalesce_moves(items: list[_InputItem]) -> list[_InputItem]:
+    """
+    Within each run of consecutive MOVE events keep only the last MOVE of every pointer.
+
+    Dropped events complete together with the event that replaced them.
+    """
+    result = []
+    run: dict[int, _InputItem] = {}
+
+    def end_run():
+        result.extend(run.values())
+        run.clear()
+
+    for item in items:
+        if not item.is_move:
+            end_run()
+            result.append(item)
+            continue
+        pointer_id = item.args[3]
+        previous = run.pop(pointer_id, None)
+        if previous is not None:
+            item.merged.extend(previous.merged)
+            item.merged.append(previous.future)
+        run[pointer_id] = item
+    end_run()
+    return result
+
+
+class InputQueue:
+    """
+    按设备的异步输入队列
+
+    事件由后台线程按提交顺序发送, 每次提交返回 Future, 调用方可以继续执行识别等逻辑.
+    设备处理不及导致事件积压时, 同一指针连续的 MOVE 事件只发送最后一个;
+    若输入实现支持批量事件 (aah-agent), 多个指针的 MOVE 在同一批中合并为一个多点触控事件.
+    """
+
+    def __init__(self, target: AdbOperate, metrics_key: Optional[str] = None, name: str = 'input-queue'):
+        self.target = target
+        self.metrics_key = metrics_key or getattr(target, 'metrics_key', None)
+        self._queue: deque[_InputItem] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._idle = threading.Event()
+        self._idle.set()
+        self.delivered = 0
+        self.coalesced = 0
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.target!r} pending={len(self._queue)}>'
+
+    def _submit(self, kind: str, *args) -> futures.Future:
+        item = _InputItem(kind, args)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('input queue is closed')
+            self._queue.append(item)
+            self._idle.clear()
+            self._cond.notify()
+        return item.future
+
+    def touch_event(self, action: EventAction, x: int, y: int, pointer_id: int = 0) -> futures.Future:
+        return self._submit('touch', action, x, y, pointer_id)
+
+    def key_event(self, action: EventAction, keycode: int, metastate: int = 0) -> futures.Future:
+        return self._submit('key_event', action, keycode, metastate)
+
+    def send_key(self, keycode: int, metastate: int = 0) -> futures.Future:
+        return self._submit('send_key', keycode, metastate)
+
+    def send_text(self, text: str) -> futures.Future:
+        return self._submit('send_text', text)
+
+    def touch_tap(self, x: int, y: int, hold_time: float = 0) -> futures.Future:
+        return self._submit('call', self.target.touch_tap, (x, y, hold_time))
+
+    def touch_swipe(self, x0, y0, x1, y1, move_duration=1, hold_before_release=0, interpolation='linear') -> futures.Future:
+        return self._submit('call', self.target.touch_swipe, (x0, y0, x1, y1, move_duration, hold_before_release, interpolation))
+
+    def call(self, func: Callable, *args) -> futures.Future:
+        """run `func(*args)` on the queue thread, ordered with the other events"""
+        return self._submit('call', func, args)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """wait until all submitted events have been delivered"""
+        return self._idle.wait(timeout)
+
+    def close(self, wait: bool = True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._idle.set()
+                    self._cond.wait()
+                if not self._queue:
+                    self._idle.set()
+                    return
+                items = list(self._queue)
+                self._queue.clear()
+            # 取出后不可再取消; 已被调用方取消的事件不发送
+            items = [item for item in items if item.future.set_running_or_notify_cancel()]
+            if len(items) > 1:
+                pending = len(items)
+                items = coalesce_moves(items)
+                self.coalesced += pending - len(items)
+            self._deliver(items)
+
+    def _deliver(self, items: list[_InputItem]):
+        batch = getattr(self.target, 'batch_event', None)
+        i = 0
+        while i < len(items):
+            item = items[i]
+            if item.is_move and batch is not None:
+                # 连续的多个指针的 MOVE 合并为一个多点触控事件
+                j = i
+                while j < len(items) and items[j].is_move:
+                    j += 1
+                if j - i > 1:
+                    self._run_batch(items[i:j], batch)
+                    i = j
+                    continue
+            self._run(item)
+            i += 1
+
+    def _send(self, item: _InputItem, flags: EventFlag = 0):
+        if self.metrics_key is not None:
+            metrics.record(self.metrics_key, 'input.queue_delay', time.perf_counter() - item.submitted)
+        kind, args = item.kind, item.args
+        if kind == 'touch':
+            if flags:
+                return self.target.touch_event(*args, flags=flags)
+            return self.target.touch_event(*args)
+        elif kind == 'key_event':
+            return self.target.key_event(*args)
+        elif kind == 'send_key':
+            return self.target.send_key(*args)
+        elif kind == 'send_text':
+            return self.target.send_text(*args)
+        elif kind == 'call':
+            func, call_args = args
+            return func(*call_args)
+        raise ValueError(kind)
+
+    def _run(self, item: _InputItem):
+        try:
+            result = self._send(item)
+        except BaseException as e:
+            logger.debug('input event %s failed', item.kind, exc_info=True)
+            item.set_exception(e)
+        else:
+            item.set_result(result)
+        self.delivered += 1
+
+    def _run_batch(self, items: list[_InputItem], batch):
+        try:
+            with batch():
+                for item in items:
+                    self._send(item, EventFlag.MERGE_MULTITOUCH_MOVE)
+        except BaseException as e:
+            logger.debug('input batch failed', exc_info=True)
+            for item in items:
+                item.set_exception(e)
+        else:
+            for item in items:
+                item.set_result(None)
+        self.delivered += len(items)
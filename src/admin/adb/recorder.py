@@ -0,0 +1,308 @@
+"""
+Screenshot recording and replay.
+
+A recording is an append-only file of frames, each stored as one lz4-compressed
+chunk, plus a sidecar index of fixed-size ``(timestamp, offset, length)``
+records. Both files are memory-mapped for reading; the index is searched with
+``np.searchsorted`` so seeking by timestamp does not touch frame data. A
+recording interrupted mid-write stays readable: the index is rebuilt by
+scanning the chunks if it is missing or out of date.
+
+Layout::
+
+    recording: magic 'AXRC' | version u32 | chunk*
+    chunk:     timestamp f64 | width u32 | height u32 | channels u16 | codec u16 | mode 8s | stored length u32 | raw length u32 | data
+    index:     (timestamp f64, chunk offset u64, chunk length u32, reserved u32)*
+
+:class:`ReplayDevice` serves a recording through the screenshot and input
+interfaces of :mod:`adb_controller`, so automation can run against it offline.
+"""
+from __future__ import annotations
+from typing import Optional, Union
+
+import contextlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ..common.config_enum import ControllerCapabilities, EventAction
+from ..utils import cvimage
+from ..utils.array_file import close_buffer
+from .adb_controller import AdbOperate, ScreenshotProtocol
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AXRC'
+VERSION = 1
+_HEADER = struct.Struct('<4sI')
+_CHUNK = struct.Struct('<dIIHH8sII')
+
+CODEC_RAW = 0
+CODEC_LZ4 = 1
+
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('offset', '<u8'), ('length', '<u4'), ('reserved', '<u4')])
+
+
+def _index_path(path: Path) -> Path:
+    return path.with_name(path.name + '.idx')
+
+
+class ScreenshotRecorder:
+    """append frames to a recording"""
+
+    def __init__(self, path: Union[str, os.PathLike], compress: bool = True):
+        self.path = Path(path)
+        self.codec = CODEC_LZ4 if compress else CODEC_RAW
+        self._lock = threading.Lock()
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        if not new:
+            # 追加前先补全索引, 并丢弃未写完的最后一帧
+            with Recording(self.path) as existing:
+                end = existing.end
+            os.truncate(self.path, end)
+        self._data = open(self.path, 'ab')
+        if new:
+            self._data.write(_HEADER.pack(MAGIC, VERSION))
+        self._index = open(_index_path(self.path), 'ab')
+        self.frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, image: cvimage.Image, timestamp: Optional[float] = None):
+        """
+        Append a frame.
+
+        :param timestamp: defaults to the render timestamp of the image, or the current time
+        """
+        if timestamp is None:
+            timestamp = image.timestamp if image.timestamp is not None else time.time()
+        arr = np.ascontiguousarray(image.array)
+        if arr.dtype != np.uint8:
+            raise TypeError(f'unsupported dtype {arr.dtype}')
+        height, width = arr.shape[:2]
+        channels = arr.shape[2] if arr.ndim == 3 else 1
+        raw = arr.data
+        if self.codec == CODEC_LZ4:
+            import lz4.block
+            stored = lz4.block.compress(raw, store_size=False)
+        else:
+            stored = raw
+        header = _CHUNK.pack(timestamp, width, height, channels, self.codec, (image.mode or '').encode('ascii'),
+                             len(stored), arr.nbytes)
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(header)
+            self._data.write(stored)
+            self._data.flush()
+            record = np.array([(timestamp, offset, _CHUNK.size + len(stored), 0)], dtype=INDEX_DTYPE)
+            self._index.write(record.tobytes())
+            self._index.flush()
+            self.frames += 1
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
+
+
+class Recording:
+    """memory-mapped, read-only view of a recording"""
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f'{self.path} is not a recording (version {VERSION})')
+        self.index = self._load_index()
+        self.timestamps = self.index['timestamp']
+
+    @staticmethod
+    def _end_of(index: np.ndarray) -> int:
+        return int(index['offset'][-1] + index['length'][-1]) if len(index) else _HEADER.size
+
+    @property
+    def end(self) -> int:
+        """file offset after the last complete frame"""
+        return self._end_of(self.index)
+
+    def _load_index(self) -> np.ndarray:
+        index_path = _index_path(self.path)
+        if index_path.exists():
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+            if self._end_of(index) == len(self._mmap):
+                return index
+        logger.info('rebuilding index of %s', self.path)
+        index = self._scan()
+        index.tofile(index_path)
+        return index
+
+    def _scan(self) -> np.ndarray:
+        records = []
+        offset = _HEADER.size
+        size = len(self._mmap)
+        while offset + _CHUNK.size <= size:
+            timestamp, *_, stored_len, _ = _CHUNK.unpack_from(self._mmap, offset)
+            length = _CHUNK.size + stored_len
+            if offset + length > size:
+                # 最后一帧未写完
+                break
+            records.append((timestamp, offset, length, 0))
+            offset += length
+        return np.array(records, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def duration(self) -> float:
+        return float(self.timestamps[-1] - self.timestamps[0]) if len(self) else 0.0
+
+    def frame(self, i: int) -> cvimage.Image:
+        offset = int(self.index['offset'][i])
+        timestamp, width, height, channels, codec, mode, stored_len, raw_len = _CHUNK.unpack_from(self._mmap, offset)
+        data_offset = offset + _CHUNK.size
+        if codec == CODEC_LZ4:
+            import lz4.block
+            raw = lz4.block.decompress(memoryview(self._mmap)[data_offset:data_offset + stored_len],
+                                       uncompressed_size=raw_len, return_bytearray=True)
+            arr = np.frombuffer(raw, dtype=np.uint8)
+        elif codec == CODEC_RAW:
+            arr = np.frombuffer(self._mmap, np.uint8, raw_len, data_offset)
+        else:
+            raise ValueError(f'unknown codec {codec}')
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        image = cvimage.fromarray(arr.reshape(shape), mode.rstrip(b'\0').decode('ascii') or None)
+        image.timestamp = timestamp
+        return image
+
+    def frame_index_at(self, timestamp: float) -> int:
+        """index of the last frame captured at or before `timestamp`"""
+        return max(int(np.searchsorted(self.timestamps, timestamp, side='right')) - 1, 0)
+
+    def frame_at(self, timestamp: float) -> cvimage.Image:
+        return self.frame(self.frame_index_at(timestamp))
+
+    def close(self):
+        # 未压缩的帧直接引用映射, 仍有帧存活时由 GC 解除映射
+        close_buffer(self._mmap)
+
+
+class RecordingScreenshotAdapter(ScreenshotProtocol):
+    """records every screenshot taken through another adapter"""
+
+    def __init__(self, inner: ScreenshotProtocol, recorder: ScreenshotRecorder):
+        self.inner = inner
+        self.recorder = recorder
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.inner!r} -> {self.recorder.path}>'
+
+    def get_screenshot_capabilities(self) -> ControllerCapabilities:
+        return self.inner.get_screenshot_capabilities()
+
+    def screenshot(self) -> cvimage.Image:
+        image = self.inner.screenshot()
+        self.recorder.write(image)
+        return image
+
+    def close(self) -> None:
+        self.inner.close()
+        self.recorder.close()
+
+
+class ReplayDevice(AdbOperate, ScreenshotProtocol):
+    """
+    回放录制的截图, 并记录注入的输入
+
+    :param speed: 回放速度倍数; 为 None 时每次截图前进一帧, 结果与运行速度无关, 适合 CI
+    :param loop:  播放到末尾后从头开始, 否则停在最后一帧
+    """
+
+    def __init__(self, recording: Union[Recording, str, os.PathLike], speed: Optional[float] = 1.0, loop: bool = False):
+        self.recording = recording if isinstance(recording, Recording) else Recording(recording)
+        if len(self.recording) == 0:
+            raise ValueError('recording is empty')
+        self.speed = speed
+        self.loop = loop
+        self._start: Optional[float] = None
+        self._step = 0
+        # (回放时间, 操作, 参数)
+        self.input_log: list[tuple[float, str, tuple]] = []
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.recording.path} frames={len(self.recording)} speed={self.speed}>'
+
+    def clock(self) -> float:
+        """current position in recording time"""
+        first = float(self.recording.timestamps[0])
+        if self.speed is None:
+            index = self._step if self.loop else min(self._step, len(self.recording) - 1)
+            return float(self.recording.timestamps[index % len(self.recording)])
+        if self._start is None:
+            self._start = time.perf_counter()
+        elapsed = (time.perf_counter() - self._start) * self.speed
+        if self.loop and self.recording.duration > 0:
+            elapsed %= self.recording.duration
+        return first + elapsed
+
+    def get_screenshot_capabilities(self) -> ControllerCapabilities:
+        return ControllerCapabilities.SCREENSHOT_TIMESTAMP
+
+    def get_input_capabilities(self) -> ControllerCapabilities:
+        return ControllerCapabilities.TOUCH_EVENTS | ControllerCapabilities.MULTITOUCH_EVENTS | \
+            ControllerCapabilities.LOW_LATENCY_INPUT | ControllerCapabilities.KEYBOARD_EVENTS
+
+    def screenshot(self) -> cvimage.Image:
+        if self.speed is None:
+            index = self._step % len(self.recording) if self.loop else min(self._step, len(self.recording) - 1)
+            self._step += 1
+            return self.recording.frame(index)
+        return self.recording.frame_at(self.clock())
+
+    def _log(self, op: str, *args):
+        timestamp = self.clock()
+        self.input_log.append((timestamp, op, args))
+        logger.debug('replay input at %.3f: %s%r', timestamp, op, args)
+
+    def touch_tap(self, x: int, y: int, hold_time: float = 0) -> None:
+        self._log('tap', x, y, hold_time)
+
+    def touch_swipe(self, x0, y0, x1, y1, move_duration=1, hold_before_release=0, interpolation='linear'):
+        self._log('swipe', x0, y0, x1, y1, move_duration, hold_before_release)
+
+    def touch_event(self, action: EventAction, x: int, y: int, pointer_id=0, flags=0) -> None:
+        self._log('touch', EventAction(action).name, x, y, pointer_id)
+
+    def key_event(self, action: EventAction, keycode: int, metastate: int = 0) -> None:
+        self._log('key_event', EventAction(action).name, keycode, metastate)
+
+    def send_key(self, keycode: int, metastate: int = 0) -> None:
+        self._log('key', keycode, metastate)
+
+    def send_text(self, text: str) -> None:
+        self._log('text', text)
+
+    def batch_event(self):
+        return contextlib.nullcontext()
+
+    def close(self) -> None:
+        self.recording.close()
@@ -1,42 +1,98 @@
 from __future__ import annotations
 import atexit
+import heapq
+import logging
 import socket
 import selectors
 import threading
 import secrets
-import queue
+import time
 from concurrent.futures import Future
-from typing import Any, Optional, ClassVar
-from weakref import WeakValueDictionary
+from typing import Optional, ClassVar
+
+logger = logging.getLogger(__name__)
+
+COOKIE_LENGTH = 8
 
 
 class ReverseConnectionFuture(Future[socket.socket]):
     cookie: bytes
+    expires: float
+    # 对端在 cookie 之后发送换行 (`echo cookie`)
+    newline: bool
+
+
+class _Handshake:
+    __slots__ = ('deadline', 'peer', 'buffer', 'expected')
+
+    def __init__(self, deadline: float, peer):
+        self.deadline = deadline
+        self.peer = peer
+        self.buffer = b''
+        # 握手需要读取的字节数, cookie 带换行时加 1
+        self.expected = COOKIE_LENGTH
+
 
 class ReverseConnectionHost(threading.Thread):
+    """
+    反向连接服务: 设备 (nc / aah-agent) 主动连接到本机, 以 8 字节 cookie 标识连接用途
+
+    单个 selector 线程同时处理所有握手. 握手未在期限内完成的连接会被关闭,
+    过期未使用的 cookie 会以 TimeoutError 结束对应的 future.
+    """
     _instance: ClassVar[Optional[ReverseConnectionHost]] = None
+    _instance_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    # 连接建立后发送 cookie 的期限 (秒)
+    HANDSHAKE_TIMEOUT = 5.0
+    # 注册的 cookie 的有效期 (秒)
+    COOKIE_TTL = 30.0
+    BACKLOG = 512
 
     @classmethod
     def get_instance(cls):
-        if not hasattr(cls, 'instance'):
-            cls._instance = cls()
-            cls._instance.start()
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = cls()
+                    instance.start()
+                    cls._instance = instance
         return cls._instance
 
-    def __init__(self, port=0):
-        super().__init__()
+    def __init__(self, port=0, handshake_timeout: Optional[float] = None, cookie_ttl: Optional[float] = None):
+        super().__init__(name='revconn')
         self.daemon = True
+        if handshake_timeout is not None:
+            self.HANDSHAKE_TIMEOUT = handshake_timeout
+        if cookie_ttl is not None:
+            self.COOKIE_TTL = cookie_ttl
         self.listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.listen_sock.bind(('127.0.0.1', port))
+        self.listen_sock.setblocking(False)
         self.port = self.listen_sock.getsockname()[1]
-        self.registered = WeakValueDictionary[str, ReverseConnectionFuture]()
+        self.registered: dict[bytes, ReverseConnectionFuture] = {}
         self.registered_lock = threading.RLock()
-    
+        # (过期时间, cookie), 惰性删除
+        self._expiry_heap: list[tuple[float, bytes]] = []
+        self._handshakes: dict[socket.socket, _Handshake] = {}
+        self.sel = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._stopped = False
+
     def __del__(self):
         self.stop()
 
-    def register_cookie(self, cookie=None) -> ReverseConnectionFuture:
-        future = None
+    def register_cookie(self, cookie=None, ttl: Optional[float] = None, newline: bool = False) -> ReverseConnectionFuture:
+        """
+        Register a cookie and return a future resolved with the connection that presents it.
+
+        :param cookie:  8 bytes, generated if not specified
+        :param ttl:     seconds before the future fails with TimeoutError, defaults to :attr:`COOKIE_TTL`
+        :param newline: the peer sends a newline after the cookie (``echo cookie``), consumed as part of the handshake
+        :return: the future, or `None` if `cookie` is already registered
+        """
+        expires = time.monotonic() + (ttl if ttl is not None else self.COOKIE_TTL)
         with self.registered_lock:
             if cookie is None:
                 while True:
@@ -44,59 +100,170 @@ class ReverseConnectionHost(threading.Thread):
                     if cookie not in self.registered:
                         break
             else:
-                assert len(cookie) == 8
-            if cookie not in self.registered:
-                future = ReverseConnectionFuture()
-                future.cookie = cookie
-                self.registered[cookie] = future
+                assert len(cookie) == COOKIE_LENGTH
+            if cookie in self.registered:
+                return None
+            future = ReverseConnectionFuture()
+            future.cookie = cookie
+            future.expires = expires
+            future.newline = newline
+            self.registered[cookie] = future
+            heapq.heappush(self._expiry_heap, (expires, cookie))
+        # 调用方取消后释放 cookie
+        future.add_done_callback(lambda f: self._forget(f.cookie, f))
         return future
 
+    def _forget(self, cookie, future):
+        with self.registered_lock:
+            if self.registered.get(cookie) is future:
+                del self.registered[cookie]
 
-    def _fulfilled(self, cookie, sock):
+    def _fulfilled(self, cookie, sock) -> bool:
         with self.registered_lock:
             future = self.registered.pop(cookie, None)
-        if future is not None:
+        if future is None or future.done():
+            return False
+        try:
             future.set_result(sock)
-
+        except Exception:
+            return False
+        return True
 
     def run(self):
-        self.listen_sock.listen()
-        self.sel = selectors.DefaultSelector()
-        self.sel.register(self.listen_sock, selectors.EVENT_READ, (self._accept_conn, None))
+        self.listen_sock.listen(self.BACKLOG)
+        self.sel.register(self.listen_sock, selectors.EVENT_READ, self._accept_conn)
+        self.sel.register(self._wakeup_r, selectors.EVENT_READ, None)
+        try:
+            while not self._stopped:
+                events = self.sel.select(self._next_timeout())
+                for key, event in events:
+                    callback = key.data
+                    if callback is None:
+                        self._drain_wakeup()
+                        continue
+                    callback(key.fileobj)
+                now = time.monotonic()
+                self._expire_handshakes(now)
+                self._expire_cookies(now)
+        finally:
+            self._shutdown()
 
-        while True:
-            # print('selecting ', list(self.sel.get_map().keys()))
-            if len(self.sel.get_map()) == 0:
-                break
-            events = self.sel.select(1)
-            for key, event in events:
-                callback, cookie = key.data
-                callback(key.fileobj, event, cookie)
+    def _next_timeout(self):
+        deadlines = [handshake.deadline for handshake in self._handshakes.values()]
+        with self.registered_lock:
+            if self._expiry_heap:
+                deadlines.append(self._expiry_heap[0][0])
+        if not deadlines:
+            return 1
+        return min(max(min(deadlines) - time.monotonic(), 0), 1)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
 
     def stop(self):
-        self.sel.unregister(self.listen_sock)
+        if self._stopped:
+            return
+        self._stopped = True
+        if self.is_alive():
+            # 由 selector 线程自行清理
+            try:
+                self._wakeup_w.send(b'\0')
+            except OSError:
+                pass
+        else:
+            self._shutdown()
+
+    def _shutdown(self):
+        self.sel.close()
         self.listen_sock.close()
-        for _, future in self.registered.items():
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        with self.registered_lock:
+            futures = list(self.registered.values())
+            self.registered.clear()
+            self._expiry_heap.clear()
+        for future in futures:
             future.cancel()
+        for sock in list(self._handshakes):
+            sock.close()
+        self._handshakes.clear()
 
-    def _accept_conn(self, sock, event, _):
-        conn, peer = sock.accept()
-        self.sel.register(conn, selectors.EVENT_READ, (self._conn_data, [b'']))
-    
-    def _conn_data(self, sock, event, box):
-        data = sock.recv(8 - len(box[0]))
-        if data:
-            box[0] += data
-            if len(box[0]) == 8:
-                self.sel.unregister(sock)
-                cookie = box[0]
-                if cookie in self.registered:
-                    self._fulfilled(cookie, sock)
-                else:
-                    sock.close()
-        else:
-            self.sel.unregister(sock)
+    def _accept_conn(self, sock):
+        # 一次接受所有排队的连接
+        while True:
+            try:
+                conn, peer = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                logger.debug('accept failed', exc_info=True)
+                return
+            conn.setblocking(False)
+            self._handshakes[conn] = _Handshake(time.monotonic() + self.HANDSHAKE_TIMEOUT, peer)
+            self.sel.register(conn, selectors.EVENT_READ, self._conn_data)
+
+    def _drop(self, sock):
+        self._handshakes.pop(sock, None)
+        self.sel.unregister(sock)
+
+    def _conn_data(self, sock):
+        handshake = self._handshakes[sock]
+        try:
+            data = sock.recv(handshake.expected - len(handshake.buffer))
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(sock)
+            sock.close()
+            return
+        handshake.buffer += data
+        if len(handshake.buffer) < handshake.expected:
+            # 等待 cookie 的剩余部分到达
+            return
+        cookie = handshake.buffer[:COOKIE_LENGTH]
+        if handshake.expected == COOKIE_LENGTH:
+            with self.registered_lock:
+                future = self.registered.get(cookie)
+            if future is not None and future.newline:
+                # `echo cookie` 的换行不属于数据, 在握手中读掉, 同样受握手超时限制
+                handshake.expected += 1
+                return
+        elif handshake.buffer[COOKIE_LENGTH:] != b'\n':
+            logger.debug('rejected connection with malformed cookie %r', handshake.buffer)
+            self._drop(sock)
             sock.close()
+            return
+        self._drop(sock)
+        sock.setblocking(True)
+        if not self._fulfilled(cookie, sock):
+            logger.debug('rejected connection with unknown cookie %r', cookie)
+            sock.close()
+
+    def _expire_handshakes(self, now):
+        for sock, handshake in list(self._handshakes.items()):
+            if handshake.deadline <= now:
+                logger.debug('handshake from %s timed out', handshake.peer)
+                self._drop(sock)
+                sock.close()
+
+    def _expire_cookies(self, now):
+        expired = []
+        with self.registered_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires, cookie = heapq.heappop(self._expiry_heap)
+                future = self.registered.get(cookie)
+                if future is not None and future.expires == expires:
+                    del self.registered[cookie]
+                    expired.append(future)
+        for future in expired:
+            if not future.done():
+                future.set_exception(TimeoutError(f'no connection for cookie {future.cookie!r}'))
 
 @atexit.register
 def _cleanup():
@@ -109,7 +276,7 @@ def main():
     worker.start()
     try:
         while True:
-            f = worker.register_cookie(b'0000000\n')
+            f = worker.register_cookie(b'0000000\n', ttl=3600)
             sock = f.result()
             while True:
                 buf = sock.recv(4096)
@@ -119,6 +286,6 @@ def main():
             sock.close()
     finally:
         worker.stop()
-    
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
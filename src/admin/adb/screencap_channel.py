@@ -0,0 +1,158 @@
+"""
+Persistent reverse data channel for ``screencap`` over ``nc``.
+
+The per-frame nc path runs ``(echo cookie; screencap) | nc`` for every frame,
+paying for an adb exec, a TCP handshake and a cookie registration each time.
+Here a single on-device loop stays connected and runs ``screencap`` whenever
+the host writes a request line::
+
+    (echo COOKIE; while read -r _; do screencap; done < FIFO) | nc HOST PORT > FIFO
+
+Frames are not length-prefixed on the wire: the raw ``screencap`` header
+(width, height, format and, since Android 9, colorspace) determines the frame
+size, so each frame is read exactly without a shell-side length computation.
+"""
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+
+import logging
+import socket
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from ..utils import metrics
+from .revconn import ReverseConnectionHost
+
+if TYPE_CHECKING:
+    from .adb_controller import ADBController
+
+logger = logging.getLogger(__name__)
+
+# 支持的 PixelFormat: RGBA_8888, RGBX_8888; 解码时按每像素 4 字节处理
+_SUPPORTED_FORMATS = (1, 2)
+_BYTES_PER_PIXEL = 4
+
+
+def _recv_into_exactly(sock: socket.socket, view: memoryview):
+    pos = 0
+    n = len(view)
+    while pos < n:
+        received = sock.recv_into(view[pos:])
+        if received == 0:
+            raise EOFError(f'screencap channel closed after {pos} of {n} bytes')
+        pos += received
+
+
+class _BufferRing:
+    """
+    可复用的接收缓冲区
+
+    截图图像直接引用缓冲区, 只有在没有图像引用时缓冲区才会被复用.
+    """
+
+    def __init__(self, size: int = 3):
+        self.size = size
+        self._buffers: list[np.ndarray] = []
+
+    def acquire(self, nbytes: int) -> np.ndarray:
+        for i in range(len(self._buffers)):
+            # 引用只来自列表本身和 getrefcount 的参数
+            if sys.getrefcount(self._buffers[i]) <= 2 and self._buffers[i].nbytes >= nbytes:
+                return self._buffers[i][:nbytes]
+        buf = np.empty(nbytes, dtype=np.uint8)
+        if len(self._buffers) < self.size:
+            self._buffers.append(buf)
+        else:
+            # 替换最小的缓冲区
+            self._buffers[min(range(len(self._buffers)), key=lambda i: self._buffers[i].nbytes)] = buf
+        return buf
+
+
+class PersistentScreencapChannel:
+    """one long-running screencap loop on the device, serving frames on request"""
+
+    def __init__(self, controller: ADBController, connect_timeout: float = 10):
+        self.controller = controller
+        self.metrics_key = controller.metrics_key
+        self.connect_timeout = connect_timeout
+        self.header_size = 16 if controller.sdk_version >= 28 else 12
+        self._lock = threading.Lock()
+        self._ring = _BufferRing()
+        self._exec_stream: Optional[socket.socket] = None
+        self._sock: Optional[socket.socket] = None
+        self.frames = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {"connected" if self._sock is not None else "closed"} frames={self.frames}>'
+
+    def _open(self):
+        nc_command = self.controller.device_info.nc_command
+        nat_address = self.controller.device_info.nat_to_host_loopback
+        rch = ReverseConnectionHost.get_instance()
+        future = rch.register_cookie(newline=True)
+        cookie = future.cookie.decode()
+        fifo = f'/data/local/tmp/aah-screencap-{cookie}'
+        script = (f'rm -f {fifo}; mkfifo {fifo} && '
+                  f'(echo {cookie}; while read -r _; do screencap; done < {fifo}) | {nc_command} {nat_address} {rch.port} > {fifo}; '
+                  f'rm -f {fifo}')
+        logger.debug('opening persistent screencap channel: %s', script)
+        self._exec_stream = self.controller.adb.exec_stream(script)
+        try:
+            sock = future.result(self.connect_timeout)
+        except:
+            future.cancel()
+            self._exec_stream.close()
+            self._exec_stream = None
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+
+    def _request(self) -> memoryview:
+        sock = self._sock
+        sock.sendall(b'\n')
+        header = np.empty(self.header_size, dtype=np.uint8)
+        _recv_into_exactly(sock, header.data)
+        width, height, pixel_format = struct.unpack_from('<III', header, 0)
+        if pixel_format not in _SUPPORTED_FORMATS:
+            raise ValueError(f'unsupported screencap pixel format {pixel_format}')
+        buf = self._ring.acquire(self.header_size + width * height * _BYTES_PER_PIXEL)
+        buf[:self.header_size] = header
+        _recv_into_exactly(sock, buf.data[self.header_size:])
+        return buf.data
+
+    def capture(self) -> memoryview:
+        """
+        Fetch one raw screencap (header included), reconnecting once if the channel dropped.
+
+        The returned buffer may be reused once no image refers to it anymore.
+        """
+        with self._lock:
+            for attempt in range(2):
+                if self._sock is None:
+                    self._open()
+                try:
+                    with metrics.timer(self.metrics_key, 'screenshot.transfer'):
+                        data = self._request()
+                    self.frames += 1
+                    return data
+                except BaseException as e:
+                    # 读取中断后流中位置未知, 任何异常都必须关闭通道
+                    self._close()
+                    if attempt or not isinstance(e, (OSError, EOFError)):
+                        raise
+                    logger.debug('persistent screencap channel dropped', exc_info=True)
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self._exec_stream is not None:
+            self._exec_stream.close()
+            self._exec_stream = None
+
+    def close(self):
+        with self._lock:
+            self._close()
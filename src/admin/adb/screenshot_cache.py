@@ -0,0 +1,187 @@
+from __future__ import annotations
+from typing import Callable, Optional, TYPE_CHECKING
+
+import logging
+import threading
+import time
+from concurrent import futures
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from ..utils import cvimage
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_signature(image: cvimage.Image, grid: int = 16) -> np.ndarray:
+    """sparse pixel sample used to tell whether consecutive frames differ"""
+    arr = image.array
+    ystep = max(1, arr.shape[0] // grid)
+    xstep = max(1, arr.shape[1] // grid)
+    return arr[::ystep, ::xstep].astype(np.int16)
+
+
+class _InflightCapture:
+    __slots__ = ('started', 'future')
+
+    def __init__(self, started: float):
+        self.started = started
+        self.future = futures.Future()
+
+
+class AdaptiveScreenshotCache:
+    """
+    截图缓存, 根据截图耗时、调用频率和画面是否变化决定缓存有效期
+
+    - rate_limit > 0: 固定有效期 1 / rate_limit
+    - rate_limit == -1: 自适应, 有效期以截图耗时为基准, 画面连续不变时逐步延长, 画面变化后恢复
+    - rate_limit == 0: 不缓存, 除非调用方给出 max_age
+
+    同一时间的多个调用方共享同一次截图, 不会各自触发截图.
+    """
+
+    # 自适应模式下有效期最多为截图耗时的倍数
+    MAX_STATIC_FACTOR = 4.0
+    # 自适应模式下有效期上限 (秒)
+    MAX_LIFETIME = 0.5
+    # 像素差超过该值视为画面变化
+    CHANGE_THRESHOLD = 8
+
+    def __init__(self, capture: Callable[[], cvimage.Image], rate_limit: Callable[[], float]):
+        """
+        :param capture:    function taking a new screenshot
+        :param rate_limit: function returning the configured rate limit, see class docstring
+        """
+        self._capture = capture
+        self._rate_limit = rate_limit
+        self._lock = threading.Lock()
+        self._inflight: Optional[_InflightCapture] = None
+
+        self.frame: Optional[cvimage.Image] = None
+        self.frame_time = 0.0
+        self.expire = 0.0
+        self._signature = None
+
+        # 指数移动平均
+        self.capture_latency = 0.0
+        self.request_interval = 0.0
+        self._last_request = None
+        self.static_factor = 1.0
+
+        self.hits = 0
+        self.captures = 0
+        self.shared = 0
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} latency={self.capture_latency * 1000:.1f}ms '
+                f'interval={self.request_interval * 1000:.1f}ms factor={self.static_factor:.2f} '
+                f'hits={self.hits} captures={self.captures} shared={self.shared}>')
+
+    @staticmethod
+    def _ewma(old, new, alpha=0.2):
+        return new if old == 0 else old + alpha * (new - old)
+
+    def _observe_request(self, now):
+        if self._last_request is not None:
+            self.request_interval = self._ewma(self.request_interval, now - self._last_request)
+        self._last_request = now
+
+    def _lifetime(self, rate_limit, latency):
+        if rate_limit > 0:
+            return 1 / rate_limit
+        if rate_limit == 0:
+            return 0.0
+        # 请求间隔包含未命中时的截图耗时, 扣除后才是调用方两次请求之间的处理时间;
+        # 处理时间比有效期还长时, 缓存帧对下一次请求已无意义
+        idle = self.request_interval - latency
+        if self.request_interval > 0 and idle > latency * self.static_factor:
+            return min(latency, self.MAX_LIFETIME)
+        return min(latency * self.static_factor, self.MAX_LIFETIME)
+
+    def _update_change(self, image: cvimage.Image):
+        try:
+            signature = _frame_signature(image)
+        except Exception:
+            return
+        previous = self._signature
+        self._signature = signature
+        if previous is None or previous.shape != signature.shape:
+            self.static_factor = 1.0
+            return
+        changed = np.count_nonzero(np.abs(signature - previous) > self.CHANGE_THRESHOLD) > 0
+        if changed:
+            self.static_factor = 1.0
+        else:
+            self.static_factor = min(self.static_factor * 1.5, self.MAX_STATIC_FACTOR)
+
+    def get(self, cached: bool = True, max_age: Optional[float] = None) -> cvimage.Image:
+        """
+        Get a screenshot, possibly from cache.
+
+        :param cached:  allow returning a cached frame
+        :param max_age: accept a frame no older than this many seconds, overriding the adaptive lifetime
+        """
+        rate_limit = self._rate_limit() or 0
+        now = time.perf_counter()
+        with self._lock:
+            self._observe_request(now)
+            # 不缓存时仍接受调用方显式给出的 max_age
+            if cached and self.frame is not None and (rate_limit != 0 or max_age is not None):
+                if max_age is not None:
+                    fresh = now - self.frame_time <= max_age
+                else:
+                    fresh = now < self.expire
+                if fresh:
+                    self.hits += 1
+                    return self.frame
+            # 正在进行中的截图足够新时直接等待其结果
+            if not cached:
+                oldest_start = now
+            elif max_age is not None:
+                oldest_start = now - max_age
+            else:
+                oldest_start = float('-inf')
+            inflight = self._inflight
+            if inflight is not None and inflight.started >= oldest_start:
+                self.shared += 1
+                owner = False
+            else:
+                inflight = self._inflight = _InflightCapture(now)
+                owner = True
+
+        if not owner:
+            return inflight.future.result()
+
+        try:
+            image = self._capture()
+        except BaseException as e:
+            with self._lock:
+                if self._inflight is inflight:
+                    self._inflight = None
+            inflight.future.set_exception(e)
+            raise
+        t1 = time.perf_counter()
+        with self._lock:
+            latency = t1 - inflight.started
+            self.capture_latency = self._ewma(self.capture_latency, latency)
+            self.captures += 1
+            if rate_limit != 0:
+                self._update_change(image)
+            if inflight.started >= self.frame_time:
+                self.frame = image
+                self.frame_time = inflight.started
+                # 固定频率从截图开始时算起, 保持 screenshot_rate_limit 的含义;
+                # 自适应模式从截图完成时算起, 否则耗时本身就用掉了整个有效期
+                start = t1 if rate_limit < 0 else inflight.started
+                self.expire = start + self._lifetime(rate_limit, self.capture_latency)
+            if self._inflight is inflight:
+                self._inflight = None
+        inflight.future.set_result(image)
+        return image
+
+    def invalidate(self):
+        """drop the cached frame, e.g. after input that changes the screen"""
+        with self._lock:
+            self.frame = None
+            self.expire = 0.0
@@ -1,15 +1,25 @@
+import functools
 import logging
+from typing import Optional, TYPE_CHECKING
 
 from src.admin.utils import cvimage
+from src.admin.scene.graph import SceneGraph
+from src.admin.scene.runtime import SceneRuntime
+
+if TYPE_CHECKING:
+    from src.admin.adb.adb_controller import ADBController
 
 logger = logging.getLogger('link')
 
 
 class BaseAutoHandler():
+    # 子类指定各自游戏的场景图
+    scene_graph: Optional[SceneGraph] = None
 
     def __init__(self, device_conn, s):
         self.device_conn = device_conn
-        pass
+        self.controller: Optional['ADBController'] = None
+        self.scene: Optional[SceneRuntime] = None
 
     def link_check(self):
         pass
@@ -20,4 +30,11 @@ class BaseAutoHandler():
             # self._controller = get_target_from_adb_serial(adb_serial).create_controller()
             self.link_check()
 
+    def attach_controller(self, controller: 'ADBController'):
+        """绑定设备控制器, 有场景图时创建场景运行时"""
+        self.controller = controller
+        if self.scene_graph is not None:
+            self.scene = SceneRuntime(self.scene_graph, functools.partial(controller.screenshot, cached=False),
+                                      controller.input, controller.metrics_key)
+
     # def screenshot(self, cached: bool = True) -> cvimage.Image:
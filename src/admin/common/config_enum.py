@@ -80,4 +80,6 @@ class KeyName(Enum):
     AospScreenshotEncoding = "AospScreenshotEncoding"
     ScreenshotTransport = "ScreenshotTransport"
     InputMethod = "InputMethod"
-    ScreenshotMethod = "ScreenshotMethod"
\ No newline at end of file
+    ScreenshotMethod = "ScreenshotMethod"
+    ScreenshotRateLimit = "ScreenshotRateLimit"
+    AahAgentCompress = "AahAgentCompress"
\ No newline at end of file
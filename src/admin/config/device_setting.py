@@ -0,0 +1,184 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Optional
+
+from ..common.config_enum import *
+from .setting import VALUE_CONVERTERS, BaseSetting, get_base_setting
+
+logger = logging.getLogger(__name__)
+
+DEVICE_SETTINGS_PATH = Path(__file__).resolve().parents[2] / 'resources' / 'device_settings.json'
+
+
+def _snake_case(name: str) -> str:
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+# device_config.screenshot_rate_limit -> KeyName.ScreenshotRateLimit
+_ATTRIBUTE_KEYS = {_snake_case(key.name): key for key in KeyName}
+
+
+class DeviceSettingStore:
+    """
+    按设备保存的配置覆盖项
+
+    配置按 基础配置(ConfigApp.BASE) -> 应用配置(ConfigApp.Arknights/MBCC) -> 设备配置 逐层覆盖,
+    设备配置以 device_identifier 为键保存在单独的文件中, 写入会合并后延迟落盘.
+    """
+
+    def __init__(self, path=DEVICE_SETTINGS_PATH, base: Optional[BaseSetting] = None, flush_delay: float = 2.0):
+        self.path = Path(path)
+        self._base = base
+        self.flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._dirty = False
+        # 每次修改递增, DeviceConfig 据此判断缓存是否失效
+        self.version = 0
+        self._devices: dict[str, dict[str, dict[str, object]]] = {}
+        if self.path.exists():
+            with open(self.path, encoding='utf-8') as f:
+                self._devices = json.load(f).get('devices', {})
+
+    @property
+    def base(self) -> BaseSetting:
+        return self._base or get_base_setting()
+
+    def overrides(self, device: str) -> dict:
+        return self._devices.get(device, {})
+
+    def resolve(self, key: KeyName, device: Optional[str] = None, app: ConfigApp = ConfigApp.BASE,
+                group: GroupName = GroupName.Simulator):
+        if device is not None:
+            group_overrides = self._devices.get(device, {}).get(group.name)
+            if group_overrides is not None and key.name in group_overrides:
+                return self._convert(key, group, group_overrides[key.name])
+        snapshot = self.base.snapshot
+        if app is not ConfigApp.BASE and (app, group, key) in snapshot:
+            return snapshot[(app, group, key)]
+        return snapshot.get(key, ConfigApp.BASE, group)
+
+    def _convert(self, key: KeyName, group: GroupName, value):
+        # 设备配置按基础配置中声明的 value_type 转换
+        base_group = self.base.snapshot.groups.get(ConfigApp.BASE, {}).get(group)
+        member = base_group.members.get(key) if base_group is not None else None
+        converter = VALUE_CONVERTERS.get(member.value_type) if member is not None else None
+        if converter is None or value is None:
+            return value
+        try:
+            return converter(value)
+        except (TypeError, ValueError):
+            logger.warning('invalid device setting %s=%r', key.name, value)
+            return None
+
+    def set(self, device: str, key: KeyName, value, group: GroupName = GroupName.Simulator):
+        with self._lock:
+            self._devices.setdefault(device, {}).setdefault(group.name, {})[key.name] = value
+            self.version += 1
+            self._schedule_flush()
+
+    def unset(self, device: str, key: KeyName, group: GroupName = GroupName.Simulator):
+        with self._lock:
+            group_overrides = self._devices.get(device, {}).get(group.name, {})
+            if group_overrides.pop(key.name, None) is not None:
+                self.version += 1
+                self._schedule_flush()
+
+    def _schedule_flush(self):
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """write pending changes to disk"""
+        # 写文件串行进行, 且在写锁内取快照, 避免并发 flush 共用临时文件或旧快照覆盖新快照;
+        # 修改配置只需 _lock, 不会被磁盘写入阻塞
+        with self._write_lock:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                data = json.dumps({'devices': self._devices}, ensure_ascii=False, indent=2)
+                self._dirty = False
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp, self.path)
+            except BaseException:
+                # 写入失败时保留待保存的修改, 下次修改或 flush 时重试
+                with self._lock:
+                    self._dirty = True
+                raise
+        logger.debug('saved device settings to %s', self.path)
+
+    def device_config(self, device: str, app: ConfigApp = ConfigApp.BASE) -> 'DeviceConfig':
+        return DeviceConfig(self, device, app)
+
+
+class DeviceConfig:
+    """
+    单个设备的配置视图, 以属性方式访问, 例如 ``device_config.screenshot_method``
+
+    解析结果缓存在本对象中, 基础配置重新加载或设备配置修改后自动重新解析.
+    """
+
+    def __init__(self, store: DeviceSettingStore, device: str, app: ConfigApp = ConfigApp.BASE,
+                 group: GroupName = GroupName.Simulator):
+        self._store = store
+        self.device = device
+        self.app = app
+        self.group = group
+        self._cache_key = None
+        self._resolved = {}
+
+    @property
+    def _mapping(self) -> dict:
+        cache_key = (self._store.base.snapshot, self._store.version)
+        if cache_key != self._cache_key:
+            self._resolved = {key.name: self._store.resolve(key, self.device, self.app, self.group) for key in KeyName}
+            self._cache_key = cache_key
+        return self._resolved
+
+    def get(self, key: KeyName):
+        return self._mapping[key.name]
+
+    def set(self, key: KeyName, value):
+        """override `key` for this device, persisted by :meth:`save` or the next batched flush"""
+        self._store.set(self.device, key, value, self.group)
+
+    def save(self):
+        self._store.flush()
+
+    def __getattr__(self, name):
+        key = _ATTRIBUTE_KEYS.get(name)
+        if key is None:
+            raise AttributeError(name)
+        return self._mapping[key.name]
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.device} {self._mapping}>'
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_device_store() -> DeviceSettingStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DeviceSettingStore()
+                atexit.register(_store.flush)
+    return _store
@@ -1,30 +1,95 @@
 import json
 import logging
+import os
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Optional
 
 from src.admin.common.base import Bean
 from ..common.config_enum import *
 
 logger = logging.getLogger(__name__)
 
+PROPERTIES_PATH = Path(__file__).resolve().parents[2] / 'resources' / 'properties.json'
+
+# value_type 到 Python 类型的转换
+VALUE_CONVERTERS = {
+    'str': str,
+    'radio': str,
+    'int': int,
+    'float': float,
+    'bool': lambda v: v if isinstance(v, bool) else str(v).lower() in ('1', 'true', 'yes', 'on'),
+}
+
+
+class ConfigSnapshot:
+    """
+    编译后的配置快照, 不可变
+
+    (app, group, key) 直接映射到已解析 (value 为空时取 default_value) 并转换类型后的值,
+    查询只需一次 dict 查找. 重新加载配置时整体替换快照, 读取方无需加锁.
+    """
+    __slots__ = ('values', 'groups', 'source_mtime')
+
+    def __init__(self, values: dict, groups: dict, source_mtime: float = 0):
+        self.values = MappingProxyType(values)
+        self.groups = MappingProxyType(groups)
+        self.source_mtime = source_mtime
+
+    def get(self, key: KeyName, app: ConfigApp = ConfigApp.BASE, group: GroupName = GroupName.Simulator, default=None):
+        return self.values.get((app, group, key), default)
+
+    def __getitem__(self, item):
+        return self.values[item]
+
+    def __contains__(self, item):
+        return item in self.values
+
+
+def compile_snapshot(all_setting: list, source_mtime: float = 0) -> ConfigSnapshot:
+    values = {}
+    groups = {}
+    for data in all_setting:
+        group = Group(data)
+        app = ConfigApp[data['app']]
+        group_name = GroupName[data['group']]
+        groups.setdefault(app, {})[group_name] = group
+        for key, member in group.members.items():
+            values[(app, group_name, key)] = member.resolve()
+    return ConfigSnapshot(values, groups, source_mtime)
+
 
 class BaseSetting:
 
-    def __init__(self):
-        self.setting = {}
-        self.setting[ConfigApp.BASE] = {}
+    def __init__(self, snapshot: Optional[ConfigSnapshot] = None):
+        self.snapshot = snapshot or ConfigSnapshot({}, {ConfigApp.BASE: {}})
+        # select_app/select_group 的状态按线程隔离, 避免多设备线程互相覆盖
+        self._selection = threading.local()
+        self._subscribers: list[Callable[[ConfigSnapshot, ConfigSnapshot], None]] = []
+        self._watcher: Optional[ConfigWatcher] = None
+
+    @property
+    def setting(self):
+        return self.snapshot.groups
+
+    @property
+    def currApp(self):
+        return getattr(self._selection, 'app', ConfigApp.BASE)
 
-        self.currApp = ConfigApp.BASE
-        self.currGroup = ""
+    @property
+    def currGroup(self):
+        return getattr(self._selection, 'group', "")
 
     def put(self, app, group, key, value):
         self.setting.get(app)
 
     def select_app(self, app: ConfigApp):
-        self.currApp = app
+        self._selection.app = app
         return self
 
     def select_group(self, group: GroupName):
-        self.currGroup = group
+        self._selection.group = group
         return self
 
     def get(self, key: KeyName, app: ConfigApp = None, group: GroupName = None):
@@ -32,13 +97,71 @@ class BaseSetting:
             app = self.currApp
         if group is None:
             group = self.currGroup
-        rstGroup: Group= self.setting.get(app).get(group)
-        if rstGroup is None:
-            logging.error("当前" + app.name + "没有" + group + "组")
+        snapshot = self.snapshot
+        try:
+            return snapshot.values[(app, group, key)]
+        except KeyError:
+            if group not in snapshot.groups.get(app, {}):
+                logging.error("当前" + app.name + "没有" + str(group) + "组")
             return None
-        else:
-            item: Member = rstGroup.members.get(key)
-            return item.value
+
+    def swap(self, snapshot: ConfigSnapshot):
+        """atomically replace the active snapshot and notify subscribers"""
+        old, self.snapshot = self.snapshot, snapshot
+        for callback in list(self._subscribers):
+            try:
+                callback(old, snapshot)
+            except Exception:
+                logger.exception('config subscriber %r failed', callback)
+
+    def subscribe(self, callback: Callable[[ConfigSnapshot, ConfigSnapshot], None]):
+        """call `callback(old_snapshot, new_snapshot)` after every reload"""
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def reload(self, path=PROPERTIES_PATH):
+        self.swap(load_snapshot(path))
+
+    def watch(self, path=PROPERTIES_PATH, interval: float = 1.0):
+        """start reloading `path` whenever it changes on disk"""
+        if self._watcher is None:
+            self._watcher = ConfigWatcher(self, path, interval)
+            self._watcher.start()
+        return self._watcher
+
+
+class ConfigWatcher(threading.Thread):
+    """polls the mtime of the properties file and reloads the settings on change"""
+
+    def __init__(self, setting: BaseSetting, path=PROPERTIES_PATH, interval: float = 1.0):
+        super().__init__(name='config-watcher', daemon=True)
+        self.setting = setting
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                continue
+            if mtime == self.setting.snapshot.source_mtime:
+                continue
+            try:
+                snapshot = load_snapshot(self.path)
+            except Exception:
+                # 文件可能正在写入, 下次轮询再试
+                logger.debug('failed to reload %s', self.path, exc_info=True)
+                continue
+            logger.info('reloaded settings from %s', self.path)
+            self.setting.swap(snapshot)
+
+    def stop(self):
+        self._stop_event.set()
 
 
 class Member:
@@ -56,6 +179,22 @@ class Member:
         self.options = arr
         return self
 
+    def resolve(self):
+        """value, falling back to default_value, converted according to value_type"""
+        value = self.value
+        if value is None or "".__eq__(value):
+            value = self.default_value
+        if value is None:
+            return None
+        converter = VALUE_CONVERTERS.get(self.value_type)
+        if converter is None:
+            return value
+        try:
+            return converter(value)
+        except (TypeError, ValueError):
+            logger.warning('invalid %s value %r for %s', self.value_type, value, self.key)
+            return None
+
 
 class Property(Bean):
     __slots__ = ('display_name', 'key_name', 'value', 'desc')
@@ -84,17 +223,37 @@ class Group():
             return rst.value
 
 
-def init_setting():
-    baseSetting = BaseSetting()
-    with open("src/resources/properties.json", encoding="utf-8") as properties_file:
+def load_snapshot(path=PROPERTIES_PATH) -> ConfigSnapshot:
+    mtime = os.stat(path).st_mtime
+    with open(path, encoding="utf-8") as properties_file:
         all_setting = json.load(properties_file)
+    logger.debug('loaded %d setting groups from %s', len(all_setting), path)
+    return compile_snapshot(all_setting, mtime)
+
+
+def init_setting(path=PROPERTIES_PATH):
+    return BaseSetting(load_snapshot(path))
+
+
+_base_setting = None
+_base_setting_lock = threading.Lock()
+
+
+def get_base_setting() -> BaseSetting:
+    """配置在第一次使用时加载"""
+    global _base_setting
+    if _base_setting is None:
+        with _base_setting_lock:
+            if _base_setting is None:
+                _base_setting = init_setting()
+    return _base_setting
+
 
-    print(all_setting)
-    # 迭代所有参数，进行转换
-    for group in all_setting:
-        baseSetting.setting[ConfigApp.BASE][GroupName[group["group"]]] = Group(group)
+class _LazyBaseSetting:
+    """stands in for the BaseSetting singleton and loads it on first attribute access"""
 
-    return baseSetting
+    def __getattr__(self, name):
+        return getattr(get_base_setting(), name)
 
 
-baseSetting = init_setting()
+baseSetting = _LazyBaseSetting()
@@ -1,15 +1,35 @@
+from functools import lru_cache
+
 from ..utils import cvimage
-from ..utils import resources
-from PIL import ImageCms
-p3_profile = ImageCms.ImageCmsProfile(resources.open_file('DisplayP3.icm'))
-srgb_profile = ImageCms.createProfile('sRGB')
+
+
+@lru_cache(maxsize=None)
+def _load_profiles():
+    from PIL import ImageCms
+    from ..utils import resources
+    p3_profile = ImageCms.ImageCmsProfile(resources.open_file('DisplayP3.icm'))
+    srgb_profile = ImageCms.createProfile('sRGB')
+    return p3_profile, srgb_profile
+
+
+def __getattr__(name):
+    # ICC 配置文件在第一次使用时才加载
+    if name == 'p3_profile':
+        return _load_profiles()[0]
+    if name == 'srgb_profile':
+        return _load_profiles()[1]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 def p3_to_srgb_inplace(img: cvimage.Image):
+    from PIL import ImageCms
+    p3_profile, srgb_profile = _load_profiles()
     pil_im, copied = img.to_pil2()
     ImageCms.profileToProfile(pil_im, p3_profile, srgb_profile, inPlace=True)
     if copied:
         return cvimage.from_pil(pil_im)
     else:
+        img.invalidate()
         return img
 
 
@@ -0,0 +1,228 @@
+"""
+Run recognition jobs on one frame in parallel.
+
+OpenCV releases the GIL in ``matchTemplate``, ``cvtColor``, ``resize`` and
+most other array operations, so independent jobs on the same frame scale
+across a thread pool. A batch is a frame plus an ordered list of jobs::
+
+    executor = RecognitionExecutor()
+    batch = executor.submit(frame, [
+        template_job('start', roi_start),
+        region_job('sanity', (100, 20, 300, 60), ocr_func),
+    ], stream='main')
+    start, sanity = batch.values()
+
+Submitting a newer frame on the same named stream cancels jobs of the previous
+batch that have not started yet. Every result carries its queueing and run time.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional, Sequence
+
+import concurrent.futures
+import os
+import threading
+import time
+
+import numpy as np
+
+from ..utils import cvimage, metrics, tracing
+from ..utils.cvimage import Rect
+
+_shared_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_shared_pool_lock = threading.Lock()
+# 不参与 "新帧取消旧帧" 的批次
+_UNTRACKED = object()
+
+
+def shared_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """process-wide thread pool for recognition jobs"""
+    global _shared_pool
+    if _shared_pool is None:
+        with _shared_pool_lock:
+            if _shared_pool is None:
+                _shared_pool = concurrent.futures.ThreadPoolExecutor(max_workers=min(os.cpu_count() or 4, 8),
+                                                                     thread_name_prefix='imgreco')
+    return _shared_pool
+
+
+class BatchCancelled(Exception):
+    pass
+
+
+@dataclass
+class RecognitionJob:
+    name: str
+    func: Callable[[cvimage.Image], Any]
+
+    def __call__(self, frame: cvimage.Image):
+        return self.func(frame)
+
+
+def job(name: str, func: Callable, *args, **kwargs) -> RecognitionJob:
+    """job calling ``func(frame, *args, **kwargs)``"""
+    return RecognitionJob(name, lambda frame: func(frame, *args, **kwargs))
+
+
+def template_job(name: str, roi, **kwargs) -> RecognitionJob:
+    """job matching a region of interest loaded by :func:`resources.load_roi`, see :func:`matching.match_roi`"""
+    from .matching import match_roi
+    return RecognitionJob(name, lambda frame: match_roi(frame, roi, **kwargs))
+
+
+def region_job(name: str, rect, func: Callable[[cvimage.Image], Any]) -> RecognitionJob:
+    """job calling `func` on a read-only subview of the frame, e.g. an OCR crop"""
+    if not isinstance(rect, Rect):
+        rect = Rect.from_ltrb(*rect)
+    return RecognitionJob(name, lambda frame: func(frame.subview(rect)))
+
+
+def color_job(name: str, rect, color: Sequence[int], tolerance: float = 16) -> RecognitionJob:
+    """job checking that the mean color of a region is within `tolerance` (max channel difference) of `color`"""
+    if not isinstance(rect, Rect):
+        rect = Rect.from_ltrb(*rect)
+    expected = np.asarray(color, dtype=np.float32)
+
+    def check(frame: cvimage.Image):
+        arr = frame.subview(rect).array
+        mean = arr.reshape(-1, arr.shape[-1] if arr.ndim == 3 else 1).mean(axis=0)
+        n = min(len(mean), len(expected))
+        return bool(np.abs(mean[:n] - expected[:n]).max() <= tolerance)
+    return RecognitionJob(name, check)
+
+
+@dataclass
+class JobResult:
+    name: str
+    value: Any = None
+    error: Optional[BaseException] = None
+    cancelled: bool = False
+    # 排队等待时间与执行时间 (秒)
+    queued: float = 0.0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.cancelled
+
+
+class RecognitionBatch:
+    """jobs submitted together on one frame, results keep the submission order"""
+
+    def __init__(self, frame: cvimage.Image, jobs: Sequence[RecognitionJob], metrics_key=None):
+        self.frame = frame
+        self.jobs = list(jobs)
+        self.metrics_key = metrics_key
+        self.results = [JobResult(job.name) for job in self.jobs]
+        self.futures: list[concurrent.futures.Future] = []
+        self._cancelled = threading.Event()
+        self.submitted = time.perf_counter()
+
+    def __repr__(self):
+        done = sum(f.done() for f in self.futures)
+        return f'<{self.__class__.__name__} jobs={len(self.jobs)} done={done}{" cancelled" if self.cancelled else ""}>'
+
+    def _run(self, index: int):
+        result = self.results[index]
+        start = time.perf_counter()
+        result.queued = start - self.submitted
+        if self._cancelled.is_set():
+            # 已开始的 OpenCV 调用无法中断, 只跳过尚未开始的任务
+            result.cancelled = True
+            raise BatchCancelled()
+        try:
+            with tracing.span('imgreco.job', job=result.name):
+                result.value = self.jobs[index](self.frame)
+        except BaseException as e:
+            result.error = e
+            raise
+        finally:
+            result.elapsed = time.perf_counter() - start
+            if self.metrics_key is not None:
+                metrics.record(self.metrics_key, f'imgreco.job.{result.name}', result.elapsed)
+        return result.value
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """cancel jobs that have not started yet"""
+        self._cancelled.set()
+        for index, future in enumerate(self.futures):
+            if future.cancel():
+                self.results[index].cancelled = True
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    def wait(self, timeout: Optional[float] = None) -> list[JobResult]:
+        """
+        Wait for all jobs and return their results in submission order.
+
+        :raises TimeoutError: if the jobs did not finish in time
+        """
+        _, not_done = concurrent.futures.wait(self.futures, timeout)
+        if not_done:
+            raise TimeoutError(f'{len(not_done)} of {len(self.futures)} recognition jobs still running')
+        return self.results
+
+    def values(self, timeout: Optional[float] = None) -> list:
+        """
+        Wait for all jobs and return their values in submission order.
+
+        :raises BatchCancelled: if the batch was cancelled before a job started
+        :raises: the first exception raised by a job
+        """
+        for result in self.wait(timeout):
+            if result.cancelled:
+                raise BatchCancelled()
+            if result.error is not None:
+                raise result.error
+        return [result.value for result in self.results]
+
+    def timings(self) -> dict[str, float]:
+        """run time of each finished job in seconds"""
+        return {result.name: result.elapsed for result in self.results if not result.cancelled}
+
+
+class RecognitionExecutor:
+    """
+    Fan recognition jobs out over a thread pool.
+
+    :param pool:        defaults to the process-wide :func:`shared_pool`
+    :param metrics_key: if given, per-job run times are recorded as ``imgreco.job.<name>``
+    """
+
+    def __init__(self, pool: Optional[concurrent.futures.Executor] = None, metrics_key=None):
+        self.pool = pool or shared_pool()
+        self.metrics_key = metrics_key
+        self._latest: dict[Hashable, RecognitionBatch] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, frame: cvimage.Image, jobs: Sequence[RecognitionJob], stream: Hashable = _UNTRACKED,
+               cancel_previous: bool = True) -> RecognitionBatch:
+        """
+        Submit jobs on a frame.
+
+        :param stream:          batches of the same stream are successive frames of one source,
+                                if omitted the batch is independent and never cancelled by a newer one
+        :param cancel_previous: cancel the previous batch of `stream` if it is still pending
+        """
+        batch = RecognitionBatch(frame, jobs, self.metrics_key)
+        if stream is not _UNTRACKED:
+            with self._lock:
+                previous = self._latest.get(stream)
+                self._latest[stream] = batch
+            if cancel_previous and previous is not None and not previous.done():
+                previous.cancel()
+        batch.futures = [self.pool.submit(batch._run, i) for i in range(len(batch.jobs))]
+        return batch
+
+    def run(self, frame: cvimage.Image, jobs: Sequence[RecognitionJob], timeout: Optional[float] = None) -> list:
+        """submit jobs outside any stream and return their values in order"""
+        return self.submit(frame, jobs).values(timeout)
+
+    def map(self, frame: cvimage.Image, func: Callable, items: Sequence, timeout: Optional[float] = None) -> list:
+        """call ``func(frame, item)`` for every item in parallel"""
+        return self.run(frame, [job(str(i), func, item) for i, item in enumerate(items)], timeout)
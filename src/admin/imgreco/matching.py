@@ -0,0 +1,182 @@
+"""
+Multi-scale template matching with an image pyramid.
+
+Templates are recorded at a ``native_resolution`` and rescaled to the height
+of the frame being searched. The search runs ``cv2.matchTemplate`` on a
+downscaled frame first to find candidate locations, then refines each
+candidate at full scale inside a small window around it. Scaled templates
+and their downscaled levels are cached per frame height.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import math
+
+import cv2
+import numpy as np
+
+from ..utils import cvimage, tracing
+from ..utils.cvimage import Rect, RectArray
+from ..utils.memcache import MemoryBoundedCache, cached
+
+# 模板金字塔缓存
+pyramid_cache = MemoryBoundedCache(64 * 1024 * 1024)
+
+# 粗匹配层中模板短边的最小像素数, 过小时粗匹配没有区分度
+MIN_COARSE_TEMPLATE_SIZE = 12
+# 粗匹配层的目标缩放比例
+COARSE_SCALE = 0.25
+
+
+@dataclass
+class Match:
+    rect: Rect
+    score: float
+    # 模板相对于 native_resolution 的缩放比例
+    scale: float
+
+
+@dataclass
+class TemplatePyramid:
+    """template rescaled for one frame height, with its coarse level"""
+    scale: float
+    template: np.ndarray
+    mask: Optional[np.ndarray]
+    coarse_scale: float
+    coarse_template: Optional[np.ndarray]
+    coarse_mask: Optional[np.ndarray]
+
+
+def template_scale(native_resolution: Optional[tuple[int, int]], frame_size: tuple[int, int]) -> float:
+    """scale factor from the resolution a template was recorded at to `frame_size`, by height"""
+    if not native_resolution:
+        return 1.0
+    return frame_size[1] / native_resolution[1]
+
+
+def _resize(arr: np.ndarray, scale: float, interpolation=cv2.INTER_AREA) -> np.ndarray:
+    if scale == 1:
+        return arr
+    size = (max(1, round(arr.shape[1] * scale)), max(1, round(arr.shape[0] * scale)))
+    return cv2.resize(arr, size, interpolation=interpolation if scale < 1 else cv2.INTER_CUBIC)
+
+
+@cached(pyramid_cache)
+def build_pyramid(template: cvimage.Image, mask: Optional[cvimage.Image], scale: float,
+                  coarse_scale: float = COARSE_SCALE) -> TemplatePyramid:
+    tmpl = _resize(template.array, scale)
+    tmask = _resize(mask.array, scale, cv2.INTER_NEAREST) if mask is not None else None
+    # 模板太小时提高粗匹配层的分辨率, 仍然太小则不做粗匹配
+    coarse_scale = max(coarse_scale, MIN_COARSE_TEMPLATE_SIZE / min(tmpl.shape[:2]))
+    if coarse_scale >= 0.75:
+        return TemplatePyramid(scale, tmpl, tmask, 1.0, None, None)
+    coarse = _resize(tmpl, coarse_scale)
+    coarse_mask = _resize(tmask, coarse_scale, cv2.INTER_NEAREST) if tmask is not None else None
+    return TemplatePyramid(scale, tmpl, tmask, coarse_scale, coarse, coarse_mask)
+
+
+def _match(frame: np.ndarray, template: np.ndarray, mask: Optional[np.ndarray]) -> np.ndarray:
+    result = cv2.matchTemplate(frame, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+    if mask is not None:
+        # 带掩码时平坦区域会得到 nan/inf
+        result = np.nan_to_num(result, nan=0.0, posinf=0.0, neginf=0.0, copy=False)
+    return result
+
+
+def _peaks(result: np.ndarray, threshold: float, limit: int, size: tuple[int, int]) -> tuple[RectArray, np.ndarray]:
+    """best locations in a matchTemplate result, with overlapping candidates suppressed"""
+    flat = result.ravel()
+    candidates = np.flatnonzero(flat >= threshold)
+    if len(candidates) == 0:
+        return RectArray(), np.zeros(0)
+    if len(candidates) > limit * 16:
+        candidates = candidates[np.argpartition(flat[candidates], -limit * 16)[-limit * 16:]]
+    ys, xs = np.divmod(candidates, result.shape[1])
+    w, h = size
+    rects = RectArray(np.stack((xs, ys, xs + w, ys + h), axis=1))
+    scores = flat[candidates]
+    keep = rects.nms(scores, 0.3, limit)
+    return rects[keep], scores[keep]
+
+
+def _frame_array(frame: cvimage.Image, mode: str) -> np.ndarray:
+    if frame.mode != mode:
+        frame = frame.convert(mode, shared=True)
+    return frame.array
+
+
+@tracing.traced('imgreco.match')
+def match_template(frame: cvimage.Image, template: cvimage.Image, mask: Optional[cvimage.Image] = None,
+                   native_resolution: Optional[tuple[int, int]] = None, threshold: float = 0.8,
+                   max_matches: int = 1, search_rect: Optional[Union[Rect, tuple]] = None,
+                   coarse_margin: float = 0.1) -> list[Match]:
+    """
+    Find `template` in `frame`, rescaling it from `native_resolution` to the frame height.
+
+    :param threshold:     minimum TM_CCOEFF_NORMED score
+    :param max_matches:   maximum number of non-overlapping matches to return
+    :param search_rect:   restrict the search to this region of the frame (frame coordinates)
+    :param coarse_margin: candidates from the coarse level scoring down to `threshold - coarse_margin` are refined
+    :return: matches in frame coordinates, best first
+    """
+    scale = template_scale(native_resolution, frame.size)
+    pyramid = build_pyramid(template, mask, round(scale, 4))
+    th, tw = pyramid.template.shape[:2]
+
+    origin_x = origin_y = 0
+    if search_rect is not None:
+        if not isinstance(search_rect, Rect):
+            search_rect = Rect.from_ltrb(*search_rect)
+        search_rect = search_rect.round()
+        origin_x, origin_y = search_rect.x, search_rect.y
+        frame = frame.subview(search_rect)
+    full = _frame_array(frame, template.mode)
+    if full.shape[0] < th or full.shape[1] < tw:
+        return []
+
+    if pyramid.coarse_template is None:
+        with tracing.span('imgreco.match.full'):
+            result = _match(full, pyramid.template, pyramid.mask)
+        rects, scores = _peaks(result, threshold, max_matches, (tw, th))
+    else:
+        c = pyramid.coarse_scale
+        coarse_frame = frame.resize((frame.width * c, frame.height * c), cvimage.BOX, shared=True)
+        coarse = _frame_array(coarse_frame, template.mode)
+        ch, cw = pyramid.coarse_template.shape[:2]
+        if coarse.shape[0] < ch or coarse.shape[1] < cw:
+            return []
+        with tracing.span('imgreco.match.coarse'):
+            result = _match(coarse, pyramid.coarse_template, pyramid.coarse_mask)
+        candidates, _ = _peaks(result, threshold - coarse_margin, max_matches * 4, (cw, ch))
+        # 在原尺寸下围绕候选位置的小窗口中精确匹配
+        pad = math.ceil(2 / c) + 1
+        windows = candidates.scale(1 / c).round()
+        found = []
+        with tracing.span('imgreco.match.refine', candidates=len(windows)):
+            for left, top, _, _ in windows.ltrb.tolist():
+                x0 = max(left - pad, 0)
+                y0 = max(top - pad, 0)
+                x1 = min(left + tw + pad, full.shape[1])
+                y1 = min(top + th + pad, full.shape[0])
+                if x1 - x0 < tw or y1 - y0 < th:
+                    continue
+                result = _match(full[y0:y1, x0:x1], pyramid.template, pyramid.mask)
+                _, score, _, (x, y) = cv2.minMaxLoc(result)
+                if score >= threshold:
+                    found.append((x0 + x, y0 + y, x0 + x + tw, y0 + y + th, score))
+        if not found:
+            return []
+        found = np.array(found)
+        rects = RectArray(found[:, :4].astype(np.int64))
+        scores = found[:, 4]
+        keep = rects.nms(scores, 0.3, max_matches)
+        rects, scores = rects[keep], scores[keep]
+
+    rects = rects.offset(origin_x, origin_y)
+    return [Match(rect, float(score), scale) for rect, score in zip(rects, scores)]
+
+
+def match_roi(frame: cvimage.Image, roi, **kwargs) -> list[Match]:
+    """match a region of interest loaded by :func:`resources.load_roi`"""
+    return match_template(frame, roi.template, roi.mask, roi.native_resolution, **kwargs)
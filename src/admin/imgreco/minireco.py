@@ -0,0 +1,152 @@
+"""
+Small-alphabet OCR for counters (sanity, currency, stage codes).
+
+A crop is binarized, split into glyphs on empty columns, and every glyph is
+normalized to the model template size. All glyphs are then classified
+together by one matrix product against the packed model from
+:func:`resources.load_minireco_model`, whose rows are zero-mean unit-norm
+templates, so each score is a correlation coefficient.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import cv2
+import numpy as np
+
+from ..utils import cvimage, tracing
+from ..utils.cvimage import Rect
+
+
+@dataclass
+class Glyph:
+    char: str
+    score: float
+    # 在输入图像中的位置
+    rect: Rect
+
+
+def binarize(img: cvimage.Image, threshold: Optional[int] = None, invert: Optional[bool] = None) -> np.ndarray:
+    """
+    Convert a crop to a uint8 mask with text as 255.
+
+    :param threshold: fixed threshold, Otsu if None
+    :param invert:    whether the text is darker than the background, guessed from the border if None
+    """
+    gray = (img.convert('L', shared=True) if img.mode != 'L' else img).array
+    if invert is None:
+        # 边框像素多为背景
+        border = np.concatenate((gray[0], gray[-1], gray[:, 0], gray[:, -1]))
+        invert = border.mean() > 127
+    flags = cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY
+    if threshold is None:
+        _, binary = cv2.threshold(gray, 0, 255, flags | cv2.THRESH_OTSU)
+    else:
+        _, binary = cv2.threshold(gray, threshold, 255, flags)
+    return binary
+
+
+def segment(binary: np.ndarray, min_height: float = 0.3, min_gap: int = 1) -> list[Rect]:
+    """
+    Split a binarized line of text into glyph boxes on empty columns.
+
+    :param min_height: glyphs shorter than this fraction of the tallest glyph are dropped as noise
+    :param min_gap:    columns of background needed to separate two glyphs
+    """
+    cols = binary.any(axis=0)
+    if not cols.any():
+        return []
+    # 前景列区间的起止
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], cols, [False])).astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    if min_gap > 1 and len(starts) > 1:
+        # 间隔过窄的相邻区间合并
+        split = starts[1:] - ends[:-1] >= min_gap
+        starts = starts[np.concatenate(([True], split))]
+        ends = ends[np.concatenate((split, [True]))]
+    rects = []
+    for left, right in zip(starts.tolist(), ends.tolist()):
+        rows = np.flatnonzero(binary[:, left:right].any(axis=1))
+        rects.append(Rect.from_ltrb(left, int(rows[0]), right, int(rows[-1]) + 1))
+    tallest = max(rect.height for rect in rects)
+    return [rect for rect in rects if rect.height >= tallest * min_height]
+
+
+def normalize_glyphs(binary: np.ndarray, rects: list[Rect], size: tuple[int, int]) -> np.ndarray:
+    """stack glyphs resized to `size` (keeping aspect ratio, centered) as zero-mean unit-norm float32 rows"""
+    width, height = size
+    out = np.zeros((len(rects), height, width), dtype=np.float32)
+    for canvas, rect in zip(out, rects):
+        glyph = binary[rect.y:rect.bottom, rect.x:rect.right]
+        scale = min(width / rect.width, height / rect.height)
+        w = max(1, min(width, round(rect.width * scale)))
+        h = max(1, min(height, round(rect.height * scale)))
+        x = (width - w) // 2
+        y = (height - h) // 2
+        canvas[y:y + h, x:x + w] = cv2.resize(glyph, (w, h), interpolation=cv2.INTER_AREA)
+    matrix = out.reshape(len(rects), -1)
+    matrix -= matrix.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norm > 0, norm, 1)
+    return matrix
+
+
+class MiniRecognizer:
+    """
+    :param model: name of a minireco model resource, or a model packed by :func:`resources.pack_minireco_model`
+    """
+
+    def __init__(self, model: Union[str, dict], filter_chars: Optional[str] = None):
+        if isinstance(model, str):
+            from ..utils import resources
+            model = resources.load_minireco_model(model, filter_chars)
+        self.chars: list[str] = model['chars']
+        self.size: tuple[int, int] = tuple(model['size'])
+        self.matrix: np.ndarray = np.ascontiguousarray(model['matrix'], dtype=np.float32)
+        self._subsets: dict[str, tuple[np.ndarray, list[str]]] = {}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} chars={"".join(self.chars)!r} size={self.size}>'
+
+    def _model_for(self, subset: Optional[str]) -> tuple[np.ndarray, list[str]]:
+        if subset is None:
+            return self.matrix, self.chars
+        cached = self._subsets.get(subset)
+        if cached is None:
+            rows = np.array([i for i, c in enumerate(self.chars) if c in subset], dtype=np.intp)
+            if len(rows) == 0:
+                raise ValueError(f'no chars of {subset!r} in model')
+            cached = (np.ascontiguousarray(self.matrix[rows]), [self.chars[i] for i in rows])
+            self._subsets[subset] = cached
+        return cached
+
+    def classify(self, glyphs: np.ndarray, subset: Optional[str] = None) -> tuple[list[str], np.ndarray]:
+        """
+        Classify normalized glyph rows from :func:`normalize_glyphs`.
+
+        :return: best char and its correlation coefficient for each glyph
+        """
+        matrix, chars = self._model_for(subset)
+        scores = glyphs @ matrix.T
+        best = scores.argmax(axis=1)
+        return [chars[i] for i in best.tolist()], scores[np.arange(len(best)), best]
+
+    @tracing.traced('imgreco.minireco')
+    def recognize_glyphs(self, img: cvimage.Image, subset: Optional[str] = None, threshold: Optional[int] = None,
+                         invert: Optional[bool] = None, min_score: float = 0.0, min_gap: int = 1) -> list[Glyph]:
+        binary = binarize(img, threshold, invert)
+        rects = segment(binary, min_gap=min_gap)
+        if not rects:
+            return []
+        chars, scores = self.classify(normalize_glyphs(binary, rects, self.size), subset)
+        return [Glyph(char, float(score), rect) for char, score, rect in zip(chars, scores.tolist(), rects)
+                if score >= min_score]
+
+    def recognize(self, img: cvimage.Image, subset: Optional[str] = None, **kwargs) -> str:
+        """recognize a single line of text, see :meth:`recognize_glyphs` for options"""
+        return ''.join(glyph.char for glyph in self.recognize_glyphs(img, subset, **kwargs))
+
+    def recognize_int(self, img: cvimage.Image, **kwargs) -> Optional[int]:
+        """recognize a number, ``None`` if no digit was found"""
+        text = self.recognize(img, '0123456789', **kwargs)
+        return int(text) if text else None
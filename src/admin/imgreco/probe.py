@@ -0,0 +1,143 @@
+"""
+Pixel probes for fast scene identification.
+
+A scene is described by a few points or small boxes with expected colors.
+All probes of all scenes are compiled into flat index arrays once per frame
+size, then a frame is checked with one fancy-indexing gather and one
+``np.add.reduceat``, without cropping or converting the frame::
+
+    probes = ProbeSet({
+        'main': [Probe((1180, 40), (255, 255, 255)), Probe((20, 20, 8, 8), (49, 49, 49), tolerance=12)],
+        'battle': [Probe((-60, 30), (200, 40, 40))],
+    }, native_resolution=(1280, 720))
+    probes.match(frame)  # -> ['main']
+
+Coordinates are in `native_resolution` and scaled by frame height, negative
+coordinates count from the right/bottom edge like Python indices, for UI
+anchored to that edge on wider screens.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Hashable, Mapping, Optional, Sequence
+
+import numpy as np
+
+from ..utils import cvimage
+
+
+@dataclass(frozen=True)
+class Probe:
+    """
+    :param rect:      ``(x, y)`` for a single pixel or ``(x, y, width, height)`` for the mean of a box
+    :param color:     expected RGB color
+    :param tolerance: maximum difference of any channel
+    """
+    rect: tuple
+    color: tuple[int, int, int]
+    tolerance: float = 16
+
+
+@dataclass
+class CompiledProbeSet:
+    """probe index arrays for one frame size"""
+    size: tuple[int, int]
+    # 所有探测像素的坐标, 按探测点依次排列
+    ys: np.ndarray
+    xs: np.ndarray
+    # 每个探测点在像素序列中的起始位置及像素数
+    pixel_starts: np.ndarray
+    pixel_counts: np.ndarray
+    expected: np.ndarray
+    tolerance: np.ndarray
+    # 每个场景在探测点序列中的起始位置
+    scene_starts: np.ndarray
+
+
+class ProbeSet:
+    def __init__(self, scenes: Optional[Mapping[Hashable, Sequence[Probe]]] = None,
+                 native_resolution: Optional[tuple[int, int]] = None):
+        self.native_resolution = native_resolution
+        self.scenes: dict[Hashable, list[Probe]] = {}
+        self._compiled: dict[tuple[int, int], CompiledProbeSet] = {}
+        if scenes:
+            for scene, probes in scenes.items():
+                self.add(scene, probes)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} scenes={len(self.scenes)} probes={sum(map(len, self.scenes.values()))}>'
+
+    def add(self, scene: Hashable, probes: Sequence[Probe]):
+        if not probes:
+            raise ValueError(f'scene {scene!r} has no probes')
+        self.scenes[scene] = list(probes)
+        self._compiled.clear()
+
+    def _scale(self, size: tuple[int, int]) -> float:
+        if not self.native_resolution:
+            return 1.0
+        return size[1] / self.native_resolution[1]
+
+    def compile(self, size: tuple[int, int]) -> CompiledProbeSet:
+        """build (and cache) the index arrays for frames of `size`"""
+        compiled = self._compiled.get(size)
+        if compiled is not None:
+            return compiled
+        width, height = size
+        scale = self._scale(size)
+        ys, xs, counts, expected, tolerance, scene_starts = [], [], [], [], [], []
+        for probes in self.scenes.values():
+            scene_starts.append(len(counts))
+            for probe in probes:
+                if len(probe.rect) == 4:
+                    x, y, w, h = probe.rect
+                    w = max(1, round(w * scale))
+                    h = max(1, round(h * scale))
+                else:
+                    # 单个像素不随分辨率放大
+                    (x, y), w, h = probe.rect, 1, 1
+                left = round((x + 0.5) * scale - 0.5) if x >= 0 else width + round(x * scale)
+                top = round((y + 0.5) * scale - 0.5) if y >= 0 else height + round(y * scale)
+                left = min(max(left, 0), width - w)
+                top = min(max(top, 0), height - h)
+                yy, xx = np.mgrid[top:top + h, left:left + w]
+                ys.append(yy.ravel())
+                xs.append(xx.ravel())
+                counts.append(w * h)
+                expected.append(probe.color)
+                tolerance.append(probe.tolerance)
+        counts = np.array(counts, dtype=np.intp)
+        compiled = CompiledProbeSet(
+            size=size,
+            ys=np.concatenate(ys).astype(np.intp),
+            xs=np.concatenate(xs).astype(np.intp),
+            pixel_starts=np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp),
+            pixel_counts=counts,
+            expected=np.array(expected, dtype=np.float32),
+            tolerance=np.array(tolerance, dtype=np.float32),
+            scene_starts=np.array(scene_starts, dtype=np.intp),
+        )
+        self._compiled[size] = compiled
+        return compiled
+
+    def evaluate(self, frame: cvimage.Image) -> np.ndarray:
+        """boolean array of whether each scene (in insertion order) matches `frame`"""
+        if not self.scenes:
+            return np.zeros(0, dtype=bool)
+        if frame.mode not in ('RGB', 'RGBA', 'RGBX'):
+            frame = frame.convert('RGB', shared=True)
+        compiled = self.compile(frame.size)
+        # 在原始缓冲区上直接取样, 只读取探测的像素
+        pixels = frame.array[compiled.ys, compiled.xs, :3]
+        sums = np.add.reduceat(pixels, compiled.pixel_starts, axis=0, dtype=np.float32)
+        means = sums / compiled.pixel_counts[:, None]
+        ok = (np.abs(means - compiled.expected).max(axis=1) <= compiled.tolerance)
+        return np.logical_and.reduceat(ok, compiled.scene_starts)
+
+    def match(self, frame: cvimage.Image) -> list:
+        """ids of scenes whose probes all match `frame`"""
+        matched = self.evaluate(frame)
+        return [scene for scene, hit in zip(self.scenes, matched) if hit]
+
+    def subset(self, scenes: Sequence[Hashable]) -> ProbeSet:
+        """probe set of only the given scenes"""
+        return ProbeSet({scene: self.scenes[scene] for scene in scenes}, self.native_resolution)
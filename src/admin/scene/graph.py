@@ -0,0 +1,240 @@
+"""
+Declarative scene graph.
+
+A scene is a screen of the game, identified by pixel probes (see
+:mod:`imgreco.probe`) and/or a recognizer function. A transition is an input
+action that leads from one scene to another. Scenes marked ``anywhere``
+(popups, loading screens, network errors) may appear after any scene.
+
+Recognizers take a :class:`FrameContext`, which caches results per frame, so
+sub-checks shared by several scenes (a back button, a template match) run at
+most once per frame::
+
+    graph = SceneGraph('example', native_resolution=(1280, 720))
+    graph.add_scene('main', probes=[Probe((1180, 40), (255, 255, 255))])
+    graph.add_scene('loading', recognizer=lambda ctx: ctx.frame.array.max() < 16, anywhere=True, priority=10)
+    graph.add_transition('main', 'settings', tap(1230, 40))
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Iterable, Optional, Sequence, TYPE_CHECKING
+
+import heapq
+import threading
+
+from ..imgreco.probe import Probe, ProbeSet
+from ..utils import cvimage
+
+if TYPE_CHECKING:
+    from ..adb.adb_controller import AdbOperate
+
+
+class FrameContext:
+    """one frame and the recognizer results computed on it"""
+
+    def __init__(self, frame: cvimage.Image, graph: Optional[SceneGraph] = None):
+        self.frame = frame
+        self.graph = graph
+        self._results: dict[Hashable, Any] = {}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.frame!r} results={len(self._results)}>'
+
+    def cached(self, key: Hashable, func: Callable[[cvimage.Image], Any]):
+        """result of ``func(frame)``, computed once per frame for `key`"""
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+        value = self._results[key] = func(self.frame)
+        return value
+
+    def match(self, roi, **kwargs):
+        """template matches of a region of interest, see :func:`matching.match_roi`"""
+        from ..imgreco.matching import match_roi
+        key = ('match', roi.name, tuple(sorted(kwargs.items())))
+        return self.cached(key, lambda frame: match_roi(frame, roi, **kwargs))
+
+    def probe(self, probes: ProbeSet) -> list:
+        """scenes of `probes` matching the frame"""
+        return self.cached(('probe', id(probes)), probes.match)
+
+    def scale(self, x: float, y: float) -> tuple[int, int]:
+        """map a point from the native resolution of the graph to the frame, like probe coordinates"""
+        native = self.graph.native_resolution if self.graph is not None else None
+        width, height = self.frame.size
+        scale = height / native[1] if native else 1.0
+        return (round(x * scale) if x >= 0 else width + round(x * scale),
+                round(y * scale) if y >= 0 else height + round(y * scale))
+
+
+Recognizer = Callable[[FrameContext], bool]
+Action = Callable[['AdbOperate', FrameContext], Any]
+
+
+@dataclass
+class Scene:
+    """
+    :param probes:     pixel probes that must all match, checked before `recognizer`
+    :param recognizer: called with the :class:`FrameContext`, must return whether the frame shows this scene
+    :param anywhere:   the scene can follow any scene, e.g. popups and loading screens
+    :param priority:   when several scenes match a frame, the highest priority wins
+    """
+    id: str
+    probes: Sequence[Probe] = ()
+    recognizer: Optional[Recognizer] = None
+    anywhere: bool = False
+    priority: int = 0
+    description: str = ''
+
+    def __post_init__(self):
+        if not self.probes and self.recognizer is None:
+            raise ValueError(f'scene {self.id!r} needs probes or a recognizer')
+
+
+@dataclass
+class Transition:
+    source: str
+    target: str
+    action: Action
+    # 路径规划时的代价, 如预计耗时
+    cost: float = 1.0
+    # 执行动作后等待进入目标场景的时间 (秒)
+    timeout: float = 10.0
+    name: str = ''
+
+
+class SceneGraph:
+    def __init__(self, name: str, native_resolution: Optional[tuple[int, int]] = None):
+        self.name = name
+        self.native_resolution = native_resolution
+        self.scenes: dict[str, Scene] = {}
+        self.transitions: dict[str, list[Transition]] = {}
+        self.probes = ProbeSet(native_resolution=native_resolution)
+        self._candidates: dict[Optional[str], tuple[str, ...]] = {}
+        self._probe_subsets: dict[tuple[str, ...], ProbeSet] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} scenes={len(self.scenes)} transitions={sum(map(len, self.transitions.values()))}>'
+
+    def _changed(self):
+        with self._lock:
+            self._candidates.clear()
+            self._probe_subsets.clear()
+
+    def add_scene(self, id: str, probes: Sequence[Probe] = (), recognizer: Optional[Recognizer] = None,
+                  anywhere: bool = False, priority: int = 0, description: str = '') -> Scene:
+        if id in self.scenes:
+            raise ValueError(f'scene {id!r} already defined')
+        scene = Scene(id, tuple(probes), recognizer, anywhere, priority, description)
+        self.scenes[id] = scene
+        self.transitions.setdefault(id, [])
+        if scene.probes:
+            self.probes.add(id, scene.probes)
+        self._changed()
+        return scene
+
+    def scene(self, id: str, probes: Sequence[Probe] = (), **kwargs):
+        """decorator registering a recognizer function as a scene"""
+        def decorator(func: Recognizer):
+            self.add_scene(id, probes, func, **kwargs)
+            return func
+        return decorator
+
+    def add_transition(self, source: str, target: str, action: Action, cost: float = 1.0, timeout: float = 10.0,
+                       name: str = '') -> Transition:
+        for scene in (source, target):
+            if scene not in self.scenes:
+                raise KeyError(f'unknown scene {scene!r}')
+        transition = Transition(source, target, action, cost, timeout, name or f'{source}->{target}')
+        self.transitions[source].append(transition)
+        self._changed()
+        return transition
+
+    def candidates(self, current: Optional[str]) -> tuple[str, ...]:
+        """
+        Scenes that may follow `current`: itself, targets of its transitions and ``anywhere`` scenes.
+
+        All scenes if `current` is None. Sorted by descending priority.
+        """
+        with self._lock:
+            cached = self._candidates.get(current)
+            if cached is not None:
+                return cached
+            if current is None:
+                ids = set(self.scenes)
+            else:
+                ids = {current, *(t.target for t in self.transitions.get(current, ())),
+                       *(scene.id for scene in self.scenes.values() if scene.anywhere)}
+            # 保持定义顺序, 再按优先级排序
+            result = tuple(sorted((id for id in self.scenes if id in ids), key=lambda id: -self.scenes[id].priority))
+            self._candidates[current] = result
+            return result
+
+    def probe_subset(self, candidates: tuple[str, ...]) -> ProbeSet:
+        """probe set of the candidates that have probes, compiled index arrays are kept across frames"""
+        with self._lock:
+            subset = self._probe_subsets.get(candidates)
+            if subset is None:
+                subset = self.probes.subset([id for id in candidates if self.scenes[id].probes])
+                self._probe_subsets[candidates] = subset
+            return subset
+
+    def path(self, source: str, target: str) -> Optional[list[Transition]]:
+        """cheapest sequence of transitions from `source` to `target`, None if unreachable"""
+        if source == target:
+            return []
+        best = {source: 0.0}
+        queue = [(0.0, 0, source, [])]
+        counter = 1
+        while queue:
+            cost, _, scene, path = heapq.heappop(queue)
+            if scene == target:
+                return path
+            if cost > best.get(scene, float('inf')):
+                continue
+            for transition in self.transitions.get(scene, ()):
+                next_cost = cost + transition.cost
+                if next_cost < best.get(transition.target, float('inf')):
+                    best[transition.target] = next_cost
+                    heapq.heappush(queue, (next_cost, counter, transition.target, path + [transition]))
+                    counter += 1
+        return None
+
+    def identify(self, ctx: FrameContext, candidates: Iterable[str]) -> Optional[str]:
+        """highest priority scene among `candidates` matching the frame"""
+        candidates = tuple(candidates)
+        probe_set = self.probe_subset(candidates)
+        probed = set(ctx.probe(probe_set)) if probe_set.scenes else set()
+        for id in candidates:
+            scene = self.scenes[id]
+            if scene.probes and id not in probed:
+                continue
+            if scene.recognizer is None or scene.recognizer(ctx):
+                return id
+        return None
+
+
+def tap(x: float, y: float, hold_time: float = 0) -> Action:
+    """action tapping a point given in the native resolution of the graph"""
+    def action(input: AdbOperate, ctx: FrameContext):
+        input.touch_tap(*ctx.scale(x, y), hold_time)
+    return action
+
+
+def tap_match(roi, **kwargs) -> Action:
+    """action tapping the center of the best template match of `roi`"""
+    def action(input: AdbOperate, ctx: FrameContext):
+        matches = ctx.match(roi, **kwargs)
+        if not matches:
+            raise LookupError(f'{roi.name} not found')
+        rect = matches[0].rect
+        input.touch_tap(round(rect.x + rect.width / 2), round(rect.y + rect.height / 2))
+    return action
+
+
+def press_key(keycode: int) -> Action:
+    def action(input: AdbOperate, ctx: FrameContext):
+        input.send_key(keycode)
+    return action
@@ -0,0 +1,162 @@
+"""
+Runtime tracking the current scene of a :class:`SceneGraph`.
+
+Each frame is checked only against the scenes reachable from the last known
+scene. Only after `fallback_after` consecutive frames match none of them
+(loading screens, animations) are the remaining scenes scanned as well. A
+scene found that way counts ``scene.fallback``, so a graph missing a
+transition shows up in the metrics instead of costing a full scan every frame.
+"""
+from __future__ import annotations
+from typing import Callable, Optional, TYPE_CHECKING
+
+import logging
+import time
+
+from ..utils import cvimage, metrics, tracing
+from .graph import FrameContext, SceneGraph, Transition
+
+if TYPE_CHECKING:
+    from ..adb.adb_controller import AdbOperate
+
+logger = logging.getLogger(__name__)
+
+
+class SceneNotReached(Exception):
+    pass
+
+
+class SceneRuntime:
+    """
+    :param screenshot: returns a fresh frame, e.g. ``functools.partial(controller.screenshot, cached=False)``
+    :param input:      target of transition actions
+    :param fallback_after: consecutive unmatched frames before all scenes are checked
+    """
+
+    def __init__(self, graph: SceneGraph, screenshot: Callable[[], cvimage.Image], input: AdbOperate,
+                 metrics_key=None, fallback_after: int = 5):
+        self.graph = graph
+        self.screenshot = screenshot
+        self.input = input
+        self.metrics_key = metrics_key or graph.name
+        self.fallback_after = fallback_after
+        self.current: Optional[str] = None
+        self.context: Optional[FrameContext] = None
+        # 连续未匹配到可达场景的帧数
+        self._misses = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.graph.name} current={self.current}>'
+
+    @tracing.traced('scene.identify')
+    def identify(self, frame: Optional[cvimage.Image] = None) -> Optional[str]:
+        """
+        Identify the scene of `frame` (a new screenshot if None) and make it the current scene.
+
+        :return: the scene id, or None if no checked scene matches (the current scene is kept)
+        """
+        if frame is None:
+            frame = self.screenshot()
+        ctx = FrameContext(frame, self.graph)
+        self.context = ctx
+        with metrics.timer(self.metrics_key, 'scene.identify'):
+            candidates = self.graph.candidates(self.current)
+            scene = self.graph.identify(ctx, candidates)
+            if scene is not None or self.current is None:
+                self._misses = 0
+            else:
+                self._misses += 1
+                if self._misses >= self.fallback_after:
+                    # 可能漏定义了转移, 在全部场景中查找; 仍未找到时再等 fallback_after 帧
+                    self._misses = 0
+                    rest = [id for id in self.graph.candidates(None) if id not in candidates]
+                    scene = self.graph.identify(ctx, rest)
+                    if scene is not None:
+                        metrics.count(self.metrics_key, 'scene.fallback')
+                        logger.debug('scene %s is not reachable from %s in graph %s', scene, self.current,
+                                     self.graph.name)
+        if scene is not None and scene != self.current:
+            logger.debug('scene: %s -> %s', self.current, scene)
+            self.current = scene
+        return scene
+
+    def wait_for(self, targets, timeout: float, interval: float = 0) -> str:
+        """
+        Identify frames until one of `targets` is shown.
+
+        :raises SceneNotReached: on timeout
+        """
+        if isinstance(targets, str):
+            targets = (targets,)
+        deadline = time.monotonic() + timeout
+        while True:
+            scene = self.identify()
+            if scene in targets:
+                return scene
+            if time.monotonic() >= deadline:
+                raise SceneNotReached(f'expected {"/".join(targets)}, got {scene}')
+            if interval:
+                time.sleep(interval)
+
+    def perform(self, transition: Transition):
+        """run the action of a transition from the current frame and wait for its target"""
+        if self.context is None or self.current != transition.source:
+            self.identify()
+        if self.current != transition.source:
+            raise SceneNotReached(f'{transition.name} requires {transition.source}, got {self.current}')
+        with tracing.span('scene.transition', transition=transition.name):
+            transition.action(self.input, self.context)
+            deadline = time.monotonic() + transition.timeout
+            while True:
+                scene = self.identify()
+                if scene == transition.target:
+                    return
+                # 停在其他可操作的场景 (如弹窗) 时交给调用方处理; 没有出边的场景 (如加载中) 继续等待
+                if scene not in (None, transition.source) and self.graph.transitions.get(scene):
+                    raise SceneNotReached(f'{transition.name} ended in {scene}')
+                if time.monotonic() >= deadline:
+                    raise SceneNotReached(f'{transition.name} timed out in {scene}')
+
+    def goto(self, target: str, max_steps: int = 32):
+        """
+        Navigate to `target` along the cheapest path, replanning when an unexpected scene shows up.
+
+        :raises SceneNotReached: if the target is unreachable or a step times out
+        """
+        for _ in range(max_steps):
+            if self.current is None or self.context is None:
+                self.identify()
+            if self.current == target:
+                return
+            if self.current is None:
+                raise SceneNotReached(f'current scene unknown, cannot navigate to {target}')
+            path = self.graph.path(self.current, target)
+            if not path:
+                raise SceneNotReached(f'no path from {self.current} to {target}')
+            transition = path[0]
+            try:
+                self.perform(transition)
+            except SceneNotReached:
+                # 出现了弹窗等其他场景时, 从当前场景重新规划
+                if self.current == transition.source:
+                    raise
+                logger.debug('%s ended in %s, replanning', transition.name, self.current)
+        raise SceneNotReached(f'{target} not reached in {max_steps} steps')
+
+    def run(self, handlers: dict[str, Callable[[SceneRuntime, FrameContext], Optional[bool]]],
+            stop: Optional[Callable[[], bool]] = None):
+        """
+        Identify every frame and call the handler of its scene, at the rate the screenshots allow.
+
+        A handler returning True stops the loop.
+        """
+        # 以设备名登记当前线程, 便于按设备采样分析
+        tracing.register_worker(self.metrics_key)
+        try:
+            while stop is None or not stop():
+                scene = self.identify()
+                handler = handlers.get(scene)
+                if handler is not None and handler(self, self.context):
+                    return
+        finally:
+            tracing.unregister_worker(self.metrics_key)
@@ -1 +1 @@
-import sys_utils
\ No newline at end of file
+from . import sys_utils
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Flat file layout shared by :mod:`resource_bundle` and :mod:`model_file`::
+
+    magic (4 bytes) | version u32 | header length u64 | header (JSON, utf-8) | padding | arrays (64-byte aligned)
+
+Arrays are described in the header as ``{offset, shape, dtype}`` with
+`offset` relative to the start of the array section, and are read back as
+zero-copy views into the buffer (usually an ``mmap``) holding the file.
+"""
+from __future__ import annotations
+from typing import Union
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+_HEADER = struct.Struct('<4sIQ')
+_ALIGN = 64
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class ArrayFileWriter:
+    """collects arrays, then writes them with a JSON header in one go"""
+
+    def __init__(self):
+        self.arrays: list[tuple[int, np.ndarray]] = []
+        # 数组区的总字节数
+        self.size = 0
+
+    def add_array(self, arr: np.ndarray) -> dict:
+        """queue an array and return its descriptor for the header"""
+        arr = np.ascontiguousarray(arr)
+        offset = _align(self.size)
+        self.arrays.append((offset, arr))
+        self.size = offset + arr.nbytes
+        return {'offset': offset, 'shape': list(arr.shape), 'dtype': arr.dtype.str}
+
+    def write(self, path: Union[str, os.PathLike], magic: bytes, version: int, header: dict):
+        """write the file atomically through a temporary file next to `path`"""
+        header = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        data_start = _align(_HEADER.size + len(header))
+        tmp = str(path) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(magic, version, len(header)))
+            f.write(header)
+            for offset, arr in self.arrays:
+                f.seek(data_start + offset)
+                f.write(arr.data)
+            f.truncate(data_start + self.size)
+        os.replace(tmp, path)
+
+
+def read_header(buffer, magic: bytes) -> tuple[int, dict, int]:
+    """
+    Parse the header of a file in `buffer`.
+
+    :return: file version, decoded JSON header and start of the array section
+    :raises ValueError: if the buffer does not start with `magic`
+    """
+    if len(buffer) < _HEADER.size:
+        raise ValueError('file too short')
+    file_magic, version, header_len = _HEADER.unpack_from(buffer, 0)
+    if file_magic != magic:
+        raise ValueError(f'bad magic {file_magic!r}')
+    header = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + header_len]).decode('utf-8'))
+    return version, header, _align(_HEADER.size + header_len)
+
+
+def array_view(buffer, data_start: int, desc: dict, dtype=None) -> np.ndarray:
+    """
+    Read-only view of the array described by `desc`.
+
+    :raises ValueError: if the array extends past the end of the buffer
+    """
+    dtype = np.dtype(desc['dtype']) if dtype is None else dtype
+    shape = tuple(desc['shape'])
+    count = int(np.prod(shape))
+    offset = data_start + desc['offset']
+    if offset + count * dtype.itemsize > len(buffer):
+        raise ValueError(f'array at offset {desc["offset"]} is truncated')
+    arr = np.frombuffer(buffer, dtype, count, offset).reshape(shape)
+    arr.flags.writeable = False
+    return arr
+
+
+def close_buffer(buffer):
+    """close `buffer` if it is an ``mmap``"""
+    if isinstance(buffer, mmap.mmap):
+        try:
+            buffer.close()
+        except BufferError:
+            # views handed out are still alive, the mapping goes away with them
+            pass
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Optional, overload
+from typing import Optional, overload, TYPE_CHECKING
 from numbers import Real
 
 import builtins
@@ -10,12 +10,14 @@ import io
 import math
 import warnings
 import contextlib
+import threading
 from pathlib import Path
 
 import cv2
 import numpy as np
 
-from PIL import Image as PILImage
+if TYPE_CHECKING:
+    from PIL import Image as PILImage
 
 
 def isPath(f):
@@ -193,10 +195,202 @@ class Rect:
         return self.scale(scale).round()
 
     def __iter__(self):
-        return iter((self.x, self.y, self.right(), self.bottom()))
+        return iter(self.ltrb)
+
+
+class RectArray:
+    """
+    A batch of rectangles backed by an (N, 4) array of (left, top, right, bottom).
+
+    Geometry is vectorized over the whole batch, e.g. for post-processing template match candidates.
+    Indexing with an integer returns a :class:`Rect`, indexing with a slice or mask returns a RectArray.
+    """
+    __slots__ = ('_ltrb',)
+
+    def __init__(self, ltrb=()):
+        arr = np.asarray(ltrb)
+        if arr.dtype.kind not in 'iuf':
+            arr = arr.astype(np.float64)
+        self._ltrb = arr.reshape(-1, 4)
+
+    @classmethod
+    def from_ltrb(cls, ltrb) -> RectArray:
+        return cls(ltrb)
+
+    @classmethod
+    def from_xywh(cls, xywh) -> RectArray:
+        xywh = np.asarray(xywh).reshape(-1, 4)
+        return cls(np.concatenate((xywh[:, :2], xywh[:, :2] + xywh[:, 2:]), axis=1))
+
+    @classmethod
+    def from_rects(cls, rects) -> RectArray:
+        return cls([rect.ltrb for rect in rects])
+
+    @classmethod
+    def concatenate(cls, arrays) -> RectArray:
+        return cls(np.concatenate([a.ltrb for a in arrays]))
+
+    def __len__(self):
+        return len(self._ltrb)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return Rect.from_ltrb(*self._ltrb[item].tolist())
+        return RectArray(self._ltrb[item])
+
+    def __iter__(self):
+        for ltrb in self._ltrb.tolist():
+            yield Rect.from_ltrb(*ltrb)
+
+    def __array__(self, dtype=None):
+        return self._ltrb if dtype is None else self._ltrb.astype(dtype)
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} n={len(self)} dtype={self._ltrb.dtype}>'
+
+    def to_rects(self) -> list[Rect]:
+        return list(self)
+
+    @property
+    def ltrb(self) -> np.ndarray:
+        return self._ltrb
+
+    @property
+    def xywh(self) -> np.ndarray:
+        return np.concatenate((self._ltrb[:, :2], self._ltrb[:, 2:] - self._ltrb[:, :2]), axis=1)
+
+    @property
+    def left(self) -> np.ndarray:
+        return self._ltrb[:, 0]
+
+    @property
+    def top(self) -> np.ndarray:
+        return self._ltrb[:, 1]
+
+    @property
+    def right(self) -> np.ndarray:
+        return self._ltrb[:, 2]
+
+    @property
+    def bottom(self) -> np.ndarray:
+        return self._ltrb[:, 3]
+
+    @property
+    def width(self) -> np.ndarray:
+        return self._ltrb[:, 2] - self._ltrb[:, 0]
+
+    @property
+    def height(self) -> np.ndarray:
+        return self._ltrb[:, 3] - self._ltrb[:, 1]
+
+    @property
+    def area(self) -> np.ndarray:
+        return np.maximum(self.width, 0) * np.maximum(self.height, 0)
+
+    def round(self) -> RectArray:
+        """return a RectArray that rounded to nearest integer"""
+        return RectArray(np.rint(self._ltrb).astype(np.int64))
+
+    def scale(self, scale) -> RectArray:
+        """return a RectArray that scaled by given factor"""
+        return RectArray(self._ltrb * scale)
+
+    def iscale(self, scale) -> RectArray:
+        """return a RectArray that scaled by given factor and rounded to nearest integer"""
+        return self.scale(scale).round()
+
+    def offset(self, dx, dy) -> RectArray:
+        return RectArray(self._ltrb + np.array([dx, dy, dx, dy], dtype=np.result_type(self._ltrb, dx, dy)))
+
+    @staticmethod
+    def _as_ltrb(other) -> np.ndarray:
+        if isinstance(other, RectArray):
+            return other.ltrb
+        if isinstance(other, Rect):
+            return np.array([other.ltrb])
+        return np.asarray(other).reshape(-1, 4)
+
+    def intersect(self, other) -> RectArray:
+        """
+        Element-wise intersection with `other` (a Rect, or a RectArray of the same length).
+
+        Disjoint pairs give empty rectangles (zero width or height).
+        """
+        o = self._as_ltrb(other)
+        lt = np.maximum(self._ltrb[:, :2], o[:, :2])
+        rb = np.maximum(np.minimum(self._ltrb[:, 2:], o[:, 2:]), lt)
+        return RectArray(np.concatenate((lt, rb), axis=1))
+
+    def iou(self, other=None) -> np.ndarray:
+        """
+        Pairwise intersection over union, an (N, M) matrix.
+
+        :param other: Rect or RectArray, defaults to this array itself
+        """
+        a = self._ltrb
+        b = a if other is None else self._as_ltrb(other)
+        lt = np.maximum(a[:, None, :2], b[None, :, :2])
+        rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+        wh = np.clip(rb - lt, 0, None)
+        inter = wh[..., 0] * wh[..., 1]
+        area_a = np.prod(np.clip(a[:, 2:] - a[:, :2], 0, None), axis=1)
+        area_b = np.prod(np.clip(b[:, 2:] - b[:, :2], 0, None), axis=1)
+        union = area_a[:, None] + area_b[None, :] - inter
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, inter / union, 0.0)
+
+    def nms(self, scores, threshold: float = 0.5, max_output: Optional[int] = None) -> np.ndarray:
+        """
+        Greedy non-maximum suppression.
+
+        :param scores:     score of every rectangle, higher is better
+        :param threshold:  suppress rectangles overlapping a better one with IoU above this
+        :param max_output: stop after keeping this many rectangles
+        :return: indices of kept rectangles, best first
+        """
+        order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+        keep = []
+        while len(order):
+            best = order[0]
+            keep.append(best)
+            if max_output is not None and len(keep) >= max_output:
+                break
+            rest = order[1:]
+            overlap = self[best:best + 1].iou(self[rest])[0]
+            order = rest[overlap <= threshold]
+        return np.array(keep, dtype=np.intp)
+
+    def contains_points(self, points) -> np.ndarray:
+        """(N, M) mask of whether each rectangle contains each (x, y) point, right and bottom edges excluded"""
+        pts = np.asarray(points).reshape(-1, 2)
+        x = pts[None, :, 0]
+        y = pts[None, :, 1]
+        a = self._ltrb
+        return (a[:, None, 0] <= x) & (x < a[:, None, 2]) & (a[:, None, 1] <= y) & (y < a[:, None, 3])
+
+    def contains(self, other) -> np.ndarray:
+        """(N, M) mask of whether each rectangle fully contains each rectangle of `other`"""
+        a = self._ltrb
+        b = self._as_ltrb(other)
+        return np.all(a[:, None, :2] <= b[None, :, :2], axis=2) & np.all(a[:, None, 2:] >= b[None, :, 2:], axis=2)
+
+# 每帧最多缓存的派生图像数, 超出后丢弃最早的
+_DERIVED_LIMIT = 4
+_derived_lock = threading.Lock()
+
 
 class Image:
-    timestamp: Optional[float] = None
+    """
+    Image backed by a numpy array, with a PIL-like interface.
+
+    :meth:`convert` and :meth:`resize` return new writable images. With ``shared=True`` they return
+    a read-only result cached on the image instead (a few per frame), so recognizers asking for the
+    same view of a frame compute it once. Call :meth:`invalidate` after modifying the array in place.
+    """
+    __slots__ = ('_mat', '_mode', 'timestamp', '_derived', '__weakref__')
+
+    timestamp: Optional[float]
+
     def __init__(self, mat: np.ndarray, mode=None):
         self._mat = mat
         valid_modes = _get_valid_modes(mat.shape, mat.dtype)
@@ -205,6 +399,37 @@ class Image:
         if mode is None and len(valid_modes) > 1:
             warnings.warn(f"multiple mode inferred from array shape {mat.shape!r} and dtype {mat.dtype!r}: {' '.join(valid_modes)}, you might want to explicitly specify a mode")
         self._mode = mode or valid_modes[0]
+        self.timestamp = None
+        # (操作, 参数) -> 派生图像
+        self._derived: Optional[dict] = None
+
+    def _derive(self, key, compute, shared: bool) -> Image:
+        with _derived_lock:
+            image = self._derived.get(key) if self._derived is not None else None
+        if image is not None:
+            if shared:
+                return image
+            image = image.copy()
+            image.timestamp = self.timestamp
+            return image
+        # 在锁外计算, 同一帧可能在多个识别线程中并发派生
+        image = compute()
+        image.timestamp = self.timestamp
+        if not shared:
+            return image
+        image._mat.flags.writeable = False
+        with _derived_lock:
+            if self._derived is None:
+                self._derived = {}
+            image = self._derived.setdefault(key, image)
+            while len(self._derived) > _DERIVED_LIMIT:
+                del self._derived[next(iter(self._derived))]
+        return image
+
+    def invalidate(self):
+        """drop cached derived images, must be called after the array is modified in place"""
+        with _derived_lock:
+            self._derived = None
 
     # for use with numpy.asarray
     def __array__(self, dtype=None):
@@ -275,9 +500,14 @@ class Image:
         return Image(newmat, self.mode)
 
     def crop(self, rect):
-        return self.subview(rect).copy()
+        view = self.subview(rect)
+        # 只读图像无需复制
+        if not self._mat.flags.writeable:
+            return view
+        return view.copy()
     
-    def convert(self, mode=None, matrix=NotImplemented, dither=NotImplemented, palette=NotImplemented, colors=NotImplemented) -> Image:
+    def convert(self, mode=None, matrix=NotImplemented, dither=NotImplemented, palette=NotImplemented, colors=NotImplemented,
+                shared=False) -> Image:
         if matrix is not NotImplemented or dither is not NotImplemented or palette is not NotImplemented or colors is not NotImplemented:
             raise NotImplementedError()
         from_cv_mode = pil_mode_mapping[self.mode]
@@ -293,9 +523,11 @@ class Image:
                 target_cv_mode = 'GRAY'
                 target_pil_mode = self.mode
         elif mode == '1':
-            limg = self.convert('L') if self.mode != 'L' else self
-            _, newmat = cv2.threshold(limg.array, 127, 1, cv2.THRESH_BINARY)
-            return Image(newmat.astype(bool), '1')
+            def threshold():
+                limg = self.convert('L', shared=True) if self.mode != 'L' else self
+                _, newmat = cv2.threshold(limg.array, 127, 1, cv2.THRESH_BINARY)
+                return Image(newmat.astype(bool), '1')
+            return self._derive(('convert', '1'), threshold, shared)
         else:
             target_cv_mode = pil_mode_mapping[mode]
             target_pil_mode = mode
@@ -311,8 +543,8 @@ class Image:
             conv = getattr(cv2, f'COLOR_{from_cv_mode}2{target_cv_mode}', None)
             if conv is None:
                 raise NotImplementedError(f'conversion from {self.mode} to {mode} not implemented yet')
-            newmat = cv2.cvtColor(self._mat, conv)
-            return Image(newmat, target_pil_mode)
+            return self._derive(('convert', target_pil_mode), lambda: Image(cv2.cvtColor(self._mat, conv), target_pil_mode),
+                                shared)
     
     def getbbox(self):
         mat = self._mat
@@ -398,14 +630,15 @@ class Image:
         newmat = cv2.warpAffine(self._mat, np.array(matrix).reshape(2, 3), (w,h), flags=resample, borderMode=cv2.BORDER_CONSTANT, borderValue=fillcolor)
         return Image(newmat, self.mode)
 
-    def resize(self, size, resample=None, box=NotImplemented, reducing_gap=NotImplemented):
+    def resize(self, size, resample=None, box=NotImplemented, reducing_gap=NotImplemented, shared=False):
         if resample is None:
             if self.mode == '1':
                 resample = NEAREST
             else:
                 resample = BICUBIC
-        newmat = cv2.resize(self._mat, (int(round(size[0])), int(round(size[1]))), interpolation=resample)
-        return Image(newmat, self.mode)
+        dsize = (int(round(size[0])), int(round(size[1])))
+        return self._derive(('resize', dsize, resample),
+                            lambda: Image(cv2.resize(self._mat, dsize, interpolation=resample), self.mode), shared)
 
     def save(self, fp, format=None, imwrite_params=None, **params):
         filename = ""
@@ -491,6 +724,7 @@ class Image:
             ystep = -1
         fulllen = ystride * h
         contmat = np.lib.stride_tricks.as_strided(mat[::ystep, ...], shape=(fulllen,), strides=(1,))
+        from PIL import Image as PILImage
         return PILImage.frombuffer(real_pil_mode, (w, h), contmat, 'raw', pil_internal_mode, ystride, ystep), mat is not oldmat
 
 def _test():
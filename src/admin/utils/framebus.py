@@ -0,0 +1,280 @@
+"""
+Shared-memory frame bus for passing screenshots between processes.
+
+A capture process creates the bus and publishes :class:`cvimage.Image` frames
+into a ring of fixed-size slots. Recognition or monitoring processes attach to
+the bus by name and get zero-copy ``Image`` views onto the slot memory.
+
+Every slot carries a sequence counter (seqlock): the writer bumps it to an odd
+value before touching the slot and to the next even value afterwards, so
+readers never need a lock -- they read the counter, use the pixels, and check
+the counter again to find out whether the frame was overwritten meanwhile.
+The bus assumes a single publisher.
+"""
+from __future__ import annotations
+from typing import Optional
+
+import logging
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import cvimage
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'AXFB'
+_VERSION = 1
+
+_BUS_HEADER = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('slot_count', '<u4'),
+    ('slot_capacity', '<u4'),
+    ('latest', '<u8'),
+    ('reserved', 'V40'),
+])
+
+_SLOT_HEADER = np.dtype([
+    ('seq', '<u8'),
+    ('frame', '<u8'),
+    ('timestamp', '<f8'),
+    ('published', '<f8'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('channels', '<u4'),
+    ('colorspace', '<i4'),
+    ('mode', 'S8'),
+    ('dtype', 'S8'),
+])
+
+_ALIGN = 64
+
+# 本进程创建的共享内存名称, 在此进程内 attach 时不能注销创建者的 resource_tracker 记录
+_created_names: set[str] = set()
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class FrameOverwrittenError(RuntimeError):
+    """the slot was reused by the publisher while the frame was being read"""
+
+
+class FrameView:
+    """
+    A frame read from the bus.
+
+    ``image`` is a read-only view into shared memory, it stays valid only as
+    long as :meth:`valid` returns True. Use :meth:`copy` to detach the frame.
+    """
+
+    def __init__(self, bus: FrameBus, slot: int, seq: int, frame: int, image: cvimage.Image, colorspace: int,
+                 published: float):
+        self.bus = bus
+        self.slot = slot
+        self.seq = seq
+        self.frame = frame
+        self.image = image
+        self.colorspace = colorspace
+        self.published = published
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} frame={self.frame} slot={self.slot} image={self.image}>'
+
+    def valid(self) -> bool:
+        """whether the slot still holds this frame"""
+        return int(self.bus._slot_headers['seq'][self.slot]) == self.seq
+
+    def copy(self) -> cvimage.Image:
+        """
+        Copy the frame out of shared memory.
+
+        :raises FrameOverwrittenError: the publisher reused the slot during the copy
+        """
+        result = self.image.copy()
+        if not self.valid():
+            raise FrameOverwrittenError(f'frame {self.frame} was overwritten')
+        result.timestamp = self.image.timestamp
+        return result
+
+
+class FrameBus:
+    """
+    Ring of shared memory slots holding screenshots.
+
+    Use :meth:`create` in the capture process and :meth:`attach` everywhere else.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        buf = shm.buf
+        self._header = np.ndarray((), dtype=_BUS_HEADER, buffer=buf)
+        if self._header['magic'] != _MAGIC or self._header['version'] != _VERSION:
+            raise ValueError(f'{shm.name} is not a frame bus')
+        self.slot_count = int(self._header['slot_count'])
+        self.slot_capacity = int(self._header['slot_capacity'])
+        self._slot_headers = np.ndarray((self.slot_count,), dtype=_SLOT_HEADER, buffer=buf,
+                                        offset=_BUS_HEADER.itemsize)
+        self._data_offset = _align(_BUS_HEADER.itemsize + _SLOT_HEADER.itemsize * self.slot_count)
+
+    @classmethod
+    def create(cls, name: Optional[str], max_width: int, max_height: int, channels: int = 4,
+               slot_count: int = 4) -> FrameBus:
+        """
+        Allocate a new frame bus.
+
+        :param name:       shared memory name, a random one is picked if `None`
+        :param max_width:  largest frame width the bus will carry
+        :param max_height: largest frame height the bus will carry
+        :param channels:   largest channel count (uint8 per channel)
+        :param slot_count: number of frames kept in the ring
+        """
+        slot_capacity = _align(max_width * max_height * channels)
+        data_offset = _align(_BUS_HEADER.itemsize + _SLOT_HEADER.itemsize * slot_count)
+        shm = shared_memory.SharedMemory(name, create=True, size=data_offset + slot_capacity * slot_count)
+        header = np.ndarray((), dtype=_BUS_HEADER, buffer=shm.buf)
+        header['magic'] = _MAGIC
+        header['version'] = _VERSION
+        header['slot_count'] = slot_count
+        header['slot_capacity'] = slot_capacity
+        header['latest'] = 0
+        del header
+        _created_names.add(shm.name)
+        logger.debug('created frame bus %s with %d slots of %d bytes', shm.name, slot_count, slot_capacity)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> FrameBus:
+        """attach to a frame bus created by another process"""
+        # the creator owns the segment, don't let our resource tracker unlink it on exit
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Python < 3.13
+            shm = shared_memory.SharedMemory(name)
+            if shm.name not in _created_names:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def latest_frame(self) -> int:
+        """number of the last published frame, 0 if nothing was published yet"""
+        return int(self._header['latest'])
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} slots={self.slot_count} latest={self.latest_frame}>'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _slot_buffer(self, slot):
+        offset = self._data_offset + slot * self.slot_capacity
+        return self._shm.buf[offset:offset + self.slot_capacity]
+
+    def publish(self, image: cvimage.Image, colorspace: int = 0) -> int:
+        """
+        Copy a frame into the next slot.
+
+        :param image:      frame to publish, must be uint8
+        :param colorspace: colorspace tag, see :class:`agent.ScreenshotImage`
+        :return: frame number
+        """
+        arr = image.array
+        if arr.dtype != np.uint8:
+            raise TypeError(f'unsupported frame dtype {arr.dtype}')
+        if arr.nbytes > self.slot_capacity:
+            raise ValueError(f'frame of {arr.nbytes} bytes exceeds slot capacity {self.slot_capacity}')
+        frame = self.latest_frame + 1
+        slot = frame % self.slot_count
+        seqs = self._slot_headers['seq']
+        seq = int(seqs[slot])
+        seqs[slot] = seq + 1
+        dest = np.ndarray(arr.shape, dtype=np.uint8, buffer=self._slot_buffer(slot))
+        np.copyto(dest, arr)
+        hdr = self._slot_headers[slot]
+        hdr['frame'] = frame
+        hdr['timestamp'] = image.timestamp if image.timestamp is not None else np.nan
+        hdr['published'] = time.time()
+        hdr['height'] = arr.shape[0]
+        hdr['width'] = arr.shape[1]
+        hdr['channels'] = arr.shape[2] if arr.ndim == 3 else 1
+        hdr['colorspace'] = colorspace
+        hdr['mode'] = image.mode.encode()
+        hdr['dtype'] = arr.dtype.str.encode()
+        seqs[slot] = seq + 2
+        self._header['latest'] = frame
+        return frame
+
+    def read(self, frame: Optional[int] = None) -> Optional[FrameView]:
+        """
+        Get a zero-copy view of a frame.
+
+        :param frame: frame number to read, defaults to the latest one
+        :return: the frame, or `None` if it is not available (not published yet, being written or already overwritten)
+        """
+        if frame is None:
+            frame = self.latest_frame
+        if frame == 0:
+            return None
+        slot = frame % self.slot_count
+        seq = int(self._slot_headers['seq'][slot])
+        if seq & 1:
+            return None
+        hdr = self._slot_headers[slot].copy()
+        if int(hdr['frame']) != frame:
+            return None
+        height, width, channels = int(hdr['height']), int(hdr['width']), int(hdr['channels'])
+        shape = (height, width, channels) if channels != 1 else (height, width)
+        arr = np.ndarray(shape, dtype=np.uint8, buffer=self._slot_buffer(slot))
+        arr.flags.writeable = False
+        if int(self._slot_headers['seq'][slot]) != seq:
+            return None
+        image = cvimage.Image(arr, hdr['mode'].decode())
+        timestamp = float(hdr['timestamp'])
+        if timestamp == timestamp:
+            image.timestamp = timestamp
+        return FrameView(self, slot, seq, frame, image, int(hdr['colorspace']), float(hdr['published']))
+
+    def wait(self, after: int = 0, timeout: Optional[float] = None, poll_interval: float = 0.002) -> Optional[FrameView]:
+        """
+        Wait for a frame newer than `after` and return the latest one.
+
+        :return: the frame, or `None` on timeout
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            if self.latest_frame > after:
+                view = self.read()
+                if view is not None:
+                    return view
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        if self._shm is None:
+            return
+        # drop our views first, SharedMemory refuses to close with exported buffers
+        self._header = None
+        self._slot_headers = None
+        shm = self._shm
+        self._shm = None
+        try:
+            shm.close()
+        except BufferError:
+            logger.debug('frame bus %s still has live views, leaving mapping open', shm.name)
+        if self._owner:
+            shm.unlink()
+            _created_names.discard(shm.name)
@@ -0,0 +1,272 @@
+"""
+Memory-bounded cache for resources and templates.
+
+Unlike ``functools.lru_cache``, entries are accounted by their size in bytes
+(``ndarray.nbytes`` of everything they hold) and evicted by LRU or LFU once
+the configured budget is exceeded. Hot entries can be pinned so they are
+never evicted. Arrays backed by a memory-mapped file (see
+:mod:`resource_bundle`) are counted as free since they don't live on the heap.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Hashable, Literal, Optional
+
+import functools
+import heapq
+import logging
+import mmap
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+
+def _array_bytes(arr: np.ndarray) -> int:
+    base = arr
+    while isinstance(base, np.ndarray) and base.base is not None:
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    if isinstance(base, mmap.mmap):
+        return 0
+    return arr.nbytes
+
+
+def estimate_size(value, _depth=0) -> int:
+    """approximate heap size of a cached value, counting numpy buffers only"""
+    if _depth > 4 or value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return _array_bytes(value)
+    array = getattr(value, 'array', None)
+    if isinstance(array, np.ndarray):
+        return _array_bytes(array)
+    if isinstance(value, dict):
+        return sum(estimate_size(v, _depth + 1) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v, _depth + 1) for v in value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, '__dict__'):
+        return estimate_size(vars(value), _depth + 1)
+    return 0
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    pinned: int = 0
+    current_bytes: int = 0
+    budget_bytes: int = 0
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'hits', 'tick')
+
+    def __init__(self, value, size):
+        self.value = value
+        self.size = size
+        self.hits = 0
+        self.tick = 0
+
+
+class MemoryBoundedCache:
+    def __init__(self, budget_bytes: int, policy: Literal['lru', 'lfu'] = 'lru',
+                 sizeof: Callable[[Any], int] = estimate_size):
+        """
+        :param budget_bytes: total size of unpinned entries to keep
+        :param policy:       'lru' evicts the least recently used entry, 'lfu' the least frequently used one
+        :param sizeof:       function returning the size of a value in bytes
+        """
+        self.budget_bytes = budget_bytes
+        self.sizeof = sizeof
+        # 可淘汰的条目, 按访问顺序排列; 固定的条目单独存放, 淘汰时无需跳过
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._pinned: dict[Hashable, _Entry] = {}
+        self._lock = threading.RLock()
+        self._current_bytes = 0
+        self._unpinned_bytes = 0
+        self._pinned_keys = set()
+        # LFU 候选堆 (hits, tick, key), 条目被访问后旧记录失效, 出堆时跳过
+        self._heap: list[tuple[int, int, Hashable]] = []
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.policy = policy
+
+    @property
+    def policy(self) -> str:
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy: Literal['lru', 'lfu']):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'unknown eviction policy {policy!r}')
+        with self._lock:
+            self._policy = policy
+            self._rebuild_heap()
+
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._pinned
+
+    def _touch(self, key, entry: _Entry):
+        self._tick += 1
+        entry.tick = self._tick
+        if self._policy == 'lfu':
+            heapq.heappush(self._heap, (entry.hits, entry.tick, key))
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        if self._policy == 'lfu':
+            self._heap = [(e.hits, e.tick, k) for k, e in self._entries.items()]
+            heapq.heapify(self._heap)
+        else:
+            self._heap = []
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                self._touch(key, entry)
+            else:
+                entry = self._pinned.get(key)
+                if entry is None:
+                    self.misses += 1
+                    return default
+                entry.hits += 1
+            self.hits += 1
+            return entry.value
+
+    def _remove(self, key) -> Optional[_Entry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unpinned_bytes -= entry.size
+        else:
+            entry = self._pinned.pop(key, None)
+        if entry is not None:
+            self._current_bytes -= entry.size
+        return entry
+
+    def put(self, key, value, pin: bool = False):
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            entry = _Entry(value, size)
+            self._current_bytes += size
+            if pin or key in self._pinned_keys:
+                self._pinned[key] = entry
+            else:
+                self._entries[key] = entry
+                self._unpinned_bytes += size
+                self._touch(key, entry)
+                self._evict()
+
+    def pin(self, key):
+        """keep `key` cached regardless of the budget, also applies if it is loaded later"""
+        with self._lock:
+            self._pinned_keys.add(key)
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unpinned_bytes -= entry.size
+                self._pinned[key] = entry
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned_keys.discard(key)
+            entry = self._pinned.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self._unpinned_bytes += entry.size
+                self._touch(key, entry)
+                self._evict()
+
+    def _pop_victim(self):
+        if self._policy == 'lfu':
+            while self._heap:
+                hits, tick, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                # 频率相同时 tick 较小者即最久未使用
+                if entry is not None and entry.hits == hits and entry.tick == tick:
+                    del self._entries[key]
+                    return key, entry
+            # 堆中记录都已失效, 退回 LRU
+        return self._entries.popitem(last=False)
+
+    def _evict(self):
+        while self._unpinned_bytes > self.budget_bytes and self._entries:
+            key, entry = self._pop_victim()
+            self._unpinned_bytes -= entry.size
+            self._current_bytes -= entry.size
+            self.evictions += 1
+            logger.debug('evicted %r (%d bytes)', key, entry.size)
+
+    def resize(self, budget_bytes: int):
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self._heap = []
+            self._current_bytes = 0
+            self._unpinned_bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                              entries=len(self), pinned=len(self._pinned),
+                              current_bytes=self._current_bytes, budget_bytes=self.budget_bytes)
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def cached(cache: MemoryBoundedCache, namespace: Optional[str] = None):
+    """
+    Decorator caching results of a function in `cache`, like ``functools.lru_cache``.
+
+    List/set/dict arguments are frozen into hashable keys. The wrapped function
+    gets ``pin(*args, **kwargs)`` and ``cache`` attributes.
+    """
+    def decorator(func):
+        prefix = namespace or func.__qualname__
+
+        def make_key(args, kwargs):
+            return (prefix, _freeze(args), _freeze(kwargs))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            value = cache.get(key, _missing)
+            if value is _missing:
+                value = func(*args, **kwargs)
+                cache.put(key, value)
+            return value
+
+        wrapper.pin = lambda *args, **kwargs: cache.pin(make_key(args, kwargs))
+        wrapper.cache = cache
+        return wrapper
+    return decorator
@@ -0,0 +1,247 @@
+"""
+Lightweight latency/throughput metrics for controllers.
+
+Latencies go into log-linear (HDR-style) histograms with ~3% relative precision,
+so recording is an integer bucket increment regardless of the value range.
+Everything is keyed by (device, operation) and can be read in process or
+dumped as text/JSON::
+
+    from src.admin.utils import metrics
+
+    with metrics.timer(serial, 'adb.exec'):
+        ...
+    print(metrics.registry.dump_text())
+"""
+from __future__ import annotations
+from typing import Optional
+
+import json
+import threading
+import time
+
+# 每个 2 的幂区间划分为 32 个子桶, 相对误差约 3%
+_SUB_BITS = 6
+_SUB_COUNT = 1 << _SUB_BITS
+_HALF_COUNT = _SUB_COUNT >> 1
+# 足够覆盖 2^40 微秒（约 12 天）
+_BUCKET_COUNT = _SUB_COUNT + (40 - _SUB_BITS) * _HALF_COUNT
+
+
+def _bucket_index(value: int) -> int:
+    if value < _SUB_COUNT:
+        return value
+    shift = value.bit_length() - _SUB_BITS
+    index = _SUB_COUNT + (shift - 1) * _HALF_COUNT + ((value >> shift) - _HALF_COUNT)
+    return index if index < _BUCKET_COUNT else _BUCKET_COUNT - 1
+
+
+def _bucket_value(index: int) -> int:
+    """representative (midpoint) value of a bucket"""
+    if index < _SUB_COUNT:
+        return index
+    j = index - _SUB_COUNT
+    shift = j // _HALF_COUNT + 1
+    mantissa = j % _HALF_COUNT + _HALF_COUNT
+    return (mantissa << shift) + (1 << (shift - 1))
+
+
+class LatencyHistogram:
+    """latency histogram with microsecond resolution"""
+    __slots__ = ('_lock', '_counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * _BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds: float):
+        us = int(seconds * 1e6)
+        if us < 0:
+            us = 0
+        index = _bucket_index(us)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += us
+            if self.min is None or us < self.min:
+                self.min = us
+            if us > self.max:
+                self.max = us
+
+    def percentile(self, p: float) -> float:
+        """value at percentile `p` (0-100) in seconds"""
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            target = max(1, round(self.count * p / 100))
+            seen = 0
+            for index, n in enumerate(self._counts):
+                seen += n
+                if seen >= target:
+                    return min(_bucket_value(index), self.max) / 1e6
+        return self.max / 1e6
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * _BUCKET_COUNT
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+
+    def snapshot(self) -> dict:
+        count = self.count
+        return {
+            'count': count,
+            'mean': self.total / count / 1e6 if count else 0.0,
+            'min': (self.min or 0) / 1e6,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max / 1e6,
+        }
+
+
+class Counter:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def add(self, n: int = 1):
+        with self._lock:
+            self.value += n
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_errors', '_t0')
+
+    def __init__(self, histogram: LatencyHistogram, errors: Counter):
+        self._histogram = histogram
+        self._errors = errors
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.record(time.perf_counter() - self._t0)
+        if exc_type is not None:
+            self._errors.add()
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class MetricsRegistry:
+    """holds histograms and counters keyed by (device, operation)"""
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple[str, str], LatencyHistogram] = {}
+        self._counters: dict[tuple[str, str], Counter] = {}
+        # (device, op) -> (耗时直方图, 错误计数), timer() 的热路径只查一次字典
+        self._timers: dict[tuple, tuple[LatencyHistogram, Counter]] = {}
+        self._started = time.time()
+
+    def histogram(self, device, op: str) -> LatencyHistogram:
+        key = (str(device), op)
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, LatencyHistogram())
+        return hist
+
+    def counter(self, device, op: str) -> Counter:
+        key = (str(device), op)
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, Counter())
+        return counter
+
+    def record(self, device, op: str, seconds: float):
+        if self.enabled:
+            self.histogram(device, op).record(seconds)
+
+    def count(self, device, op: str, n: int = 1):
+        if self.enabled:
+            self.counter(device, op).add(n)
+
+    def timer(self, device, op: str):
+        """context manager recording elapsed time into `op`, exceptions also count into `op.errors`"""
+        if not self.enabled:
+            return _null_timer
+        targets = self._timers.get((device, op))
+        if targets is None:
+            targets = (self.histogram(device, op), self.counter(device, op + '.errors'))
+            self._timers[(device, op)] = targets
+        return _Timer(*targets)
+
+    def reset(self):
+        with self._lock:
+            for hist in self._histograms.values():
+                hist.reset()
+            for counter in self._counters.values():
+                counter.reset()
+            self._started = time.time()
+
+    def snapshot(self, device: Optional[str] = None) -> dict:
+        """
+        Collect current values.
+
+        :param device: only include this device
+        :return: ``{device: {'latency': {op: {...}}, 'counters': {op: value}}}``
+        """
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+        result = {}
+        for (dev, op), hist in histograms:
+            if device is None or dev == device:
+                result.setdefault(dev, {'latency': {}, 'counters': {}})['latency'][op] = hist.snapshot()
+        for (dev, op), counter in counters:
+            if device is None or dev == device:
+                result.setdefault(dev, {'latency': {}, 'counters': {}})['counters'][op] = counter.value
+        return result
+
+    def dump_json(self, device: Optional[str] = None, **kwargs) -> str:
+        return json.dumps({'since': self._started, 'devices': self.snapshot(device)}, **kwargs)
+
+    def dump_text(self, device: Optional[str] = None) -> str:
+        lines = []
+        for dev, data in sorted(self.snapshot(device).items()):
+            lines.append(f'[{dev}]')
+            for op, h in sorted(data['latency'].items()):
+                lines.append(f'  {op:<28} n={h["count"]:<8} mean={h["mean"]*1000:9.3f}ms p50={h["p50"]*1000:9.3f}ms '
+                             f'p90={h["p90"]*1000:9.3f}ms p99={h["p99"]*1000:9.3f}ms max={h["max"]*1000:9.3f}ms')
+            for op, value in sorted(data['counters'].items()):
+                lines.append(f'  {op:<28} {value}')
+        return '\n'.join(lines)
+
+
+registry = MetricsRegistry()
+
+record = registry.record
+count = registry.count
+timer = registry.timer
@@ -0,0 +1,148 @@
+"""
+Versioned, array-native container for recognition models.
+
+Replaces pickled models: loading runs no code, only plain numeric dtypes are
+accepted, and arrays are read-only views into an ``mmap``-ed file, so cold
+start does not copy model data and worker processes share the pages.
+
+The file uses the layout of :mod:`array_file` with magic ``'AXMD'``. The header holds the model ``kind``, free-form JSON ``meta`` and an
+``arrays`` table of ``{name: {offset, shape, dtype}}``.
+
+Convert a pickled model with ``python -m src.admin.utils.model_file <pickle> <output> [--kind minireco]``.
+"""
+from __future__ import annotations
+from typing import Optional, Union
+
+import logging
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .array_file import ArrayFileWriter, array_view, close_buffer, read_header
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AXMD'
+VERSION = 1
+SUFFIX = '.axm'
+
+
+def _check_dtype(dtype: np.dtype):
+    # 只允许数值类型, 拒绝 object 等需要反序列化的类型
+    if dtype.kind not in 'biufc' or dtype.hasobject:
+        raise TypeError(f'unsupported dtype {dtype}')
+
+
+def save_model(path: Union[str, os.PathLike], arrays: dict[str, np.ndarray], meta: Optional[dict] = None,
+               kind: Optional[str] = None):
+    """
+    Write a model file.
+
+    :param arrays: named numeric arrays
+    :param meta:   JSON-serializable metadata
+    :param kind:   model type tag checked by loaders, e.g. ``'minireco'``
+    """
+    writer = ArrayFileWriter()
+    table = {}
+    for name, arr in arrays.items():
+        arr = np.asarray(arr)
+        _check_dtype(arr.dtype)
+        table[name] = writer.add_array(arr)
+    writer.write(path, MAGIC, VERSION, {'kind': kind, 'meta': meta or {}, 'arrays': table})
+
+
+class ModelFile:
+    """
+    Read-only model, arrays are zero-copy views into `buffer`.
+
+    :param buffer: an ``mmap`` or bytes-like object holding the whole file
+    """
+
+    def __init__(self, buffer, name: str = '<buffer>'):
+        self.name = name
+        self._buffer = buffer
+        try:
+            version, header, data_start = read_header(buffer, MAGIC)
+        except ValueError:
+            raise ValueError(f'{name} is not a model file') from None
+        if version != VERSION:
+            raise ValueError(f'{name} has unsupported model file version {version}')
+        self.kind: Optional[str] = header['kind']
+        self.meta: dict = header['meta']
+        self.arrays: dict[str, np.ndarray] = {}
+        for key, desc in header['arrays'].items():
+            dtype = np.dtype(desc['dtype'])
+            _check_dtype(dtype)
+            try:
+                self.arrays[key] = array_view(buffer, data_start, desc, dtype)
+            except ValueError:
+                raise ValueError(f'{name}: array {key!r} is truncated') from None
+
+    @classmethod
+    def open(cls, path: Union[str, os.PathLike]) -> ModelFile:
+        """memory-map a model file"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(buffer, str(path))
+        except:
+            buffer.close()
+            raise
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} kind={self.kind} arrays={list(self.arrays)}>'
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self.arrays[key]
+
+    def __contains__(self, key):
+        return key in self.arrays
+
+    def close(self):
+        self.arrays = {}
+        close_buffer(self._buffer)
+
+
+def convert_pickle(source: Union[str, os.PathLike], output: Union[str, os.PathLike], kind: Optional[str] = None):
+    """
+    Convert a pickled model. Only run this on trusted pickles.
+
+    With ``kind='minireco'`` the ``data`` list of (char, template) is packed by
+    :func:`resources.pack_minireco_model`. Otherwise the pickle must be a dict:
+    numpy values become arrays and everything else goes to the JSON metadata.
+    """
+    import pickle
+    with open(source, 'rb') as f:
+        obj = pickle.load(f)
+    if kind is None and isinstance(obj, dict) and 'data' in obj and 'chars' in obj:
+        kind = 'minireco'
+    if kind == 'minireco':
+        from .resources import pack_minireco_model
+        packed = pack_minireco_model(obj['data'])
+        save_model(output, {'matrix': packed['matrix']}, {'chars': packed['chars'], 'size': list(packed['size'])},
+                   kind)
+    else:
+        if not isinstance(obj, dict):
+            raise TypeError(f'cannot convert pickled {type(obj).__name__}, expected dict')
+        arrays = {k: v for k, v in obj.items() if isinstance(v, np.ndarray)}
+        meta = {k: v for k, v in obj.items() if not isinstance(v, np.ndarray)}
+        save_model(output, arrays, meta, kind)
+    logger.info('converted %s to %s (kind=%s)', source, output, kind)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='convert a pickled recognition model to the array-native model format')
+    parser.add_argument('source', help='pickled model')
+    parser.add_argument('output', nargs='?', help=f'model file to write, defaults to source with {SUFFIX} suffix')
+    parser.add_argument('--kind', help='model type, e.g. minireco (detected if omitted)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    output = args.output or str(Path(args.source).with_suffix(SUFFIX))
+    convert_pickle(args.source, output, args.kind)
+
+
+if __name__ == '__main__':
+    main()
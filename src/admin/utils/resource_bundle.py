@@ -0,0 +1,159 @@
+"""
+Precompiled, memory-mapped bundle of image recognition resources.
+
+The build step walks ``resources/imgreco``, decodes every PNG once and stores
+the raw pixel arrays (plus mode-converted templates and alpha masks for
+images with a ``.roi.json``) back to back in one flat file with a JSON offset
+index. At runtime the bundle is ``mmap``-ed and every lookup is a zero-copy,
+read-only numpy view, so cold start does not pay for PNG decoding.
+
+The file uses the layout of :mod:`array_file` with magic ``'AXRB'`` and the
+index as header.
+
+Build with ``python -m src.admin.utils.resource_bundle <imgreco dir> <output>``.
+"""
+from __future__ import annotations
+from typing import Optional, Union
+
+import json
+import logging
+import mmap
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from . import cvimage
+from .array_file import ArrayFileWriter, array_view, close_buffer, read_header
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AXRB'
+# 2: 所有带 alpha 的 PNG 都保存掩码
+VERSION = 2
+
+# load_roi 默认使用的模板格式
+ROI_TEMPLATE_MODES = ('RGB',)
+
+
+class _BundleWriter(ArrayFileWriter):
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+
+    def add_array(self, arr: np.ndarray, mode: Optional[str] = None) -> dict:
+        desc = super().add_array(arr)
+        desc['mode'] = mode
+        return desc
+
+    def write(self, output: Union[str, Path]):
+        super().write(output, MAGIC, VERSION, {'entries': self.entries})
+
+
+def build_bundle(root: Union[str, Path], output: Union[str, Path]) -> int:
+    """
+    Compile an ``imgreco`` resource directory into a bundle file.
+
+    :param root:   the ``imgreco`` directory
+    :param output: bundle file to write
+    :return: number of entries written
+    """
+    root = Path(root)
+    writer = _BundleWriter()
+    for dirpath, _, files in os.walk(root):
+        for filename in sorted(files):
+            path = Path(dirpath, filename)
+            respath = path.relative_to(root).as_posix()
+            if filename.endswith('.png'):
+                raw = cvimage.imread(path, cv2.IMREAD_UNCHANGED)
+                entry = {'variants': {'raw': writer.add_array(raw.array, raw.mode)}}
+                if os.path.exists(path.with_name(filename[:-len('.png')] + '.roi.json')):
+                    for mode in ROI_TEMPLATE_MODES:
+                        converted = raw.convert(mode)
+                        entry['variants'][mode] = writer.add_array(converted.array, converted.mode)
+                # 与 load_roi 从文件读取时一致: 所有带 alpha 的图像都有掩码
+                if raw.mode.endswith('A'):
+                    entry['mask'] = writer.add_array(raw.array[..., -1], 'L')
+                writer.entries[respath] = entry
+            elif filename.endswith('.roi.json'):
+                with open(path, encoding='utf-8') as f:
+                    writer.entries[respath] = {'json': json.load(f)}
+    writer.write(output)
+    logger.info('compiled %d resources into %s (%d bytes of arrays)', len(writer.entries), output, writer.size)
+    return len(writer.entries)
+
+
+class ResourceBundle:
+    """read-only view of a compiled bundle"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            version, index, self._data_start = read_header(self._mmap, MAGIC)
+        except ValueError:
+            version = None
+        if version != VERSION:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a resource bundle (version {VERSION})')
+        self.entries: dict = index['entries']
+
+    def __contains__(self, respath):
+        return respath in self.entries
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path} entries={len(self.entries)}>'
+
+    def _view(self, desc: dict) -> np.ndarray:
+        return array_view(self._mmap, self._data_start, desc)
+
+    def get_image(self, respath: str, mode: Optional[str] = None) -> Optional[cvimage.Image]:
+        """
+        Get an image as a zero-copy view.
+
+        :param mode: requested mode, converted on the fly if the bundle has no precompiled variant
+        :return: the image, or `None` if it is not in the bundle
+        """
+        entry = self.entries.get(respath)
+        if entry is None or 'variants' not in entry:
+            return None
+        variants = entry['variants']
+        desc = variants.get(mode) if mode is not None else None
+        if desc is None:
+            desc = variants['raw']
+        image = cvimage.Image(self._view(desc), desc['mode'])
+        if mode is not None and image.mode != mode:
+            image = image.convert(mode)
+        return image
+
+    def get_mask(self, respath: str) -> Optional[cvimage.Image]:
+        entry = self.entries.get(respath)
+        if entry is None or 'mask' not in entry:
+            return None
+        return cvimage.Image(self._view(entry['mask']), 'L')
+
+    def get_json(self, respath: str):
+        entry = self.entries.get(respath)
+        if entry is None or 'json' not in entry:
+            return None
+        return entry['json']
+
+    def close(self):
+        self.entries = {}
+        close_buffer(self._mmap)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='compile imgreco resources into a memory-mappable bundle')
+    parser.add_argument('root', help='imgreco resource directory')
+    parser.add_argument('output', help='bundle file to write')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    build_bundle(args.root, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,70 @@
 from __future__ import annotations
 import os
 import pickle
-from functools import lru_cache
 import json
+import logging
+import threading
 from typing import TYPE_CHECKING
 import cv2
 import numpy as np
 from util import cvimage as Image
+from . import tracing
+from .memcache import MemoryBoundedCache, cached
+from .model_file import ModelFile, SUFFIX as MODEL_SUFFIX
+
+logger = logging.getLogger(__name__)
 
-import app
 
 class ResourceArchiveIndex:
-    def __init__(self, archive, archive_path):
+    def __init__(self, archive, archive_path, respath=None):
         self.archive = archive
         self.archive_path = archive_path
+        self.respath = respath
     def open(self):
         return self.archive.open(self.archive_path, 'r')
     def __hash__(self):
         return hash((ResourceArchiveIndex, self.archive, self.archive_path))
+    def __eq__(self, other):
+        return isinstance(other, ResourceArchiveIndex) and (self.archive, self.archive_path) == (other.archive, other.archive_path)
 
 class FileSystemIndex:
-    def __init__(self, path):
+    def __init__(self, path, respath=None):
         self.path = path
+        self.respath = respath
     def open(self):
         return open(self.path, 'rb')
     def __hash__(self):
         return hash((FileSystemIndex, self.path))
+    def __eq__(self, other):
+        return isinstance(other, FileSystemIndex) and self.path == other.path
 
-if app.use_archived_resources:
-    import zipfile
+class _ArchiveBackend:
     root = 'resources/imgreco'
-    archive = zipfile.ZipFile(open(app.resource_archive, 'rb'), 'r')
 
-    filelist = archive.namelist()
+    def __init__(self, archive_path):
+        import zipfile
+        self.archive = zipfile.ZipFile(open(archive_path, 'rb'), 'r')
+        self.filelist = self.archive.namelist()
 
-    def get_path(names):
-        return '/'.join([root, *names])
+    def get_path(self, names):
+        return '/'.join([self.root, *names])
 
-    def _open_file(path):
-        return archive.open(path)
+    def open_file(self, path):
+        return self.archive.open(path)
 
-    def _get_index(names):
-        archive_path = get_path(names)
+    def get_index(self, names):
+        archive_path = self.get_path(names)
         try:
-            info = archive.getinfo(archive_path)
-            return ResourceArchiveIndex(archive, info.filename)
+            info = self.archive.getinfo(archive_path)
+            return ResourceArchiveIndex(self.archive, info.filename, '/'.join(names))
         except KeyError:
             return None
 
-    def get_entries(base):
+    def get_entries(self, base):
         prefix = 'resources/imgreco/' + base + '/'
         dirs = []
         files = []
-        for name in filelist:
+        for name in self.filelist:
             if name.startswith(prefix):
                 name = name[len(prefix):]
                 if len(name) == 0:
@@ -64,30 +76,101 @@ if app.use_archived_resources:
                 else:
                     files.append(name)
         return dirs, files
-else:
-    root = app.resource_root.joinpath('imgreco')
 
-    def get_path(names):
-        return root.joinpath(*names)
 
-    def _get_index(names):
-        path = get_path(names)
-        fspath = root.joinpath(path)
+class _FileSystemBackend:
+    def __init__(self, root):
+        self.root = root
+
+    def get_path(self, names):
+        return self.root.joinpath(*names)
+
+    def open_file(self, path):
+        return open(path, 'rb')
+
+    def get_index(self, names):
+        path = self.get_path(names)
+        fspath = self.root.joinpath(path)
         if os.path.exists(fspath):
-            return FileSystemIndex(fspath)
+            return FileSystemIndex(fspath, '/'.join(names))
         else:
             return None
 
-    def _open_file(path):
-        return open(path, 'rb')
-
-    def get_entries(base):
-        findroot = get_path(base.split('/'))
+    def get_entries(self, base):
+        findroot = self.get_path(base.split('/'))
         for _, dirs, files in os.walk(findroot):
             return (dirs, files)
         return ([], [])
 
 
+# 资源缓存, 按 ndarray 占用字节数计算, 超出预算后按 LRU 淘汰
+cache = MemoryBoundedCache(256 * 1024 * 1024)
+
+# 预编译资源包, 存在时优先从中读取已解码的模板
+bundle = None
+
+# 资源后端在第一次访问资源时才初始化, 避免导入本模块时就打开资源压缩包
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _get_backend():
+    global _backend, bundle
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            import app
+            if budget := getattr(app, 'resource_cache_budget', None):
+                cache.resize(budget)
+            if (bundle_path := getattr(app, 'resource_bundle', None)) and os.path.exists(bundle_path):
+                from .resource_bundle import ResourceBundle
+                try:
+                    bundle = ResourceBundle(bundle_path)
+                except ValueError:
+                    logger.warning('ignoring outdated resource bundle %s, rebuild it with resource_bundle', bundle_path)
+            if app.use_archived_resources:
+                _backend = _ArchiveBackend(app.resource_archive)
+            else:
+                _backend = _FileSystemBackend(app.resource_root.joinpath('imgreco'))
+    return _backend
+
+
+def _get_bundle():
+    _get_backend()
+    return bundle
+
+
+def get_path(names):
+    return _get_backend().get_path(names)
+
+
+def _open_file(path):
+    return _get_backend().open_file(path)
+
+
+def _get_index(names):
+    return _get_backend().get_index(names)
+
+
+def get_entries(base):
+    return _get_backend().get_entries(base)
+
+
+def configure_cache(budget_bytes=None, policy=None):
+    """change memory budget (bytes) and/or eviction policy ('lru' or 'lfu') of the resource cache"""
+    if policy is not None:
+        cache.policy = policy
+    if budget_bytes is not None:
+        cache.resize(budget_bytes)
+
+
+def _bundle_key(name):
+    if isinstance(name, str):
+        return name
+    return getattr(name, 'respath', None)
+
+
 def resolve(respath):
     names = respath.split('/')
     return _get_index(names)
@@ -99,7 +182,13 @@ def open_file(respath):
     return resolve(respath).open()
 
 
+@tracing.traced('resources.load_image')
 def load_image(name, mode=None, imread_flags=None) -> Image.Image:
+    res_bundle = _get_bundle()
+    if res_bundle is not None and imread_flags in (None, cv2.IMREAD_UNCHANGED):
+        im = res_bundle.get_image(_bundle_key(name), mode)
+        if im is not None:
+            return im
     if imread_flags is None:
         im = Image.open(open_file(name))
         if mode is not None and im.mode != mode:
@@ -109,7 +198,7 @@ def load_image(name, mode=None, imread_flags=None) -> Image.Image:
     return im
 
 
-@lru_cache(maxsize=None)
+@cached(cache)
 def load_image_cached(name, mode=None, imread_flags=None):
     return load_image(name, mode, imread_flags)
 
@@ -118,29 +207,102 @@ def load_image_as_ndarray(name):
     return np.asarray(load_image(name))
 
 
+@tracing.traced('resources.load_pickle')
 def load_pickle(name):
     with open_file(name) as f:
         result = pickle.load(f)
     return result
 
 
+def pack_minireco_model(data) -> dict:
+    """
+    Stack (char, template) pairs into one contiguous float32 matrix.
+
+    Each row is a template resized to the size of the first one, flattened,
+    zero-mean and unit-norm, so that ``glyphs @ matrix.T`` gives the
+    correlation coefficient of every glyph against every template.
+
+    :return: dict of ``chars`` (list of str), ``size`` ((width, height)) and ``matrix`` ((N, width*height) float32)
+    """
+    if not data:
+        raise ValueError('empty minireco model')
+    height, width = np.asarray(data[0][1]).shape[:2]
+    matrix = np.empty((len(data), width * height), dtype=np.float32)
+    for row, (_, template) in zip(matrix, data):
+        template = np.asarray(template)
+        if template.ndim == 3:
+            template = template[..., 0]
+        if template.shape != (height, width):
+            template = cv2.resize(template, (width, height), interpolation=cv2.INTER_AREA)
+        row[:] = template.ravel()
+    matrix -= matrix.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norm > 0, norm, 1)
+    return {'chars': [x[0] for x in data], 'size': (width, height), 'matrix': matrix}
+
+
+@tracing.traced('resources.load_model')
+def load_model(name) -> ModelFile:
+    """load a model file, memory-mapped when resources are not archived"""
+    index = resolve(name) if isinstance(name, str) else name
+    if index is None:
+        raise FileNotFoundError(name)
+    if isinstance(index, FileSystemIndex):
+        return ModelFile.open(index.path)
+    with index.open() as f:
+        return ModelFile(f.read(), index.respath)
+
+
+@cached(cache)
 def load_minireco_model(name, filter_chars=None):
+    """
+    Load a minireco model packed as by :func:`pack_minireco_model`.
+
+    A model file with the same base name and ``.axm`` suffix is preferred over the pickle.
+    """
+    model_name = os.path.splitext(name)[0] + MODEL_SUFFIX
+    if resolve(model_name) is not None:
+        model = load_model(model_name)
+        if model.kind != 'minireco':
+            raise ValueError(f'{model_name} is a {model.kind} model, not minireco')
+        chars = model.meta['chars']
+        matrix = model['matrix']
+        if filter_chars is not None:
+            rows = [i for i, c in enumerate(chars) if c in filter_chars]
+            if not rows:
+                raise ValueError(f'no chars of {filter_chars!r} in {name}')
+            chars = [chars[i] for i in rows]
+            matrix = matrix[rows]
+        return {'chars': chars, 'size': tuple(model.meta['size']), 'matrix': matrix}
+    # 旧版 pickle 模型, 可用 model_file 转换
     model = load_pickle(name)
+    data = model['data']
     if filter_chars is not None:
-        model['data'] = [x for x in model['data'] if x[0] in filter_chars]
-        model['chars'] = [x[0] for x in model['data']]
-    return model
+        data = [x for x in data if x[0] in filter_chars]
+        if not data:
+            raise ValueError(f'no chars of {filter_chars!r} in {name}')
+    return pack_minireco_model(data)
 
 
 if TYPE_CHECKING:
     from .common import RegionOfInterest as RegionOfInterest_ghost
 
+@cached(cache)
+@tracing.traced('resources.load_roi')
 def load_roi(basename, image_mode='RGB', metafile=None, imgfile=None) -> RegionOfInterest_ghost:
     from .common import RegionOfInterest
     if metafile is None:
         metafile = basename + '.roi.json'
     if imgfile is None:
         imgfile = basename + '.png'
+    res_bundle = _get_bundle()
+    if res_bundle is not None and imgfile in res_bundle:
+        img = res_bundle.get_image(imgfile, image_mode)
+        mask = res_bundle.get_mask(imgfile)
+        meta = res_bundle.get_json(metafile) or {}
+        bbox_matrix = np.asmatrix(meta['bbox_matrix']) if 'bbox_matrix' in meta else None
+        native_resolution = tuple(meta['native_resolution']) if 'native_resolution' in meta else None
+        return RegionOfInterest(name=basename, template=img, mask=mask, bbox_matrix=bbox_matrix, native_resolution=native_resolution)
     imgfileindex = resolve(imgfile)
     raw_img = load_image_cached(imgfileindex, imread_flags=cv2.IMREAD_UNCHANGED) if imgfileindex is not None else None
     mask = None
@@ -0,0 +1,316 @@
+"""
+Tracing spans and a sampling profiler for automation steps.
+
+Spans record nested wall-clock timings and are written as Chrome trace-event
+JSON (open with chrome://tracing or https://ui.perfetto.dev)::
+
+    from src.admin.utils import tracing
+
+    tracing.tracer.start('trace/aah.json')
+
+    with tracing.span('recognize', scene='main'):
+        ...
+
+    @tracing.traced('input.tap')
+    def touch_tap(...):
+        ...
+
+Tracing is off until :meth:`Tracer.start` is called, a disabled span costs a
+flag check.
+"""
+from __future__ import annotations
+from typing import Callable, Optional, Union
+
+import atexit
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_pid = os.getpid()
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+class RotatingTraceWriter:
+    """
+    Appends trace events to a JSON array file, rotating it when it grows too large.
+
+    Files are left without the closing bracket while being written, which the
+    Chrome trace viewer accepts.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 64 * 1024 * 1024, backup_count: int = 3):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._fp = None
+        self._size = 0
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = open(self.path, 'w', encoding='utf-8')
+        self._fp.write('[\n')
+        self._size = 2
+
+    def _rotate(self):
+        self.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self.path.with_name(f'{self.path.name}.{i}')
+            if src.exists():
+                os.replace(src, self.path.with_name(f'{self.path.name}.{i + 1}'))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path.with_name(f'{self.path.name}.1'))
+
+    def write(self, events: list[dict]):
+        if not events:
+            return
+        if self._fp is None:
+            self._open()
+        text = ''.join(json.dumps(e, separators=(',', ':')) + ',\n' for e in events)
+        self._fp.write(text)
+        self._fp.flush()
+        self._size += len(text)
+        if self._size >= self.max_bytes:
+            self._rotate()
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.write('{}]\n')
+            self._fp.close()
+            self._fp = None
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self._writer: Optional[RotatingTraceWriter] = None
+        self._events = []
+        # _lock 只保护事件缓冲, 文件写入由 _write_lock 串行化, 其他线程记录事件时不会等待磁盘 I/O
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self.flush_threshold = 1024
+
+    def start(self, path: Union[str, Path], max_bytes: int = 64 * 1024 * 1024, backup_count: int = 3):
+        """start recording spans into `path`"""
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+            self._writer = RotatingTraceWriter(path, max_bytes, backup_count)
+            self.enabled = True
+        logger.debug('tracing to %s', path)
+
+    def stop(self):
+        self.enabled = False
+        self.flush()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.write(events)
+
+    def emit(self, event: dict):
+        with self._lock:
+            self._events.append(event)
+            if len(self._events) < self.flush_threshold:
+                return
+        self.flush()
+
+    @property
+    def current_stack(self) -> list[str]:
+        """names of the spans currently open in this thread"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def set_thread_name(self, name: str):
+        """label the calling thread in the trace viewer"""
+        self.emit({'name': 'thread_name', 'ph': 'M', 'pid': _pid, 'tid': threading.get_ident(),
+                   'args': {'name': name}})
+
+
+tracer = Tracer()
+
+
+class _Span:
+    __slots__ = ('name', 'cat', 'args', '_ts')
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        tracer.current_stack.append(self.name)
+        self._ts = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = _now_us()
+        tracer.current_stack.pop()
+        event = {'name': self.name, 'cat': self.cat, 'ph': 'X', 'ts': self._ts, 'dur': end - self._ts,
+                 'pid': _pid, 'tid': threading.get_ident()}
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        if self.args:
+            event['args'] = self.args
+        tracer.emit(event)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(name: str, cat: str = 'aah', **args):
+    """
+    Context manager timing a block as a trace span.
+
+    :param name: span name shown in the viewer
+    :param cat:  trace category
+    :param args: extra values attached to the span
+    """
+    if not tracer.enabled:
+        return _null_span
+    return _Span(name, cat, args)
+
+
+def traced(name: Optional[str] = None, cat: str = 'aah'):
+    """decorator wrapping every call of the function in a span"""
+    def decorator(func: Callable):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with _Span(span_name, cat, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@atexit.register
+def _flush_at_exit():
+    if tracer.enabled:
+        tracer.stop()
+
+
+_workers: dict[str, int] = {}
+
+
+def register_worker(device, thread: Optional[threading.Thread] = None):
+    """
+    Remember which thread drives a device, so it can be profiled by device name.
+
+    :param device: device identifier
+    :param thread: worker thread, defaults to the calling thread
+    """
+    ident = thread.ident if thread is not None else threading.get_ident()
+    _workers[str(device)] = ident
+    tracer.set_thread_name(f'worker {device}')
+
+
+def unregister_worker(device, thread: Optional[threading.Thread] = None):
+    """forget the worker thread of `device` if it is still the registered one"""
+    ident = thread.ident if thread is not None else threading.get_ident()
+    if _workers.get(str(device)) == ident:
+        del _workers[str(device)]
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the Python stack of one thread at a fixed interval.
+
+    Results are kept as collapsed stacks (``frame;frame;frame count``, the
+    input format of flamegraph.pl / speedscope) and every sample is also
+    emitted as an instant event when tracing is enabled.
+    """
+
+    def __init__(self, target_ident: int, duration: float, interval: float = 0.005,
+                 output: Optional[Union[str, Path]] = None):
+        super().__init__(name=f'sampling-profiler-{target_ident}', daemon=True)
+        self.target_ident = target_ident
+        self.duration = duration
+        self.interval = interval
+        self.output = output
+        self.stacks = Counter()
+        self.samples = 0
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.target_ident)
+        if frame is None:
+            return False
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        names.reverse()
+        self.stacks[';'.join(names)] += 1
+        self.samples += 1
+        if tracer.enabled:
+            tracer.emit({'name': names[-1], 'cat': 'sample', 'ph': 'i', 's': 't', 'ts': _now_us(), 'pid': _pid,
+                         'tid': self.target_ident})
+        return True
+
+    def run(self):
+        deadline = time.perf_counter() + self.duration
+        while time.perf_counter() < deadline:
+            if not self._sample():
+                logger.debug('profiled thread %d exited', self.target_ident)
+                break
+            time.sleep(self.interval)
+        if self.output is not None:
+            self.write_collapsed(self.output)
+        logger.debug('sampling profiler collected %d samples from thread %d', self.samples, self.target_ident)
+
+    def write_collapsed(self, path: Union[str, Path]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f'{stack} {n}\n')
+
+
+def profile_device(device, seconds: float, interval: float = 0.005,
+                   output: Optional[Union[str, Path]] = None) -> SamplingProfiler:
+    """
+    Attach a sampling profiler to the worker thread of `device` for `seconds`.
+
+    :return: the running profiler, `join()` it to wait for the result
+    """
+    ident = _workers.get(str(device))
+    if ident is None:
+        raise KeyError(f'no worker registered for {device}')
+    profiler = SamplingProfiler(ident, seconds, interval, output)
+    profiler.start()
+    return profiler
@@ -0,0 +1,43 @@
+"""
+Import-time budget of the device layer.
+
+Worker processes import ``adb_controller`` on start, so it must not pull in
+cv2, scipy, lz4 or PIL, and the whole import has to stay well under a second.
+Each check runs in a fresh interpreter so modules already imported by the
+test runner don't hide the cost.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULE = 'src.admin.adb.adb_controller'
+# 秒, 冷启动的累计导入时间
+BUDGET = 0.5
+HEAVY_MODULES = ('cv2', 'scipy', 'lz4', 'PIL', 'src.admin.utils.cvimage')
+
+
+def _run(code, *args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = str(ROOT)
+    return subprocess.run([sys.executable, *args, '-c', code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def test_no_heavy_imports():
+    proc = _run(f'import sys, {MODULE}; print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])')
+    assert proc.stdout.split() == []
+
+
+def test_import_time_budget():
+    proc = _run(f'import {MODULE}', '-X', 'importtime')
+    # 每行格式: "import time: self [us] | cumulative | imported package"
+    for line in proc.stderr.splitlines():
+        _, _, fields = line.partition('import time:')
+        parts = [x.strip() for x in fields.split('|')]
+        if len(parts) == 3 and parts[2] == MODULE:
+            assert int(parts[1]) / 1e6 < BUDGET
+            break
+    else:
+        raise AssertionError(f'{MODULE} not found in -X importtime output')